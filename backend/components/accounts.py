@@ -92,8 +92,9 @@ class Accounts:
         query_result = self._connection.query(
             """
             SELECT password_hash, user_id FROM users
-            WHERE username="{}";
-            """.format(username)
+            WHERE username=%s;
+            """,
+            (username,)
         )
 
         if (len(query_result) == 0) or (query_result[0][0] != entered_password):
@@ -122,36 +123,36 @@ class Accounts:
 
         Returns an integer, which is the user id of the new user.
         """
-        query_result = self._connection.query(
-            """
-            SELECT username FROM users
-            WHERE username="{}"
-            """.format(username)
-        )
+        password_hash = self.hash_password(password)  # Password must be hashed before storing in the database. Done
+        # before the transaction, as it is slow, and does not need the database.
 
-        if len(query_result):
-            raise UserExistsError(username)
-        else:
-            self._connection.query(
+        with self._connection.transaction():  # The user should not be created without their lists
+            query_result = self._connection.query(
                 """
-                INSERT INTO users (first_name, surname, username, password_hash)
-                VALUES ("{first_name}", "{surname}", "{username}", "{password}");
-                """.format(
-                    first_name=first_name,
-                    surname=surname,
-                    username=username,
-                    password=self.hash_password(password)  # Password must be hashed before
-                    # storing in the database.
-                )
+                SELECT username FROM users
+                WHERE username=%s
+                """,
+                (username,)
             )
 
-            user_id = self.get_user_id(username)
+            if len(query_result):
+                raise UserExistsError(username)
+            else:
+                self._connection.query(
+                    """
+                    INSERT INTO users (first_name, surname, username, password_hash)
+                    VALUES (%s, %s, %s, %s);
+                    """,
+                    (first_name, surname, username, password_hash)
+                )
+
+                user_id = self.get_user_id(username)
 
-            self._reading_lists.create_list(user_id, "Want to Read")
-            self._reading_lists.create_list(user_id, "Currently Reading")
-            self._reading_lists.create_list(user_id, "Have Read")
+                self._reading_lists.create_list(user_id, "Want to Read")
+                self._reading_lists.create_list(user_id, "Currently Reading")
+                self._reading_lists.create_list(user_id, "Have Read")
 
-            return user_id
+                return user_id
 
     def get_user_id(self, username):
         """
@@ -165,8 +166,9 @@ class Accounts:
         query_result = self._connection.query(
             """
             SELECT user_id FROM users
-            WHERE username="{}";
-            """.format(username)
+            WHERE username=%s;
+            """,
+            (username,)
         )
 
         return query_result[0][0]
@@ -206,8 +208,9 @@ class Sessions:
 
         self._connection.query(
             """
-            INSERT INTO sessions (client_id, user_id) VALUES ("{token}", {user_id});
-            """.format(token=token, user_id=user_id)
+            INSERT INTO sessions (client_id, user_id) VALUES (%s, %s);
+            """,
+            (token, user_id)
         )
 
         return token
@@ -227,8 +230,9 @@ class Sessions:
             UPDATE sessions
             SET
                 date_added=NOW()
-            WHERE client_id="{}";
-            """.format(session_id)
+            WHERE client_id=%s;
+            """,
+            (session_id,)
         )
 
     def get_user_id(self, session_id):
@@ -247,8 +251,9 @@ class Sessions:
         res = self._connection.query(
             """
             SELECT user_id, date_added FROM sessions
-            WHERE client_id="{}";
-            """.format(session_id)
+            WHERE client_id=%s;
+            """,
+            (session_id,)
         )
         if len(res) == 0:
             raise SessionExpiredError(session_id)  # If there is no entries
@@ -283,8 +288,9 @@ class Sessions:
         self._connection.query(
             """
             DELETE FROM sessions
-            WHERE client_id="{}";
-            """.format(session_id)
+            WHERE client_id=%s;
+            """,
+            (session_id,)
         )
     
     def get_session_id_list(self):
@@ -28,27 +28,27 @@ class Authors:
         try:
             self._connection.query("""
                 INSERT INTO author_followers (user_id, author_id)
-                VALUES ({user_id}, {author_id});
-            """.format(user_id=user_id, author_id=author_id))
+                VALUES (%s, %s);
+            """, (user_id, author_id))
         except mysql.connector.errors.IntegrityError:
             pass
 
     def unfollow(self, user_id, author_id):
         self._connection.query("""
             DELETE FROM author_followers
-            WHERE user_id={user_id}
-                AND author_id={author_id};
-        """.format(user_id=user_id, author_id=author_id))
+            WHERE user_id=%s
+                AND author_id=%s;
+        """, (user_id, author_id))
 
     def get_number_followers(self, author_id):
         return self._connection.query("""
         SELECT COUNT(author_id) FROM author_followers
-            WHERE author_id={};
-        """.format(author_id))[0][0]  # If the author ID is known, can safely assume that an author is in the DB with that
+            WHERE author_id=%s;
+        """, (author_id,))[0][0]  # If the author ID is known, can safely assume that an author is in the DB with that
         # name.
 
     def get_about_data(self, author_id):
-        res = self._connection.query("SELECT author_id FROM authors WHERE author_id={}".format(author_id))
+        res = self._connection.query("SELECT author_id FROM authors WHERE author_id=%s", (author_id,))
         if len(res) == 0:
             raise AuthorNotFoundError(author_id)  # Cannot safely assume that it is from a reputable source -
             # it may not be from a link, so it should be verified.
@@ -67,8 +67,8 @@ class Authors:
                 ON authors.author_id=books.author_id
             LEFT OUTER JOIN reviews
                 ON reviews.book_id=books.book_id
-            WHERE authors.author_id={};
-        """.format(author_id))[0]
+            WHERE authors.author_id=%s;
+        """, (author_id,))[0]
 
         first_name, surname, alias, about, followers, average_rating, number_ratings = res  # res is a 4 element tuple, so this unpacks it
         author = names_to_display(first_name, surname, alias)
@@ -81,8 +81,8 @@ class Authors:
 
         books = self._connection.query("""
             SELECT book_id, title, cover_image FROM books
-            WHERE author_id={};
-        """.format(author_id))
+            WHERE author_id=%s;
+        """, (author_id,))
 
         book_arr = []
         for i in books:
@@ -103,10 +103,10 @@ class Authors:
             INNER JOIN book_genres ON book_genres.genre_id=genres.genre_id
             INNER JOIN books ON books.book_id=book_genres.book_id
             INNER JOIN authors ON authors.author_id=books.author_id
-            WHERE authors.author_id={author_id}
+            WHERE authors.author_id=%s
             ORDER BY book_genres.match_strength DESC
-            LIMIT {number}
-        """.format(author_id=author_id, number=self._number_genres))
+            LIMIT %s
+        """, (author_id, self._number_genres))
 
         output_dict["genres"] = list(set(i[0] for i in genres))
 
@@ -118,8 +118,8 @@ class Authors:
                 surname,
                 alias
             FROM authors
-            WHERE author_id={}
-        """.format(author_id))[0]
+            WHERE author_id=%s
+        """, (author_id,))[0]
 
         return names_to_display(res[0], res[1], res[2])
 
@@ -155,14 +155,11 @@ class Authors:
             LEFT OUTER JOIN reviews ON reviews.book_id=books.book_id
             WHERE books.author_id IN (SELECT author_followers.author_id
                 FROM author_followers
-                WHERE author_followers.user_id={user_id})
+                WHERE author_followers.user_id=%s)
             GROUP BY books.book_id
             ORDER BY average_rating DESC
-            LIMIT {limit};
-        """.format(
-            user_id=user_id,
-            limit=self._number_summaries_home
-        ))
+            LIMIT %s;
+        """, (user_id, self._number_summaries_home))
 
         if len(res) == 0:
             return None
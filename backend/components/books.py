@@ -1,9 +1,16 @@
 # -----------------------------------------------------------------------------
 # Standard Python library imports
 # -----------------------------------------------------------------------------
+import os
 import re
 import sys
 import math
+import threading
+
+# -----------------------------------------------------------------------------
+# Third party Python library imports
+# -----------------------------------------------------------------------------
+import numpy as np
 
 # -----------------------------------------------------------------------------
 # Project imports
@@ -12,7 +19,7 @@ import components.authors
 
 sys.path.append("../backend")
 import data_structures
-import ml_utilities
+import nearest_neighbours
 
 
 # -----------------------------------------------------------------------------
@@ -27,56 +34,100 @@ class BookNotFoundError(Exception):
         message = f"Book with ID '{book_id}' was not found."
         super().__init__(message)
 
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+NEWEST_CACHE_KEY = "newest"  # Only changed when books are added, so is left to expire
+HIGHLY_RATED_CACHE_KEY = "highly_rated"  # Invalidated by anything that changes the reviews
+
 # -----------------------------------------------------------------------------
 # Objects
 # -----------------------------------------------------------------------------
 class Books:
-    def __init__(self, connection, reading_lists, number_similarities_about, number_summaries_home, num_display_genres):
+    def __init__(self, connection, reading_lists, number_similarities_about, number_summaries_home, num_display_genres,
+            cache=None, similarity_index_path=None, similarity_engine="exact", similarity_engine_options=None):
         self._reading_lists = reading_lists
         self._num_display_genres = num_display_genres
         self._number_summaries_home = number_summaries_home
         self._number_similarities_about = number_similarities_about
         self._connection = connection
+        if cache is None:
+            cache = data_structures.TTLCache()  # Values are not reused unless a cache with a ttl is given
+        self._cache = cache
+
+        self._similarity_index_path = similarity_index_path  # Shared with maintenance, which refreshes it when the
+        # book genres change
+        self._similarity_index = None
+        self._similarity_index_time = None  # Modification time of the file the index was loaded from
+        self._similarity_index_lock = threading.Lock()  # Only one thread loads or builds the index
+        self._similarity_engine = similarity_engine  # See nearest_neighbours.ENGINES
+        self._similarity_engine_options = similarity_engine_options
 
     def get_similar_items(self, book_id):
-        res = self._connection.query("""
-            SELECT books.book_id,
-                GROUP_CONCAT(book_genres.genre_id
-                    ORDER BY book_genres.genre_id ASC
-                ),
-                GROUP_CONCAT(book_genres.match_strength
-                    ORDER BY book_genres.genre_id ASC
-                ),
-                books.author_id
-            FROM books
-            INNER JOIN book_genres
-                ON books.book_id=book_genres.book_id
-            GROUP BY books.book_id;
-        """)
-
-        genre_dict = dict()
-        for i in res:
-            genres = [0 for k in range(self._connection.query("SELECT COUNT(genre_id) FROM genres")[0][0])]
-            for genre_id, strength in zip(i[1].split(","), i[2].split(",")):
-                genres[int(genre_id) - 1] = float(strength)
-
-            genre_dict[i[0]] = genres
-
-        target_genres = genre_dict[book_id]
-        genre_dict.pop(book_id)
-
-        tree = data_structures.BinaryTree(access_function=lambda x: -x["strength"])  # Insert into tree using
-        # similarity not id
-        for i in genre_dict:
-            tree.insert({
-                "book_id": i,
-                "strength": ml_utilities.cosine_similarity(target_genres, genre_dict[i])
-            })
-
-        result = tree.in_order_traversal()[:self._number_similarities_about]  # Get the books ordered by similarity.
-        #Note that the distance is descending - This is correct, as 0 is identical genres, and 1 is different
-
-        return [self.get_summary(i["book_id"]) for i in result]
+        index = self.get_similarity_index()
+        if book_id not in index:  # Books with no genres, or added since the index was refreshed, are not in it
+            if len(self._connection.query("SELECT book_id FROM books WHERE book_id=%s", (book_id,))) == 0:
+                raise BookNotFoundError(book_id)
+            return []  # So the pages that show it do not fail until maintenance refreshes the index
+
+        return self.get_summaries(index.get_neighbours(book_id, self._number_similarities_about))  # Ordered by
+        # similarity, most similar first
+
+    def get_similarity_index(self):
+        # The index is loaded from the file again if it has been changed by another process, and is built from the
+        # database if there is no file that can be used.
+        with self._similarity_index_lock:
+            path = self._similarity_index_path
+            modified_time = os.path.getmtime(path) if path is not None and os.path.exists(path) else None
+            if self._similarity_index is not None and modified_time == self._similarity_index_time:
+                return self._similarity_index
+
+            index = None
+            if modified_time is not None:
+                index = nearest_neighbours.SimilarityIndex.load(
+                    path,
+                    self._number_similarities_about,
+                    self._similarity_engine,
+                    self._similarity_engine_options
+                )
+
+            if index is None:
+                return self.refresh_similarity_index()
+
+            self._similarity_index = index
+            self._similarity_index_time = modified_time
+            return index
+
+    def refresh_similarity_index(self):
+        # Builds the index from book_genres, and saves it so other processes use it. Should be called whenever
+        # book_genres changes.
+        genre_lookup_table = data_structures.LookupTable(
+            [i[0] for i in self._connection.query("SELECT genre_id FROM genres")]
+        )
+
+        rows = np.array(
+            list(self._connection.stream("SELECT book_id, genre_id, match_strength FROM book_genres")),
+            dtype=np.float64
+        ).reshape(-1, 3)  # Streamed, as there is a row for every genre of every book
+        book_ids, book_indexes = np.unique(rows[:, 0].astype(np.int64), return_inverse=True)
+
+        vectors = np.zeros((len(book_ids), len(genre_lookup_table)))
+        vectors[book_indexes, genre_lookup_table.get_indexes(rows[:, 1].astype(np.int64))] = rows[:, 2]
+
+        index = nearest_neighbours.SimilarityIndex(
+            book_ids,
+            vectors,
+            self._number_similarities_about,
+            self._similarity_engine,
+            self._similarity_engine_options
+        )
+        self._similarity_index = index
+        self._similarity_index_time = None
+        if self._similarity_index_path is not None:
+            index.save(self._similarity_index_path)
+            self._similarity_index_time = os.path.getmtime(self._similarity_index_path)
+
+        return index
 
     def get_summary(self, book_id=None, isbn=None):
         if book_id is not None:
@@ -89,8 +140,8 @@ class Books:
                     authors.alias
                 FROM books
                 INNER JOIN authors ON books.author_id=authors.author_id
-                WHERE books.book_id={}
-            """.format(book_id))
+                WHERE books.book_id=%s
+            """, (book_id,))
         else:
             res = self._connection.query("""
                 SELECT books.title,
@@ -101,14 +152,37 @@ class Books:
                     authors.alias
                 FROM books
                 INNER JOIN authors ON books.author_id=authors.author_id
-                WHERE books.isbn="{}"
-            """.format(isbn))
+                WHERE books.isbn=%s
+            """, (isbn,))
 
         if len(res) == 0:
             raise BookNotFoundError(book_id)
 
-        res = res[0]
+        return self._summary(res[0])
 
+    def get_summaries(self, book_ids):
+        # The same as get_summary for each book, but with a single query. The summaries are in the same order as
+        # book_ids.
+        if not len(book_ids):
+            return []
+
+        res = self._connection.query("""
+            SELECT books.title,
+                books.book_id,
+                books.cover_image,
+                authors.first_name,
+                authors.surname,
+                authors.alias
+            FROM books
+            INNER JOIN authors ON books.author_id=authors.author_id
+            WHERE books.book_id IN ({})
+        """.format(",".join(["%s"] * len(book_ids))), list(book_ids))
+
+        summaries = {i[1]: self._summary(i) for i in res}
+        return [summaries[i] for i in book_ids if i in summaries]
+
+    def _summary(self, res):
+        # Converts a row of title, book_id, cover_image, first_name, surname, alias to the summary of the book
         return {
             "author": components.authors.names_to_display(res[3], res[4], res[5]),
             "title": res[0],
@@ -117,6 +191,9 @@ class Books:
         }
 
     def get_newest(self):
+        return self._cache.get(NEWEST_CACHE_KEY, self._get_newest)  # The same for every user
+
+    def _get_newest(self):
         res = self._connection.query("""
             SELECT books.title,
                 books.book_id,
@@ -127,8 +204,8 @@ class Books:
             FROM books
             INNER JOIN authors ON books.author_id=authors.author_id
             ORDER BY books.date_added DESC
-            LIMIT {};
-        """.format(self._number_summaries_home))  # Get the first n books
+            LIMIT %s;
+        """, (self._number_summaries_home,))  # Get the first n books
 
         output_dict = dict()
         for i, k in enumerate(res):
@@ -171,8 +248,8 @@ class Books:
             FROM books
             INNER JOIN authors
                 ON authors.author_id=books.author_id
-            WHERE books.book_id={book_id};
-        """.format(book_id=book_id))
+            WHERE books.book_id=%s;
+        """, (book_id,))
 
         if len(res) == 0:
             raise BookNotFoundError(
@@ -185,10 +262,10 @@ class Books:
         genres = [i[0] for i in self._connection.query("""
             SELECT genres.name FROM genres
             INNER JOIN book_genres ON book_genres.genre_id=genres.genre_id
-            WHERE book_genres.book_id={book_id}
+            WHERE book_genres.book_id=%s
             ORDER BY book_genres.match_strength DESC
-            LIMIT {number}
-        """.format(book_id=book_id, number=self._num_display_genres))]
+            LIMIT %s
+        """, (book_id, self._num_display_genres))]
 
         output_dict = {
             "title": res[0],
@@ -214,22 +291,22 @@ class Books:
                 COUNT(overall_rating) AS num_ratings,
                 (SELECT COUNT(overall_rating) from reviews
                     WHERE overall_rating=5
-                        AND book_id={book_id}) AS num_5_stars,
+                        AND book_id=%s) AS num_5_stars,
                 (SELECT COUNT(overall_rating) from reviews
                     WHERE overall_rating=4
-                        AND book_id={book_id}) AS num_4_stars,
+                        AND book_id=%s) AS num_4_stars,
                 (SELECT COUNT(overall_rating) from reviews
                     WHERE overall_rating=3
-                        AND book_id={book_id}) AS num_3_stars,
+                        AND book_id=%s) AS num_3_stars,
                 (SELECT COUNT(overall_rating) from reviews
                     WHERE overall_rating=2
-                        AND book_id={book_id}) AS num_2_stars,
+                        AND book_id=%s) AS num_2_stars,
                 (SELECT COUNT(overall_rating) from reviews
                     WHERE overall_rating=1
-                        AND book_id={book_id}) AS num_1_star
+                        AND book_id=%s) AS num_1_star
                 FROM reviews
-                WHERE book_id={book_id};
-            """.format(book_id=book_id))[0]  # This always gives one tuple, regardless of whether there are any reviews.
+                WHERE book_id=%s;
+            """, (book_id,) * 6)[0]  # This always gives one tuple, regardless of whether there are any reviews.
 
         # Even if there is no reviews, the query has results of 0 for all these.
         output_dict["average_rating"] = float(res[0])  # The query gives a Decimal type, so cast to float to be useful.
@@ -252,9 +329,9 @@ class Books:
                         summary,
                         rating_body
                     FROM reviews
-                    WHERE user_id={user_id}
-                        AND book_id={book_id};
-                """.format(user_id=user_id, book_id=book_id))
+                    WHERE user_id=%s
+                        AND book_id=%s;
+                """, (user_id, book_id))
             if len(res) == 0:
                 output_dict["current_user_review"] = None
             else:
@@ -281,11 +358,9 @@ class Books:
                 users.username
             FROM reviews
             INNER JOIN users ON users.user_id=reviews.user_id
-            WHERE reviews.user_id!={user_id}
-                AND reviews.book_id={book_id};
-        """.format(user_id=user_id,
-                   book_id=book_id))  # Inserting None will insert a string “None” so will not match any IDs.
-        # Does not include the current user's review. If it is None it includes all users.
+            WHERE reviews.user_id!=%s
+                AND reviews.book_id=%s;
+        """, (user_id, book_id))  # Does not include the current user's review. If it is None it includes all users.
 
         stack = data_structures.Stack() # date added will be newest comes last - reverses the order
         for i in res:
@@ -293,9 +368,9 @@ class Books:
 
         output_dict["author_following"] = bool(len(self._connection.query("""
             SELECT author_id FROM author_followers
-            WHERE author_id={author_id}
-                AND user_id={user_id};
-        """.format(author_id=output_dict["author_id"], user_id=user_id))))  # Finds all entries with the same user and
+            WHERE author_id=%s
+                AND user_id=%s;
+        """, (output_dict["author_id"], user_id))))  # Finds all entries with the same user and
         # author id as required, which will either be 1 or 0. If it is 0, the user is not following the author, so the
         # author_following value should be false. If it is 1, they are, so it should be true. Len gets the number of results
         # (1 or 0), and bool converts this to the corresponding boolean value, which is whether the user is following the
@@ -324,39 +399,35 @@ class Books:
     def delete_review(self, review_id, user_id):
         self._connection.query("""
             DELETE FROM reviews
-            WHERE user_id={user_id}
-                AND review_id={review_id};
-        """.format(user_id=user_id, review_id=review_id))
+            WHERE user_id=%s
+                AND review_id=%s;
+        """, (user_id, review_id))
+        self._cache.invalidate(HIGHLY_RATED_CACHE_KEY)
 
     def leave_review(self, user_id, book_id, overall_rating, plot_rating, character_rating, summary, thoughts):
-        params = locals()
-        params = {i: "null" if k is None else k for i, k in zip(params.keys(), params.values())}
-        #  Convert all None parameters to null for insertion into query.
         if thoughts is not None:
-            params["thoughts"] = '"' + re.sub("\n+", "\n", params["thoughts"]) + '"'
-            params["summary"] = '"' + params["summary"] + '"'  # There is a check to ensure that 'thoughts' cannot be given
-            # without 'summary'.
+            thoughts = re.sub("\n+", "\n", thoughts)  # There is a check to ensure that 'thoughts' cannot be given
+            # without 'summary'. None parameters are inserted as null.
 
-        self._connection.query("""
-            DELETE FROM reviews
-            WHERE book_id={book_id}
-                AND user_id={user_id}
-        """.format(book_id=book_id, user_id=user_id))  # This will remove any existing reviews, so there will only ever be one review per book per user
+        with self._connection.transaction():  # The old review is only removed if the new one is added
+            self._connection.query("""
+                DELETE FROM reviews
+                WHERE book_id=%s
+                    AND user_id=%s
+            """, (book_id, user_id))  # This will remove any existing reviews, so there will only ever be one review per book per user
+
+            self._connection.query("""
+                INSERT INTO reviews (user_id, book_id, overall_rating, plot_rating, character_rating, summary, rating_body) VALUES
+                (%s, %s, %s, %s, %s, %s, %s);
+            """, (user_id, book_id, overall_rating, plot_rating, character_rating, summary, thoughts))
+
+        self._cache.invalidate(HIGHLY_RATED_CACHE_KEY)  # After the transaction, so it cannot be recalculated from the
+        # reviews before it is committed
 
-        self._connection.query("""
-            INSERT INTO reviews (user_id, book_id, overall_rating, plot_rating, character_rating, summary, rating_body) VALUES
-            ({user_id}, {book_id}, {overall_rating}, {plot_rating}, {character_rating}, {summary}, {rating_body});
-        """.format(
-            user_id=params["user_id"],
-            book_id=params["book_id"],
-            overall_rating=params["overall_rating"],
-            plot_rating=params["plot_rating"],
-            character_rating=params["character_rating"],
-            summary=params["summary"],
-            rating_body=params["thoughts"]
-        ))
-    
     def get_highly_rated(self):
+        return self._cache.get(HIGHLY_RATED_CACHE_KEY, self._get_highly_rated)  # The same for every user
+
+    def _get_highly_rated(self):
         res = self._connection.query("""
             SELECT books.title,
                 books.book_id,
@@ -370,8 +441,8 @@ class Books:
             INNER JOIN reviews ON reviews.book_id=books.book_id
             GROUP BY books.book_id
             ORDER BY average_rating DESC
-            LIMIT {}
-        """.format(self._number_summaries_home))  # The number of summaries on the genre
+            LIMIT %s
+        """, (self._number_summaries_home,))  # The number of summaries on the genre
         # page should be the same as the layout is the same
 
         output_dict = dict()  # priority queue
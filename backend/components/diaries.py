@@ -8,6 +8,7 @@ import sys
 # Project imports
 # -----------------------------------------------------------------------------
 import components.authors
+import components.reading_lists
 
 sys.path.append("../backend")
 import data_structures
@@ -17,61 +18,49 @@ import data_structures
 # Objects
 # -----------------------------------------------------------------------------
 class Diaries:
-    def __init__(self, connection):
+    def __init__(self, connection, cache=None):
         self._connection = connection
+        if cache is None:
+            cache = data_structures.TTLCache()  # Values are not reused unless a cache with a ttl is given
+        self._cache = cache
 
     def add_entry(self, user_id, book_id, overall_rating, character_rating, plot_rating, summary, thoughts, pages_read):
-        params = locals()
-        params = {i: "null" if k is None else k for i, k in zip(params.keys(), params.values())}
         if thoughts is not None:
-            params["thoughts"] = '"' + re.sub("\n+", "\n", params["thoughts"]) + '"'
-        if summary is not None:
-            params["summary"] = '"' + params["summary"] + '"'
-        self._connection.query("""
-            INSERT INTO diary_entries (user_id, book_id, overall_rating, character_rating, plot_rating, summary, thoughts, pages_read)
-            VALUES
-            ({user_id}, {book_id}, {overall_rating}, {character_rating}, {plot_rating}, {summary}, {thoughts}, {pages_read});
-        """.format(
-            user_id=params["user_id"],
-            book_id=params["book_id"],
-            overall_rating=params["overall_rating"],
-            character_rating=params["character_rating"],
-            plot_rating=params["plot_rating"],
-            summary=params["summary"],
-            thoughts=params["thoughts"],
-            pages_read=params["pages_read"]
-        ))
+            thoughts = re.sub("\n+", "\n", thoughts)  # None parameters are inserted as null
+        with self._connection.transaction():  # The entry and moving the book to "Have Read" are made together
+            self._connection.query("""
+                INSERT INTO diary_entries (user_id, book_id, overall_rating, character_rating, plot_rating, summary, thoughts, pages_read)
+                VALUES
+                (%s, %s, %s, %s, %s, %s, %s, %s);
+            """, (user_id, book_id, overall_rating, character_rating, plot_rating, summary, thoughts, pages_read))
 
-        start_list, end_list = self._connection.query("""
-                SELECT list_id FROM reading_list_names
-                WHERE user_id={}
-                    AND list_name IN ("Currently Reading", "Have Read")
-                ORDER BY list_name ASC
-            """.format(user_id))
+            start_list, end_list = self._connection.query("""
+                    SELECT list_id FROM reading_list_names
+                    WHERE user_id=%s
+                        AND list_name IN ("Currently Reading", "Have Read")
+                    ORDER BY list_name ASC
+                """, (user_id,))
 
-        self._connection.query("""
-            UPDATE reading_lists
-            SET list_id = {end_list}
-            WHERE user_id = {user_id}
-                AND list_id = {start_list}
-                AND book_id = {book_id}
-            """.format(
-                end_list=end_list[0],
-                user_id=user_id,
-                start_list=start_list[0],
-                book_id=book_id
+            self._connection.query("""
+                UPDATE reading_lists
+                SET list_id = %s
+                WHERE user_id = %s
+                    AND list_id = %s
+                    AND book_id = %s
+                """,
+                (end_list[0], user_id, start_list[0], book_id)
             )
-        )
-            
+
+        self._cache.invalidate(components.reading_lists.POPULAR_CACHE_KEY)  # The book is no longer currently being read
 
     def delete_entry(self, user_id, entry_id):
         # The user id is just a way of helping preventing a random deletion of a list. The corresponding user_id must be
         # known.
         self._connection.query("""
             DELETE from diary_entries
-            WHERE user_id={user_id}
-                AND entry_id={entry_id};
-        """.format(user_id=user_id, entry_id=entry_id))
+            WHERE user_id=%s
+                AND entry_id=%s;
+        """, (user_id, entry_id))
 
     def get_entries(self, user_id):
         res = self._connection.query("""
@@ -99,8 +88,8 @@ class Diaries:
             FROM diary_entries
             INNER JOIN books ON books.book_id=diary_entries.book_id
             INNER JOIN authors ON books.author_id=authors.author_id
-            WHERE diary_entries.user_id={}
-        """.format(user_id))
+            WHERE diary_entries.user_id=%s
+        """, (user_id,))
 
         queue = data_structures.PriorityQueue(priority_func=lambda x: x[7])  # Order by date added
         for i in res:
@@ -27,9 +27,8 @@ class Genres:
     def get_about_data(self, genre_name):
         res = self._connection.query("""
             SELECT genre_id, name, about FROM genres
-            WHERE name="{genre_name}";
-        """.format(
-            genre_name=genre_name))  # There will only be one entry with that name, so take only tuple from result
+            WHERE name=%s;
+        """, (genre_name,))  # There will only be one entry with that name, so take only tuple from result
         # list
 
         if len(res) == 0:  # Protect against a list out of range errors
@@ -40,18 +39,18 @@ class Genres:
         count = self._connection.query("""
             SELECT CEIL(COUNT(book_id) * 0.15)
             FROM book_genres 
-            WHERE genre_id={};
-        """.format(res[0]))[0][0]
+            WHERE genre_id=%s;
+        """, (res[0],))[0][0]
 
         db_books = self._connection.query("""
             SELECT books.book_id, books.title, books.cover_image, authors.first_name, authors.surname, authors.alias FROM books
             INNER JOIN authors ON books.author_id=authors.author_id
             INNER JOIN book_genres ON books.book_id=book_genres.book_id
             INNER JOIN genres ON genres.genre_id=book_genres.genre_id
-            WHERE genres.genre_id={genre_id}
+            WHERE genres.genre_id=%s
             ORDER BY book_genres.match_strength DESC
-            LIMIT {count};
-        """.format(genre_id=res[0], count=count))
+            LIMIT %s;
+        """, (res[0], int(count)))  # CEIL gives a decimal, but LIMIT must be an integer
 
         book_dict = dict()
         for i, k in enumerate(db_books):
@@ -77,5 +76,5 @@ class Genres:
     def id_to_name(self, genre_id):
         return self._connection.query("""
             SELECT name FROM genres
-            WHERE genre_id={}
-        """.format(genre_id))[0][0]
+            WHERE genre_id=%s
+        """, (genre_id,))[0][0]
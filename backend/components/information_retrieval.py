@@ -2,13 +2,33 @@
 # Standard Python library imports
 # -----------------------------------------------------------------------------
 import itertools
+import collections
+import collections.abc
+import json
 import math
+import mmap
+import os
+import threading
+
+# -----------------------------------------------------------------------------
+# Third party Python library imports
+# -----------------------------------------------------------------------------
+import numpy as np
+import scipy.sparse
 
 # -----------------------------------------------------------------------------
 # Project imports
 # -----------------------------------------------------------------------------
 import components.books
 
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+SEARCH_BACKENDS = ("dict", "sparse")  # See DocumentCollection.tfidf_search
+INDEX_FILE_MAGIC = b"OBSI"  # First bytes of a search index file
+INDEX_FILE_VERSION = 1  # Increase if the format of the saved index changes, so old files are not used
+INDEX_FILE_ALIGNMENT = 64  # Arrays start at a multiple of this many bytes in the file, so they can be used in place
+
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
@@ -16,24 +36,340 @@ def clean_data(string):
     return "".join([i.lower() for i in string if i.isalnum() or i == " "])
 
 
+def rank_documents(similarities, types, ids, limit):
+    # Documents with a similarity above 0, in the same order as the dict backend. similarities, types and ids have an
+    # item for each document, in order of position. Only the top limit are found, with argpartition, so the rest are not
+    # sorted.
+    rows = np.flatnonzero(similarities > 0)
+    if len(rows) > limit:
+        top = rows[np.argpartition(-similarities[rows], limit - 1)[:limit]]
+        rows = rows[similarities[rows] >= similarities[top].min()]  # Includes every document tied with the lowest,
+        # so the ties are broken by type and position below, rather than by argpartition
+
+    rows = rows[np.lexsort((rows, types[rows], -similarities[rows]))][:limit]  # By similarity descending, then
+    # type ascending, then position
+    return [{
+        "type": str(types[i]),
+        "similarity": float(similarities[i]),
+        "id": int(ids[i])
+    } for i in rows]
+
+
+def align(offset):
+    return -(-offset // INDEX_FILE_ALIGNMENT) * INDEX_FILE_ALIGNMENT  # Rounded up to a multiple of the alignment
+
+
+def save_arrays(path, arrays):
+    # Saves a dictionary of numpy arrays to a single file, which load_arrays memory maps. The file is the magic bytes,
+    # the length of a json header with the dtype, shape and offset of each array, the header, then the arrays' data.
+    layout = dict()
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": array.shape, "offset": offset}
+        offset = align(offset + array.nbytes)
+
+    header = json.dumps({"version": INDEX_FILE_VERSION, "arrays": layout}).encode()
+    data_start = align(len(INDEX_FILE_MAGIC) + 8 + len(header))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"  # Written then renamed, so a partially written file is never read.
+    # Processes that mapped the old file keep using it until they load the new one.
+    with open(temp_path, "wb") as file:
+        file.write(INDEX_FILE_MAGIC + len(header).to_bytes(8, "little") + header)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(data_start + offset)  # Padding after the last array
+    os.replace(temp_path, path)
+
+
+def load_arrays(path):
+    # Memory maps the arrays saved by save_arrays, so they are read from the file as they are used, and the pages are
+    # shared by every process that maps the same file. The arrays are read only. Returns None if there is no file, or
+    # it is not a search index file of this version.
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as file:
+        if file.read(len(INDEX_FILE_MAGIC)) != INDEX_FILE_MAGIC:
+            return None
+        header_length = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_length))
+        if header["version"] != INDEX_FILE_VERSION:
+            return None
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # Stays open after the file is closed
+
+    data_start = align(len(INDEX_FILE_MAGIC) + 8 + header_length)
+    arrays = dict()
+    for name, layout in header["arrays"].items():
+        dtype = np.dtype(layout["dtype"])
+        arrays[name] = np.frombuffer(
+            buffer,
+            dtype=dtype,
+            count=math.prod(layout["shape"]),
+            offset=data_start + layout["offset"]
+        ).reshape(layout["shape"])
+    return arrays
+
+
 # -----------------------------------------------------------------------------
 # Objects
 # -----------------------------------------------------------------------------
+class SparseTfidfIndex:
+    # The tf-idf values of every document as the rows of a sparse matrix, which are divided by their length, so the
+    # cosine similarity of every document to a search is a single matrix-vector product. This is the similarity over
+    # all of a document's words, rather than only the search terms, so can rank documents differently to the dict
+    # backend.
+    def __init__(self, documents, idf_values):
+        # documents is a list of the documents in order of position, which have their tf values
+        self.vocabulary = dict()  # Word -> column
+        rows = []
+        columns = []
+        values = []
+        for row, document in enumerate(documents):
+            for word, tf in document["tf"].items():
+                if word in idf_values:
+                    rows.append(row)
+                    columns.append(self.vocabulary.setdefault(word, len(self.vocabulary)))
+                    values.append(tf * idf_values[word])
+
+        matrix = scipy.sparse.csr_matrix((values, (rows, columns)), shape=(len(documents), len(self.vocabulary)))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        self.matrix = scipy.sparse.csr_matrix(scipy.sparse.diags(
+            np.divide(1, norms, out=np.zeros(len(norms)), where=norms > 0)
+        ).dot(matrix))  # Documents without any words with an idf value are left as zeros
+        self.types = np.array([i["type"] for i in documents])
+        self.ids = [i["id"] for i in documents]
+
+    def search(self, search_tfidf, limit):
+        # Documents with a similarity above 0 to the search, which has tf-idf values search_tfidf. See rank_documents.
+        search_vector = np.zeros(len(self.vocabulary))
+        for word, tfidf in search_tfidf.items():
+            if word in self.vocabulary:
+                search_vector[self.vocabulary[word]] = tfidf
+
+        norm = np.linalg.norm(search_vector)
+        if norm == 0 or limit <= 0:
+            return []
+
+        return rank_documents(self.matrix.dot(search_vector) / norm, self.types, self.ids, limit)
+
+
+class MappedWords(collections.abc.Mapping):
+    # Read only dictionary of word -> value, where the words are a sorted array of utf-8 bytes, which are found with a
+    # binary search. Nothing is copied out of the arrays until it is looked up, so they can be memory mapped.
+    def __init__(self, words, get_value):
+        self._words = words
+        self._get_value = get_value  # Row of the word -> value
+
+    def __getitem__(self, word):
+        encoded = word.encode()
+        row = np.searchsorted(self._words, encoded)
+        if row == len(self._words) or self._words[row] != encoded:
+            raise KeyError(word)
+        return self._get_value(row)
+
+    def __iter__(self):
+        return (i.decode() for i in self._words)
+
+    def __len__(self):
+        return len(self._words)
+
+
+class MappedDocuments(collections.abc.Mapping):
+    # Read only dictionary of position -> document, with the type and id of the documents in a MappedSearchIndex
+    def __init__(self, types, ids):
+        self._types = types
+        self._ids = ids
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self._ids):
+            raise KeyError(position)
+        return {"type": str(self._types[position]), "id": int(self._ids[position])}
+
+    def __iter__(self):
+        return iter(range(len(self._ids)))
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class MappedSearchIndex:
+    # The documents, inverted index and idf values as arrays, which are saved to a file that processes memory map, so
+    # they do not need to be loaded from the database and generated by each of them. The postings of each word are
+    # the positions and tf values of the documents containing it, and the norms are the length of each document's
+    # tf-idf values, so both backends can be searched with it. Only words with an idf value are included, as the others
+    # cannot be searched for. Positions are the rows of the documents when the index was built, so are in the same
+    # order as the documents it was built from.
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.types = arrays["document_types"]
+        self.ids = arrays["document_ids"]
+        self.norms = arrays["document_norms"]
+        self._words = arrays["words"]
+        self._idf_values = arrays["idf_values"]
+        self._posting_offsets = arrays["posting_offsets"]  # Postings of the word in row i are from offsets[i] to
+        # offsets[i + 1] in the posting arrays
+        self._posting_positions = arrays["posting_positions"]
+        self._posting_tf = arrays["posting_tf"]
+
+        self.idf_values = MappedWords(self._words, lambda row: float(self._idf_values[row]))
+        self.inverted_index = MappedWords(self._words, self._get_postings)  # Word -> list of (position, tf value),
+        # the same as DocumentCollection.inverted_index
+        self.documents = MappedDocuments(self.types, self.ids)
+
+    def _get_postings(self, row):
+        start, end = self._posting_offsets[row], self._posting_offsets[row + 1]
+        return list(zip(self._posting_positions[start:end].tolist(), self._posting_tf[start:end].tolist()))
+
+    @classmethod
+    def build(cls, documents, idf_values):
+        # documents is a list of the documents in order of position, which have their tf values
+        postings = dict()  # Word -> list of (row, tf value)
+        norms = np.zeros(len(documents))
+        for row, document in enumerate(documents):
+            for word, tf in document["tf"].items():
+                if word in idf_values:
+                    postings.setdefault(word, []).append((row, tf))
+                    norms[row] += (tf * idf_values[word]) ** 2
+
+        words = sorted(i.encode() for i in idf_values.keys())  # Sorted as bytes, as they are searched as bytes
+        word_postings = [postings.get(i.decode(), []) for i in words]
+        return cls({
+            "words": np.array(words, dtype=bytes),
+            "idf_values": np.array([idf_values[i.decode()] for i in words], dtype=np.float64),
+            "posting_offsets": np.cumsum([0] + [len(i) for i in word_postings], dtype=np.int64),
+            "posting_positions": np.array([k for i in word_postings for k, _ in i], dtype=np.int64),
+            "posting_tf": np.array([tf for i in word_postings for _, tf in i], dtype=np.float64),
+            "document_types": np.array([i["type"] for i in documents], dtype="U1"),
+            "document_ids": np.array([i["id"] for i in documents], dtype=np.int64),
+            "document_norms": np.sqrt(norms)
+        })
+
+    def save(self, path):
+        save_arrays(path, self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        # Returns None if there is no file, or it is from a different version, so the index needs to be built again
+        arrays = load_arrays(path)
+        return cls(arrays) if arrays is not None else None
+
+    def search(self, search_tfidf, limit):
+        # The same as SparseTfidfIndex.search, but the similarities are added up from the postings of the search terms,
+        # so only the documents containing them are read
+        similarities = np.zeros(len(self.ids))
+        norm = 0
+        for word, tfidf in search_tfidf.items():
+            encoded = word.encode()
+            row = np.searchsorted(self._words, encoded)
+            if row == len(self._words) or self._words[row] != encoded:
+                continue
+            start, end = self._posting_offsets[row], self._posting_offsets[row + 1]
+            if start == end:  # Not in any document, so not in the sparse backend's vocabulary
+                continue
+
+            positions = self._posting_positions[start:end]
+            norms = self.norms[positions]
+            similarities[positions] += np.divide(
+                self._posting_tf[start:end] * self._idf_values[row],
+                norms,
+                out=np.zeros(len(positions)),
+                where=norms > 0
+            ) * tfidf  # Positions are unique within a word's postings, so each document is only added to once
+            norm += tfidf ** 2
+
+        norm = math.sqrt(norm)
+        if norm == 0 or limit <= 0:
+            return []
+
+        return rank_documents(similarities / norm, self.types, self.ids, limit)
+
+
 class DocumentCollection:
-    def __init__(self, connection, books, authors, genres, result_limit):
+    def __init__(self, connection, books, authors, genres, result_limit, backend="dict", index_path=None):
+        if backend not in SEARCH_BACKENDS:
+            raise ValueError(f"Unknown search backend '{backend}', expected one of {', '.join(SEARCH_BACKENDS)}")
+
+        self._backend = backend  # dict searches the inverted index, and sparse searches a SparseTfidfIndex
         self._authors = authors
         self._genres = genres
         self._books = books
         self._result_limit = result_limit
         self._connection = connection
+        self._inverted_index = None  # See inverted_index
+        self._sparse_index = None  # See sparse_index
+        self._lock = threading.RLock()  # Held while the documents or inverted index are changed, or searched
+        self._idf_values = None
+
+        self._index_path = index_path  # Saved by refresh_search_index, which maintenance runs
+        self._mapped_index = None  # See mapped_index
+        self._mapped_index_version = None  # See _index_file_version. Of the file the mapped index was loaded from
+        self._documents_version = None  # Of the file when the documents were loaded, or saved from them
+        self._documents_dict = None
+        if index_path is not None and self.mapped_index is not None:
+            return  # The documents are only loaded if something other than a search needs them
+
         self.load_documents_dict()
         self.gen_tf_values()
+
+    @property
+    def mapped_index(self):
+        # MappedSearchIndex loaded from index_path, which is searched in place of the documents until they are loaded.
+        # It is loaded again once the file is changed by another process. If the documents have been loaded, they are
+        # dropped once the file is changed by another process, as it was built from the database after they were
+        # loaded. None if there is no file that can be used, or the documents are loaded and it has not been changed
+        # since.
+        with self._lock:
+            if self._index_path is None:
+                return None
+
+            version = self._index_file_version()
+            if self._documents_dict is not None and version == self._documents_version:
+                return None
+
+            if version is not None and version != self._mapped_index_version:
+                index = MappedSearchIndex.load(self._index_path)
+                if index is not None:  # Otherwise the index that is already loaded is kept, as it is still mapped
+                    self._mapped_index = index
+                    self._mapped_index_version = version
+                    self._unload_documents()
+            return self._mapped_index
+
+    def _index_file_version(self):
+        # Identifies the file at index_path, or None if there is not one. The file is replaced each time it is saved, so
+        # the inode changes as well as the modification time, which may be the same for files saved close together.
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+    def _unload_documents(self):
+        # Drops the documents and everything generated from them, so the mapped index is searched in their place
+        self._documents_dict = None
+        self._inverted_index = None
+        self._sparse_index = None
         self._idf_values = None
 
+    def _load_documents(self):
+        # Loads the documents from the database in place of the mapped index, for anything other than a search. The
+        # index file is not used after this until it is saved again - see mapped_index.
+        with self._lock:
+            if self._documents_dict is None:
+                self._mapped_index = None
+                self._mapped_index_version = None
+                self.load_documents_dict()
+                self.gen_tf_values()
+
     def load_documents_dict(self):
-        self._documents_dict = []
-        self._documents = []
-        res = self._connection.query("""
+        if self._index_path is not None:
+            self._documents_version = self._index_file_version()  # Before they are loaded, so a file saved while they
+            # are is used in their place
+        self._documents_dict = dict()  # Position -> document, in the order they were loaded
+        self._inverted_index = None
+        self._sparse_index = None
+        res = self._connection.stream("""
             SELECT books.clean_title,
                 books.book_id,
                 authors.clean_name
@@ -41,63 +377,41 @@ class DocumentCollection:
             INNER JOIN authors ON authors.author_id=books.author_id
         """)
         for title, book_id, author_name in res:
-            new_title = title + " " + author_name
-            self._documents_dict.append({
-                "type": "b",
-                "words": new_title,
-                "id": book_id,
-                "similarity": 0
-            })
-
-            self._documents.append(new_title)
+            self._append_document("b", book_id, title + " " + author_name)
         
-        for title, genre_id in self._connection.query("SELECT clean_name, genre_id FROM genres"):
-            self._documents_dict.append({
-                "type": "g",
-                "words": title,
-                "id": genre_id,
-                "similarity": 0
-            })
-            self._documents.append(title)
-
-        for title, author_id in self._connection.query("SELECT clean_name, author_id FROM authors"):
-            self._documents_dict.append({
-                "type": "a",
-                "words": title,
-                "id": author_id,
-                "similarity": 0
-            })
-            self._documents.append(title)
+        for title, genre_id in self._connection.stream("SELECT clean_name, genre_id FROM genres"):
+            self._append_document("g", genre_id, title)
+
+        for title, author_id in self._connection.stream("SELECT clean_name, author_id FROM authors"):
+            self._append_document("a", author_id, title)
+
+    def _append_document(self, document_type, document_id, words):
+        self._documents_dict[len(self._documents_dict)] = {
+            "type": document_type,
+            "words": words,
+            "id": document_id,
+            "similarity": 0
+        }
 
     def gen_unique_words(self):
-        words = list(itertools.chain(*[i["words"].split(" ") for i in self._documents_dict]))
+        self._load_documents()
+        words = list(itertools.chain(*[i["words"].split(" ") for i in self._documents_dict.values()]))
 
         unique_words = set(words)
 
-        self._connection.query("DELETE FROM unique_words")
-        values = ""
-
-        for i in unique_words:
-            if i != "":
-                if values != "":
-                    values += ","
-                values += f'("{i}")'
-        
-        self._connection.query(f"INSERT INTO unique_words (word) VALUES {values}")
+        self._connection.bulk_replace(
+            "unique_words",
+            ("word",),
+            ((i,) for i in unique_words if i != "")
+        )  # Words are passed as parameters, so do not need to be escaped
     
     def gen_tf_values(self, term=None):
         if term is None:
-            for count, document in enumerate(self._documents_dict):
-                tf = dict()
-                arr = document["words"].split(" ")
-                one_over_n = 1 / len(arr)
-                for i in arr:
-                    if i != "":
-                        if i in tf:
-                            tf[i] += one_over_n
-                        else:
-                            tf[i] = one_over_n
-                self._documents_dict[count]["tf"] = tf
+            self._load_documents()
+            self._inverted_index = None  # Uses the tf values, so needs to be generated again
+            self._sparse_index = None
+            for document in self._documents_dict.values():
+                document["tf"] = self.gen_tf_values(document["words"])
         else:
             arr = term.split(" ")
             tf = dict()
@@ -111,37 +425,96 @@ class DocumentCollection:
             return tf
     
     def num_documents_containing(self, string):
-        return sum(string in i for i in self._documents)
+        self._load_documents()
+        return sum(string in i["words"].split(" ") for i in self._documents_dict.values())  # Whole words, so "art" is
+        # not found in "heart"
+
+    def gen_document_frequencies(self):
+        # Number of documents each word is in, counted in one pass over the documents. Each document's words are a set,
+        # so a word repeated in a document is only counted once.
+        self._load_documents()
+        return collections.Counter(itertools.chain.from_iterable(
+            set(i["words"].split(" ")) for i in self._documents_dict.values()
+        ))
 
     def gen_idf_values(self):
-        num_documents = len(self._documents)
-        self._idf_values = dict()
-        for word_id, word in self._connection.query("SELECT word_id, word FROM unique_words"):
-            idf = math.log10(num_documents / self.num_documents_containing(word))
-            self._connection.query("""
-                UPDATE unique_words
-                    SET idf_values={idf}
-                WHERE word_id={word_id}
-            """.format(
-                idf=idf,
-                word_id=word_id
-            ))
-
-            self._idf_values[word] = idf
+        self._load_documents()
+        num_documents = len(self._documents_dict)
+        document_frequencies = self.gen_document_frequencies()
+
+        words = [i for i in self._connection.query("SELECT word_id, word FROM unique_words")
+            if document_frequencies[i[1]] > 0]  # Words that are no longer in any document are left unchanged, as they
+            # cannot match a document
+        idf_values = np.log10(num_documents / np.array([document_frequencies[i[1]] for i in words], dtype=np.float64))
+
+        self._connection.bulk_upsert(
+            "unique_words",
+            ("word_id", "word", "idf_values"),
+            ((word_id, word, idf) for (word_id, word), idf in zip(words, idf_values.tolist())),
+            ("idf_values",)
+        )  # The rows already exist, so are only updated
+
+        self._idf_values = {word: idf for (word_id, word), idf in zip(words, idf_values.tolist())}
+        self._sparse_index = None  # Uses the idf values, so needs to be generated again
     
     @property
     def idf_values(self):
         if self._idf_values is not None: # Should be faster as it only needs to be fetched from the DB once
             return self._idf_values
+        elif self._mapped_index is not None:
+            return self._mapped_index.idf_values  # Saved with the index, so the database is not used
         else:
             self._idf_values = dict()
             for word, idf in self._connection.query("""SELECT word, idf_values FROM unique_words"""):
                 self._idf_values[word] = idf
             return self._idf_values
     
+    @property
+    def inverted_index(self):
+        # Dictionary of word -> list of (position, tf value) for every document containing the word, in order of
+        # position. The tf values are multiplied by the idf values when searching, so the postings do not change when
+        # the idf values do. Generated the first time it is needed.
+        with self._lock:
+            self._load_documents()
+            if self._inverted_index is None:
+                inverted_index = dict()
+                for position, document in self._documents_dict.items():
+                    for word, tf in document["tf"].items():
+                        inverted_index.setdefault(word, []).append((position, tf))
+                self._inverted_index = inverted_index
+            return self._inverted_index
+
+    @property
+    def sparse_index(self):
+        # SparseTfidfIndex of the documents. Generated the first time it is needed, and again after the documents or
+        # idf values change.
+        with self._lock:
+            self._load_documents()
+            if self._sparse_index is None:
+                self._sparse_index = SparseTfidfIndex(list(self._documents_dict.values()), self.idf_values)
+            return self._sparse_index
+
+    def refresh_search_index(self):
+        # Builds a MappedSearchIndex from the documents and idf values, and saves it to index_path, so other processes
+        # map it rather than loading the documents. Should be called after gen_idf_values, as the idf values are saved
+        # with it. Processes that had already mapped the index, or loaded their documents before it was saved, load the
+        # new one before their next search. This is how changes to the books, authors and genres are searched - there is
+        # no way to change the documents without building the index again.
+        if self._index_path is None:
+            raise ValueError("The search index cannot be saved without an index_path")
+
+        with self._lock:
+            self._load_documents()
+            index = MappedSearchIndex.build(list(self._documents_dict.values()), self.idf_values)
+            index.save(self._index_path)
+            self._documents_version = self._index_file_version()  # The file has the same documents, so this process
+            # keeps them rather than mapping it
+        return index
+
     def gen_tfidf_values(self, document=None, search_terms=None):
         if document is None:
-            for count, document in enumerate(self._documents_dict):
+            self._load_documents()
+            for document in self._documents_dict.values():
                 document_words = document["words"].split(" ")
                 if search_terms is None:
                     new_search_terms = document_words
@@ -153,7 +526,7 @@ class DocumentCollection:
                     if i in self.idf_values and i in document_words:
                         res[i] = document["tf"][i] * self.idf_values[i]
                 
-                self._documents_dict[count]["tfidf"] = res
+                document["tfidf"] = res
         else:
             document_words = document.split(" ")
             tf = self.gen_tf_values(document)
@@ -167,26 +540,45 @@ class DocumentCollection:
         terms = clean_data(terms)
         term_arr = terms.split(" ")
 
+        mapped_index = self.mapped_index  # Loaded first, so the idf values are from the index that is searched
         search_tfidf = self.gen_tfidf_values(document=terms)
+        if self._backend == "sparse":
+            index = mapped_index if mapped_index is not None else self.sparse_index
+            return index.search(search_tfidf, self._result_limit)
+
         result = []
 
-        self.gen_tfidf_values(search_terms=term_arr)
+        tfidf_values = dict()  # Position -> tf-idf values of the search terms in the document. Only the documents
+        # containing a search term can have a similarity above 0, so are the only ones looked at.
+        with self._lock:
+            if mapped_index is not None:
+                inverted_index = mapped_index.inverted_index
+                documents_dict = mapped_index.documents
+            else:
+                inverted_index = self.inverted_index
+                documents_dict = self._documents_dict
+
+            for word in set(term_arr):
+                if word in self.idf_values:
+                    for position, tf in inverted_index.get(word, []):
+                        tfidf_values.setdefault(position, dict())[word] = tf * self.idf_values[word]
+
+            documents = [(documents_dict[i], tfidf_values[i]) for i in sorted(tfidf_values)]  # In order of
+            # position, so documents with the same similarity and type stay in the same order
 
-        for document in self._documents_dict:
+        for document, tfidf in documents:
             similarity = a_total = b_total = 0 # These are used to work out the magnitude of the vectors
-            tfidf = document["tfidf"]
 
-            for k in term_arr:
-                similarity += search_tfidf[k] * tfidf[k]
+            for k in term_arr:  # Repeated terms are counted each time they appear
+                similarity += search_tfidf[k] * tfidf.get(k, 0)
                 a_total += search_tfidf[k] ** 2
-                b_total += tfidf[k] ** 2
+                b_total += tfidf.get(k, 0) ** 2
             
             if similarity > 0:
                 similarity /= (math.sqrt(a_total) * math.sqrt(b_total))
-                document["similarity"] = similarity
                 result.append({
                     "type": document["type"],
-                    "similarity": document["similarity"],
+                    "similarity": similarity,
                     "id": document["id"]
                 })
         
@@ -20,17 +20,28 @@ class ListNotFoundError(Exception):
         message = f"User with id '{user_id} does not have a list called {list_name}."
         super().__init__(message)
 
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+POPULAR_CACHE_KEY = "popular"  # Invalidated by anything that changes the "Currently Reading" lists
+
 # -----------------------------------------------------------------------------
 # Objects
 # -----------------------------------------------------------------------------
 class ReadingLists:
-    def __init__(self, connection, number_summaries_home, num_display_genres, recommendations):
+    def __init__(self, connection, number_summaries_home, num_display_genres, recommendations, cache=None):
         self._recommendations = recommendations
         self._connection = connection
         self._number_summaries_home = number_summaries_home
         self._num_display_genres = num_display_genres
+        if cache is None:
+            cache = data_structures.TTLCache()  # Values are not reused unless a cache with a ttl is given
+        self._cache = cache  # Shared with the other components, which invalidate the sections they change
 
     def get_popular(self):
+        return self._cache.get(POPULAR_CACHE_KEY, self._get_popular)  # The same for every user
+
+    def _get_popular(self):
         res = self._connection.query("""
             SELECT books.book_id,
                 books.title,
@@ -49,8 +60,8 @@ class ReadingLists:
             WHERE reading_list_names.list_name="Currently Reading"
             GROUP BY books.book_id
             ORDER BY num DESC
-            LIMIT {};
-        """.format(self._number_summaries_home))
+            LIMIT %s;
+        """, (self._number_summaries_home,))
 
         output_dict = dict()
         for i, k in enumerate(res):
@@ -67,9 +78,9 @@ class ReadingLists:
         res = self._connection.query("""
             SELECT list_id
             FROM reading_list_names
-            WHERE user_id={user_id}
-                AND list_name="{list_name}";
-        """.format(user_id=user_id, list_name=list_name))
+            WHERE user_id=%s
+                AND list_name=%s;
+        """, (user_id, list_name))
 
         if len(res) == 0:
             raise ListNotFoundError(list_name, user_id)
@@ -80,8 +91,9 @@ class ReadingLists:
         res = self._connection.query(
             """
             SELECT list_id, list_name FROM reading_list_names
-            WHERE user_id={};
-            """.format(user_id)
+            WHERE user_id=%s;
+            """,
+            (user_id,)
         )  # List of single element tuples
         output_queue = data_structures.Queue()
         for i in res:
@@ -108,8 +120,8 @@ class ReadingLists:
             INNER JOIN reading_list_names
                 ON reading_list_names.list_id=reading_lists.list_id
             WHERE reading_list_names.list_name="Currently Reading"
-                AND reading_list_names.user_id={};
-        """.format(user_id))
+                AND reading_list_names.user_id=%s;
+        """, (user_id,))
         return [{
                 "author": components.authors.names_to_display(i[3], i[4], i[5]),
                 "title": i[1],
@@ -133,8 +145,8 @@ class ReadingLists:
             INNER JOIN reading_list_names
                 ON reading_list_names.list_id=reading_lists.list_id
             WHERE reading_list_names.list_name="Want to Read"
-                AND reading_list_names.user_id={};
-        """.format(user_id))
+                AND reading_list_names.user_id=%s;
+        """, (user_id,))
         return [{
                 "author": components.authors.names_to_display(i[3], i[4], i[5]),
                 "title": i[1],
@@ -146,8 +158,9 @@ class ReadingLists:
         res = self._connection.query(
             """
             SELECT list_id, list_name FROM reading_list_names
-            WHERE user_id={};
-            """.format(user_id)
+            WHERE user_id=%s;
+            """,
+            (user_id,)
         )
 
         lists = dict()
@@ -155,9 +168,9 @@ class ReadingLists:
             list_id, list_name = k
             in_list = bool(len(self._connection.query("""
                 SELECT book_id FROM reading_lists
-                WHERE list_id={list_id}
-                    AND book_id={book_id};
-            """.format(list_id=list_id, book_id=book_id))))
+                WHERE list_id=%s
+                    AND book_id=%s;
+            """, (list_id, book_id))))
             lists[i] = {
                 "id": list_id,
                 "list_name": list_name,
@@ -196,16 +209,13 @@ class ReadingLists:
                 ON books.author_id=authors.author_id
                 INNER JOIN reading_list_names
                 ON reading_list_names.list_id=reading_lists.list_id
-                WHERE reading_lists.list_id={list_id}
-                    AND reading_lists.user_id={user_id}
+                WHERE reading_lists.list_id=%s
+                    AND reading_lists.user_id=%s
                 ORDER BY reading_lists.date_added DESC, books.title ASC;
-            """.format(
-                list_id=list_id,
-                user_id=user_id  # This is not strictly necessary, but helps
-                # protect against people being able to view other people's list
-                # contents by guessing the list id.# Prevent any null values -
-                # replace with 0s.
-            )
+            """,
+            (list_id, user_id)  # The user id is not strictly necessary, but helps
+            # protect against people being able to view other people's list
+            # contents by guessing the list id.
         )
 
         queue = data_structures.Queue()
@@ -214,23 +224,23 @@ class ReadingLists:
 
         list_name = self._connection.query("""
             SELECT list_name FROM reading_list_names
-            WHERE list_id={};
-        """.format(list_id))[0][0]  # See which list the button would move too.
+            WHERE list_id=%s;
+        """, (list_id,))[0][0]  # See which list the button would move too.
 
         if list_name == "Currently Reading":
             button = "Mark as Read"
             move_target = self._connection.query("""
                 SELECT list_id FROM reading_list_names
                 WHERE list_name="Have Read"
-                    AND user_id={};
-            """.format(user_id))[0][0]
+                    AND user_id=%s;
+            """, (user_id,))[0][0]
         elif list_name == "Want to Read":
             button = "Start Reading"
             move_target = self._connection.query("""
                 SELECT list_id FROM reading_list_names
                 WHERE list_name="Currently Reading"
-                    AND user_id={};
-            """.format(user_id))[0][0]
+                    AND user_id=%s;
+            """, (user_id,))[0][0]
         else:
             button = None
             move_target = None
@@ -260,14 +270,11 @@ class ReadingLists:
     def remove_entry(self, user_id, list_id, book_id):
         self._connection.query("""
         DELETE FROM reading_lists
-        WHERE user_id={user_id}
-            AND book_id={book_id}
-            AND list_id={list_id};
-        """.format(
-            book_id=book_id,
-            user_id=user_id,
-            list_id=list_id
-        ))
+        WHERE user_id=%s
+            AND book_id=%s
+            AND list_id=%s;
+        """, (user_id, book_id, list_id))
+        self._cache.invalidate(POPULAR_CACHE_KEY)
 
     def add_entry(self, user_id, list_id, book_id):
         self._recommendations.delete_recommendation(user_id, book_id, bad_recommendation=False)
@@ -280,25 +287,22 @@ class ReadingLists:
             lists = {i[0] for i in self._connection.query("""
                 SELECT list_id FROM reading_list_names
                 WHERE list_name IN ("Currently Reading", "Have Read", "Want to Read")
-                    AND user_id={}
-            """.format(user_id))}
+                    AND user_id=%s
+            """, (user_id,))}
 
             if list_id in lists:
                 self._connection.query("""
                     DELETE FROM reading_lists
-                    WHERE user_id={user_id}
-                        AND book_id={book_id}
-                """.format(book_id=book_id, user_id=user_id))
+                    WHERE user_id=%s
+                        AND book_id=%s
+                """, (user_id, book_id))
                 # Delete entry from other lists to prevent duplicates
 
             self._connection.query("""
                 INSERT INTO reading_lists (user_id, book_id, list_id) VALUES 
-                ({user_id}, {book_id}, {list_id});
-            """.format(
-                user_id=user_id,
-                book_id=book_id,
-                list_id=list_id
-            ))
+                (%s, %s, %s);
+            """, (user_id, book_id, list_id))
+            self._cache.invalidate(POPULAR_CACHE_KEY)
 
     def move_entry(self, user_id, start_list_id, end_list_id, book_id):
         self.add_entry(user_id, end_list_id, book_id)  # This changes the date
@@ -313,24 +317,26 @@ class ReadingLists:
         # still require session id, so cannot be done accidentally.
         self._connection.query("""
             DELETE FROM reading_lists
-            WHERE list_id={list_id}
-                AND user_id={user_id};
-        """.format(list_id=list_id, user_id=user_id))
+            WHERE list_id=%s
+                AND user_id=%s;
+        """, (list_id, user_id))
         # Only the specific users list will be deleted, as it targets the single
         # list
 
         self._connection.query("""
             DELETE FROM reading_list_names
-            WHERE list_id={list_id}
-                AND user_id={user_id}
-        """.format(list_id=list_id, user_id=user_id))
+            WHERE list_id=%s
+                AND user_id=%s
+        """, (list_id, user_id))
         # Delete the list name
 
+        self._cache.invalidate(POPULAR_CACHE_KEY)
+
     def create_list(self, user_id, list_name):
         self._connection.query("""
             INSERT INTO reading_list_names (user_id, list_name) VALUES
-            ({user_id}, "{list_name}")
-        """.format(user_id=user_id, list_name=list_name))
+            (%s, %s)
+        """, (user_id, list_name))
     
     def get_most_recent_read(self, user_id):
         res = self._connection.query("""
@@ -340,11 +346,11 @@ class ReadingLists:
             INNER JOIN reading_list_names
                 ON reading_lists.list_id=reading_list_names.list_id
             INNER JOIN books ON books.book_id=reading_lists.book_id
-            WHERE reading_lists.user_id={}
+            WHERE reading_lists.user_id=%s
                 AND reading_list_names.list_name="Have Read"
             ORDER BY reading_lists.date_added DESC
             LIMIT 1;
-        """.format(user_id))
+        """, (user_id,))
 
         if len(res) > 0:
             return res[0]
@@ -358,11 +364,11 @@ class ReadingLists:
             INNER JOIN reading_list_names
                 ON reading_lists.list_id=reading_list_names.list_id
             INNER JOIN books ON books.book_id=reading_lists.book_id
-            WHERE reading_lists.user_id={}
+            WHERE reading_lists.user_id=%s
                 AND reading_list_names.list_name!="Have Read"
             ORDER BY reading_lists.date_added DESC
             LIMIT 1;
-        """.format(user_id))
+        """, (user_id,))
 
         if len(res) > 0:
             return res[0]
@@ -2,9 +2,14 @@
 # Standard Python library imports
 # -----------------------------------------------------------------------------
 import math
+import time
 import random
 import datetime
+import concurrent.futures
+import multiprocessing.shared_memory
 import numpy as np
+import scipy.linalg
+import scipy.sparse
 import sklearn.metrics
 
 # -----------------------------------------------------------------------------
@@ -18,7 +23,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 import configuration
+import data_structures
 import mysql_handler
+import nearest_neighbours
 
 # -----------------------------------------------------------------------------
 # Project imports
@@ -28,6 +35,201 @@ class NoUserPreferencesError(Exception):
         message = f"User with id {user_id}, has no preferences"
         super().__init__(message)
 
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+DENSE_MATRIX_LIMIT = 1000000  # Number of users x books, below which the review matrix is kept dense. 1 million 64 bit
+# floats is 8MB.
+FACTORS_FILE_VERSION = 1  # Increase if the format of the saved factors changes, so old files are not used
+DEFAULT_CONFIDENCE_WEIGHT = 10  # How much more an observed rating counts than an unobserved one, per unit of rating
+RECOMMENDATION_BATCH_SIZE = 4000000  # Number of users x books scored at once in gen_recommendations. 4 million 64 bit
+# floats is 32MB.
+
+# -----------------------------------------------------------------------------
+# Weighted ALS row solves
+# -----------------------------------------------------------------------------
+def solve_weighted_rows(indptr, indices, data, fixed, gram, confidence_weight, output, start_row, end_row):
+    # Implicit feedback ALS (Hu, Koren and Volinsky). Unrated entries are treated as a rating of 0 with a weight of 1,
+    # and rated entries have a confidence of 1 + confidence_weight * rating, so each row needs its own solve:
+    #     (FᵀC F + λI) x = FᵀC r
+    # FᵀC F = FᵀF + Fᵀ(C - I)F, and C - I is 0 for every unrated entry, so gram (FᵀF + λI) is only calculated once, and
+    # each row only adds the correction for the entries it has rated. indptr, indices and data are the arrays of a CSR
+    # matrix.
+    for row in range(start_row, end_row):
+        start, end = indptr[row], indptr[row + 1]
+        if start == end:
+            output[row] = 0  # No ratings, so the solution is 0
+            continue
+
+        rated = fixed[indices[start:end]]
+        values = data[start:end]
+        confidence = 1 + confidence_weight * values
+
+        A = gram + (rated.T * (confidence - 1)).dot(rated)
+        B = rated.T.dot(confidence * values)
+        output[row] = scipy.linalg.cho_solve(scipy.linalg.cho_factor(A), B)
+
+
+_attached_arrays = dict()  # Shared arrays this process has already attached to, so they are only attached once
+
+
+def _attach_shared_array(name, shape, dtype):
+    if name not in _attached_arrays:
+        memory = multiprocessing.shared_memory.SharedMemory(name=name)
+        _attached_arrays[name] = (memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf))  # The memory object must
+        # be kept, otherwise the buffer is closed
+    return _attached_arrays[name][1]
+
+
+def _solve_shared_weighted_rows(ratings, fixed, output, gram, confidence_weight, start_row, end_row):
+    # Run in the worker processes. Arrays are passed as (name, shape, dtype) of their shared memory blocks.
+    indptr, indices, data = (_attach_shared_array(*i) for i in ratings)
+    solve_weighted_rows(
+        indptr,
+        indices,
+        data,
+        _attach_shared_array(*fixed),
+        gram,
+        confidence_weight,
+        _attach_shared_array(*output),
+        start_row,
+        end_row
+    )
+
+
+class ParallelWeightedSolver:
+    # Splits the rows of each weighted ALS half step into blocks, and solves them across a pool of processes. The
+    # ratings, the fixed factors and the results are kept in shared memory, so only the names of the memory blocks and
+    # the row range are sent with each task, rather than pickling the matrices every time.
+    def __init__(self, matrices, num_factors, hyperparam, confidence_weight, workers):
+        self._num_factors = num_factors
+        self._hyperparam = hyperparam
+        self._confidence_weight = confidence_weight
+        self._memory = []
+        self._matrices = []
+
+        for ratings in matrices:  # Each must be a CSR matrix
+            blocks = np.searchsorted(ratings.indptr, np.linspace(0, ratings.nnz, (workers * 4) + 1)[1:-1])  # Blocks
+            # have a similar number of ratings rather than rows, so the work is split evenly
+            blocks = np.unique(np.concatenate(([0], blocks, [ratings.shape[0]])))
+
+            self._matrices.append({
+                "matrix": ratings,
+                "ratings": [self._share(ratings.indptr), self._share(ratings.indices), self._share(ratings.data)],
+                "fixed": self._share(np.zeros((ratings.shape[1], num_factors))),
+                "output": self._share(np.zeros((ratings.shape[0], num_factors))),
+                "blocks": list(zip(blocks[:-1], blocks[1:]))
+            })
+
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    def _share(self, array):
+        memory = multiprocessing.shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+        shared[:] = array
+        self._memory.append(memory)
+        return (memory.name, array.shape, array.dtype.str), shared
+
+    def weighted_wals_step(self, ratings, fixed):
+        # Same as Recommendations.weighted_wals_step, but ratings must be one of the matrices the solver was created with
+        shared = next(i for i in self._matrices if i["matrix"] is ratings)
+        shared["fixed"][1][:] = fixed
+
+        gram = fixed.T.dot(fixed) + np.eye(self._num_factors) * self._hyperparam
+        futures = [
+            self._executor.submit(
+                _solve_shared_weighted_rows,
+                [i[0] for i in shared["ratings"]],
+                shared["fixed"][0],
+                shared["output"][0],
+                gram,
+                self._confidence_weight,
+                start_row,
+                end_row
+            ) for start_row, end_row in shared["blocks"]
+        ]
+        for future in futures:
+            future.result()  # Waits for the block to finish, and raises any exception from the worker
+
+        return shared["output"][1].copy()  # Copied, as the shared output is overwritten by the next step
+
+    def close(self):
+        self._executor.shutdown()
+        self._matrices = []  # Arrays using the shared memory must be removed before it can be closed
+        for memory in self._memory:
+            memory.close()
+            memory.unlink()
+        self._memory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# -----------------------------------------------------------------------------
+# Convergence
+# -----------------------------------------------------------------------------
+class ConvergenceMonitor:
+    # Decides when fit can stop iterating. The criterion is either "loss", the relative change of the training error, or
+    # "factors", the largest relative change of the user and book factor matrices (Frobenius norm of the change / norm
+    # of the previous factors). It has converged once the change has been below tolerance for patience iterations in a
+    # row, and a tolerance of 0 never converges. If max_time (seconds) is given, it stops once the time since start has
+    # exceeded it, even if it has not converged.
+    def __init__(self, tolerance=0, patience=1, max_time=None, criterion="loss"):
+        if criterion not in ("loss", "factors"):
+            raise ValueError(f"Unknown convergence criterion '{criterion}'")
+        self._tolerance = tolerance
+        self._patience = patience
+        self._max_time = max_time
+        self._criterion = criterion
+        self.start()
+
+    def start(self):
+        self._start_time = time.time()
+        self._previous = None
+        self._num_below_tolerance = 0
+        self.change_record = []
+
+    @property
+    def needs_loss(self):
+        return self._criterion == "loss" and self._tolerance > 0  # So the loss is not calculated if it is not used
+
+    def update(self, user_factors, book_factors, loss=None):
+        # Returns True if the iterations should stop. The previous factors are kept by reference rather than copied, as
+        # each step creates new factor matrices.
+        current = loss if self._criterion == "loss" else (user_factors, book_factors)
+
+        if self._previous is not None and current is not None:
+            if self._criterion == "loss":
+                change = self.relative_change(self._previous, current)
+            else:
+                change = max(
+                    self.relative_change(self._previous[0], current[0]),
+                    self.relative_change(self._previous[1], current[1])
+                )
+            self.change_record.append(change)
+
+            if change < self._tolerance:
+                self._num_below_tolerance += 1
+            else:
+                self._num_below_tolerance = 0
+
+        self._previous = current
+
+        if self._tolerance > 0 and self._num_below_tolerance >= self._patience:
+            return True
+        return bool(self._max_time) and time.time() - self._start_time > self._max_time
+
+    @staticmethod
+    def relative_change(previous, current):
+        norm = np.linalg.norm(previous)
+        if norm == 0:
+            return 0 if np.linalg.norm(current) == 0 else math.inf
+        return np.linalg.norm(current - previous) / norm
+
+
 # -----------------------------------------------------------------------------
 # Recommendations
 # -----------------------------------------------------------------------------
@@ -44,13 +246,40 @@ class Recommendations:
             bad_recommendation_value,
             minimum_required_reviews,
             number_recommendations,
-            debug=False
+            debug=False,
+            dense_matrix_limit=DENSE_MATRIX_LIMIT,
+            weighted=False,
+            confidence_weight=DEFAULT_CONFIDENCE_WEIGHT,
+            convergence_tolerance=0,
+            convergence_patience=1,
+            max_fit_time=None,
+            convergence_criterion="loss",
+            factors_path=None,
+            candidate_engine="exact",
+            candidate_engine_options=None
         ):
         self._connection = connection
         self._num_converge_iters = num_converge_iters
         self._hyperparam = hyperparam
         self._num_factors = len(self._connection.query("SELECT * FROM genres"))
         self.debug = debug
+        self._dense_matrix_limit = dense_matrix_limit
+        self._weighted = weighted  # Use weighted_wals_step rather than wals_step. Only the weighted step can be split
+        # across processes - see fit.
+        self._confidence_weight = confidence_weight
+        self._convergence_monitor = ConvergenceMonitor(
+            convergence_tolerance,
+            convergence_patience,
+            max_fit_time,
+            convergence_criterion
+        )
+        self.num_iterations = 0  # Number of iterations the last fit ran for, which can be less than num_converge_iters
+        self._factors_path = factors_path  # .npz file the factors are saved to after fitting, and the next fit starts
+        # from. None means the factors are not saved, and every fit starts from random factors.
+        self._book_gram_cache = None  # See _book_gram
+        self._candidate_engine = candidate_engine  # Finds the books with the highest score for each user in
+        # gen_recommendations. See nearest_neighbours.ENGINES
+        self._candidate_engine_options = candidate_engine_options or dict()
         self._num_users = len(self._connection.query("SELECT user_id FROM users"))
         self._num_books = len(self._connection.query("SELECT book_id FROM books"))
         self._number_recommendations = number_recommendations
@@ -62,6 +291,7 @@ class Recommendations:
         self._num_display_genres = number_display_genres
         self.test_mse_record = []
         self.train_mse_record = []
+        self.time_record = []
         self._list_users_no_preferences = {i[0] for i in self._connection.query(
             "SELECT user_id FROM users WHERE preferences_set=FALSE")}
         # Uses a set as it is faster for 'item in var' operations
@@ -73,176 +303,335 @@ class Recommendations:
 
         self.gen_lookup_tables()
         self._load_book_factors()
+        self.user_factors = np.zeros((self._num_users, self._num_factors))  # Only known after fit, or fold_in_user
 
     def _load_book_factors(self):
         self.book_factors = np.zeros((self._num_books, self._num_factors))
 
-        res = self._connection.query("""
+        res = self._connection.stream("""
             SELECT book_id,
                 GROUP_CONCAT(match_strength ORDER BY genre_id),
                 GROUP_CONCAT(genre_id ORDER BY genre_id)
             FROM book_genres
             GROUP BY book_id
-        """)
+        """)  # Streamed, as there is a row for every book
 
         for i, j, k in res:
-            book_id = list(self.book_lookup_table.keys())[list(self.book_lookup_table.values()).index(i)]
+            book = self.book_lookup_table.get_index(i)
             match_strengths = [float(z) for z in j.split(",")]
-            genre_ids = [list(self.genre_lookup_table.keys())[list(self.genre_lookup_table.values()).index(int(z))] for z in k.split(",")]
+            genres = self.genre_lookup_table.get_indexes(k.split(","))
 
-            for genre, match in zip(genre_ids, match_strengths):
-                self.book_factors[book_id][genre] = match
+            self.book_factors[book, genres] = match_strengths
 
-    def fit(self):
+    def fit(self, workers=1):
+        # workers is the number of processes used for the weighted step, and is ignored by the unweighted step, which
+        # always runs in this process. Only its Cholesky solve, and the product with dense ratings, use more than one
+        # core, through the BLAS library numpy uses - the product with sparse ratings uses one.
         train, test, = self.create_train_test()
 
         self._num_users, self._num_books = train.shape
 
         self.book_factors = np.random.random((self._num_books, self._num_factors))
         self.user_factors = np.random.random((self._num_users, self._num_factors))
+        self.load_factors()  # Replaces the random factors of any users and books from the previous fit
+
+        solver = None
+        if self._weighted:
+            step = self.weighted_wals_step
+            train = scipy.sparse.csr_matrix(train)  # The weighted step works through the stored ratings of each row
+            train_t = train.T.tocsr()
+            if workers > 1:
+                solver = ParallelWeightedSolver(
+                    (train, train_t),
+                    self._num_factors,
+                    self._hyperparam,
+                    self._confidence_weight,
+                    workers
+                )
+                step = solver.weighted_wals_step
+        else:
+            step = self.wals_step
+            train_t = train.T  # Transposing a CSR matrix gives a CSC matrix without copying, so is only done once
+
+        try:
+            return self._fit_iterations(step, train, train_t, test)
+        finally:
+            if solver is not None:
+                solver.close()  # Always stops the worker processes and frees the shared memory
+
+    def _fit_iterations(self, step, train, train_t, test):
+        # num_converge_iters is the maximum number of iterations - it stops earlier if the convergence monitor finds
+        # that the factors have stopped changing, or it has run out of time.
+        self._convergence_monitor.start()
+        self.num_iterations = 0
 
         if self.debug:  # Debug is about 10 times slower
             self.test_mse_record = []
             self.train_mse_record = []
+            self.time_record = []  # Cumulative time of the steps, excluding the error calculations, to compare speed
 
             for i in range(self._num_converge_iters):
                 print(f"Iteration {i + 1} of {self._num_converge_iters} Start")
-                self.user_factors = self.wals_step(train, self.book_factors)
-                self.book_factors = self.wals_step(train.T, self.user_factors)
-
-                predict = self.predict()
-
-                self.train_mse_record.append(self.mean_squared_error(train, predict))
-                self.test_mse_record.append(self.mean_squared_error(test, predict))
+                step_start_time = time.time()
+                self.user_factors = step(train, self.book_factors)
+                self.book_factors = step(train_t, self.user_factors)
+                self.time_record.append(time.time() - step_start_time + (self.time_record[-1] if i else 0))
+                self.num_iterations += 1
+
+                self.train_mse_record.append(self.rated_mean_squared_error(train))
+                self.test_mse_record.append(self.rated_mean_squared_error(test))
                 print(f"Iteration {i + 1} of {self._num_converge_iters} End")
 
+                if self._convergence_monitor.update(self.user_factors, self.book_factors, self.train_mse_record[-1]):
+                    print(f"Stopped after iteration {i + 1}")
+                    break
+
             return self.test_mse_record, self.train_mse_record
 
         else:
             for i in range(self._num_converge_iters):
-                self.user_factors = self.wals_step(train, self.book_factors)
-                self.book_factors = self.wals_step(train.T, self.user_factors)
+                self.user_factors = step(train, self.book_factors)
+                self.book_factors = step(train_t, self.user_factors)
+                self.num_iterations += 1
+
+                loss = None
+                if self._convergence_monitor.needs_loss:
+                    loss = self.rated_mean_squared_error(train)  # Only uses the rated entries, so is cheap compared to a step
+
+                if self._convergence_monitor.update(self.user_factors, self.book_factors, loss):
+                    break
 
             self.save_book_genres()  # Not included in the debug option, as it increases time cost,
             # and would likely be rerun a lot to find optimum parameters, so is unnecessary.
+            self.save_factors()
+
+    def save_factors(self):
+        # Saves the factors with the ids of their rows, so that they can still be matched to the right users and books
+        # after users and books have been added or removed.
+        if self._factors_path is None:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self._factors_path)), exist_ok=True)
+        temp_path = self._factors_path + ".tmp.npz"  # Written then renamed, so a partially written file is never read
+        np.savez(
+            temp_path,
+            version=FACTORS_FILE_VERSION,
+            user_ids=self.user_lookup_table.ids,
+            book_ids=self.book_lookup_table.ids,
+            genre_ids=self.genre_lookup_table.ids,
+            user_factors=self.user_factors,
+            book_factors=self.book_factors
+        )
+        os.replace(temp_path, self._factors_path)
+
+    def load_factors(self):
+        # Copies the saved factors into user_factors and book_factors for every user and book that was in the previous
+        # fit. New users and books keep their current values. The file is ignored if it is from a different version, or
+        # the genres (the factors) have changed. Returns whether the file was used.
+        if self._factors_path is None or not os.path.exists(self._factors_path):
+            return False
+
+        with np.load(self._factors_path) as saved:
+            if int(saved["version"]) != FACTORS_FILE_VERSION or \
+                    not np.array_equal(saved["genre_ids"], self.genre_lookup_table.ids):
+                return False
+
+            for factors, lookup_table, ids, saved_factors in (
+                    (self.user_factors, self.user_lookup_table, saved["user_ids"], saved["user_factors"]),
+                    (self.book_factors, self.book_lookup_table, saved["book_ids"], saved["book_factors"])):
+                saved_lookup_table = data_structures.LookupTable(ids)
+                found = np.isin(lookup_table.ids, ids)
+                factors[found] = saved_factors[saved_lookup_table.get_indexes(lookup_table.ids[found])]
+
+        return True
 
     def save_book_genres(self):
-        query = "INSERT INTO book_genres (book_id, genre_id, match_strength) VALUES "
-        for count, facts in enumerate(self.book_factors):
-            # i will be the rating for each the genres.
-            book_id = self.book_lookup_table[count]
-            temp = ",".join(f"({book_id}, {self.genre_lookup_table[i]}, {strength})" for i, strength in enumerate(facts) if strength > 0)
-            if len(temp):
-                query += temp + ","
-
-        self._connection.query("DELETE FROM book_genres")  # Done here to minimise time without data in DB
-        self._connection.query(query[:-1])
+        books, genres = np.nonzero(self.book_factors > 0)
+        self._connection.bulk_replace(
+            "book_genres",
+            ["book_id", "genre_id", "match_strength"],
+            zip(
+                self.book_lookup_table.get_ids(books).tolist(),  # tolist converts to python types, which the
+                self.genre_lookup_table.get_ids(genres).tolist(),  # connector can convert to MySQL types
+                self.book_factors[books, genres].tolist()
+            )
+        )  # Replaced in one transaction, so the table is never empty, and is kept if saving fails
 
     def predict(self):
         return self.user_factors.dot(self.book_factors.T)
 
     def gen_review_matrix(self):
-        # x = np.array([[0.0 for i in range(num_books)] for k in range(num_users)])
-        mat = np.zeros((self._num_users, self._num_books))
-        for user in self.user_lookup_table:
-            user_id = self.user_lookup_table[user]
-            #    Reviews    #
-            reviews = self._connection.query("""
-                SELECT book_id,
-                    (overall_rating + IFNULL(character_rating, overall_rating) + IFNULL(plot_rating, overall_rating)) / 3
-                FROM reviews
-                WHERE user_id={}
-                GROUP BY review_id;
-            """.format(user_id))
-
-            for book_id, rating in reviews:
-                used_book_id = list(self.book_lookup_table.values()).index(book_id)  # This finds the key for the value stored in the lookup table.
-                # geeksforgeeks.org/python-get-key-from-value-in-dictionary
-                mat[user][used_book_id] = float(rating)
-
-            #    Initial Preferences    #
-            books = self._connection.query("""
-                SELECT books.book_id
-                FROM initial_preferences
-                INNER JOIN books
-                    ON books.author_id=initial_preferences.author_id
-                WHERE initial_preferences.user_id={}
-                GROUP BY books.book_id
-            """.format(user_id))  # Get a user's existing preferences
-
-            if len(reviews) <= self._min_required_reviews:
-                if len(books):
-                    for i in books:
-                        used_book_id = list(self.book_lookup_table.values()).index(i[0])
-                        mat[user][used_book_id] += self._initial_recommendation_mat_val  # This is a non-zero value so recommendation is made.
-                        # This is not affected by the average preference expressed by all the user's selected authors.
-                else:
-                    continue # The user has not set up any initial preferences yet.
-            elif len(books):
-                self._connection.query("""
-                    DELETE FROM initial_preferences
-                    WHERE user_id={}
-                """.format(user_id))
+        # Each signal is loaded for every user with a single query, rather than a set of queries per user. The matrix
+        # is sparse, as most users have only interacted with a very small number of the books, so only the entries that
+        # any signal refers to are stored, in the values array. The signals are applied in the same order as they would
+        # be for a single user, as the later ones depend on the values set by earlier ones.
+
+        #    Reviews    #
+        reviews = self._load_signal("""
+            SELECT user_id,
+                book_id,
+                (overall_rating + IFNULL(character_rating, overall_rating) + IFNULL(plot_rating, overall_rating)) / 3
+            FROM reviews
+            GROUP BY review_id
+            ORDER BY review_id;
+        """)  # Ordered so that if a user has reviewed a book more than once, the newest review is used
+
+        num_reviews = np.bincount(reviews[0], minlength=self._num_users)
+
+        #    Initial Preferences    #
+        preferences = self._load_signal("""
+            SELECT initial_preferences.user_id,
+                books.book_id
+            FROM initial_preferences
+            INNER JOIN books
+                ON books.author_id=initial_preferences.author_id
+            GROUP BY initial_preferences.user_id, books.book_id
+        """)  # Get every user's existing preferences
+
+        has_preferences = np.bincount(preferences[0], minlength=self._num_users) > 0
+        few_reviews = num_reviews <= self._min_required_reviews
+
+        skipped = few_reviews & ~has_preferences  # The user has not set up any initial preferences yet, so only the
+        # reviews are used.
+
+        remove = self.user_lookup_table.get_ids(np.nonzero(~few_reviews & has_preferences)[0])
+        if len(remove):
+            self._connection.query("""
+                DELETE FROM initial_preferences
+                WHERE user_id IN ({})
+            """.format(",".join(["%s"] * len(remove))), [int(i) for i in remove])
+
+        #    Reading Lists    #
+        lists = self._load_signal("""
+            SELECT reading_lists.user_id,
+                reading_lists.book_id
+            FROM reading_lists
+            INNER JOIN reading_list_names
+                ON reading_lists.list_id=reading_list_names.list_id
+            GROUP BY reading_lists.user_id, reading_lists.book_id;
+        """, skipped)
+
+        #    Authors following    #
+        following = self._load_signal("""
+            SELECT author_followers.user_id,
+                books.book_id
+            FROM author_followers
+            INNER JOIN books
+                ON books.author_id=author_followers.author_id
+        """, skipped)
+
+        #    Bad Recommendations    #
+        bad_recommendations = self._indexes_from_rows([
+            (user_id, book_id)
+            for user_id, books in self.get_all_bad_recommendations(
+                self.user_lookup_table.get_ids(np.nonzero(~skipped)[0])
+            ).items()
+            for book_id in books
+        ])  # Only the users that are not skipped, so the others' expired bad recommendations are not deleted
+
+        #    Diary entries    #
+        entries = self._load_signal("""
+            SELECT user_id,
+                book_id,
+                (SUM(overall_rating) + SUM(IFNULL(character_rating, overall_rating)) + SUM(IFNULL(plot_rating, overall_rating))) / (COUNT(entry_id) * 3)
+            FROM diary_entries
+            GROUP BY user_id, book_id;
+        """, skipped)
+
+        keys = np.unique(np.concatenate([
+            self._matrix_keys(users, books)
+            for users, books, _ in (reviews, preferences, lists, following, bad_recommendations, entries)
+        ]))  # Every entry in the matrix that may be non-zero, sorted so positions can be found with a binary search
+        values = np.zeros(len(keys))
+
+        users, books, ratings = reviews
+        for i in self._unique_pairs(users, books):
+            values[np.searchsorted(keys, self._matrix_keys(users[i], books[i]))] = ratings[i]
+
+        users, books, _ = preferences
+        keep = few_reviews[users]
+        values[np.searchsorted(keys, self._matrix_keys(users[keep], books[keep]))] += self._initial_recommendation_mat_val
+        # This is a non-zero value so recommendation is made. This is not affected by the average preference expressed
+        # by all the user's selected authors.
+
+        for (users, books, _), increase in (
+                (lists, self._reading_list_percentage_increase),
+                (following, self._following_percentage_increase)):
+            for i in self._unique_pairs(users, books):
+                positions = np.searchsorted(keys, self._matrix_keys(users[i], books[i]))
+                values[positions] = np.where(
+                    values[positions] == 0,
+                    self._initial_recommendation_mat_val,
+                    values[positions] * (1 + increase)
+                )
 
-            #    Reading Lists    #
-            lists = self._connection.query("""
-                SELECT reading_lists.book_id
-                FROM reading_lists
-                INNER JOIN reading_list_names
-                    ON reading_lists.list_id=reading_list_names.list_id
-                WHERE reading_lists.user_id={}
-                GROUP BY reading_lists.book_id;
-            """.format(user_id))
-
-            for i in lists:
-                used_book_id = list(self.book_lookup_table.values()).index(i[0])
-                if mat[user][used_book_id] == 0:
-                    mat[user][used_book_id] = self._initial_recommendation_mat_val
-                else:
-                    mat[user][used_book_id] *= (1 + self._reading_list_percentage_increase)
-
-            #    Authors following    #
-            following = self._connection.query("""
-                SELECT books.book_id
-                FROM author_followers
-                INNER JOIN books
-                    ON books.author_id=author_followers.author_id
-                WHERE user_id={}
-            """.format(user_id))
-
-            for i in following:
-                used_book_id = list(self.book_lookup_table.values()).index(int(i[0]))
-                if mat[user][used_book_id] == 0:
-                    mat[user][used_book_id] = self._initial_recommendation_mat_val
-                else:
-                    mat[user][used_book_id] *= (1 + self._following_percentage_increase)
-
-            #    Bad Recommendations    #
-            for book in self.get_bad_recommendations(user_id):
-                used_book_id = list(self.book_lookup_table.values()).index(book)
-                mat[user][used_book_id] = self._bad_recommendation_val  # = is used in case there is a good value here. It should be marked as bad.
-
-            #    Diary entries    #
-            entries = self._connection.query("""
-                SELECT book_id,
-                    (SUM(overall_rating) + SUM(IFNULL(character_rating, overall_rating)) + SUM(IFNULL(plot_rating, overall_rating))) / (COUNT(entry_id) * 3)
-                FROM diary_entries
-                WHERE user_id={}
-                GROUP BY book_id;
-            """.format(user_id))
-
-            for book_id, rating in entries:
-                used_book_id = list(self.book_lookup_table.values()).index(book_id)
-                mat[user][used_book_id] += float(rating)  # += is used incase there is already a value at that index
+        users, books, _ = bad_recommendations
+        values[np.searchsorted(keys, self._matrix_keys(users, books))] = self._bad_recommendation_val  # = is used in
+        # case there is a good value here. It should be marked as bad.
+
+        users, books, ratings = entries
+        values[np.searchsorted(keys, self._matrix_keys(users, books))] += ratings  # += is used incase there is already
+        # a value at that index
 
+        mat = scipy.sparse.csr_matrix(
+            (values, (keys // self._num_books, keys % self._num_books)),
+            shape=(self._num_users, self._num_books)
+        )
+        mat.eliminate_zeros()  # Entries can be set back to 0, eg. bad_recommendation_value
+
+        if self._num_users * self._num_books <= self._dense_matrix_limit:
+            return mat.toarray()  # Dense matrices are faster for a small number of users and books
         return mat
 
+    def _matrix_keys(self, users, books):
+        return users.astype(np.int64) * self._num_books + books  # Single integer for each position in the matrix
+
+    def _load_signal(self, query, skipped=None):
+        return self._indexes_from_rows(self._connection.query(query), skipped)
+
+    def _indexes_from_rows(self, rows, skipped=None):
+        # Converts (user_id, book_id) or (user_id, book_id, value) rows into arrays of matrix indexes. Users that are not
+        # in the lookup table, as they were created after it was generated, and users in skipped are removed.
+        rows = [i for i in rows if self.user_lookup_table.contains_id(i[0])]
+
+        users = self.user_lookup_table.get_indexes([i[0] for i in rows])
+        books = self.book_lookup_table.get_indexes([i[1] for i in rows])
+        values = np.fromiter((float(i[2]) for i in rows if len(i) > 2), dtype=np.float64)
+
+        if skipped is not None:
+            keep = ~skipped[users]
+            users, books = users[keep], books[keep]
+            if len(values):
+                values = values[keep]
+
+        return users, books, values
+
+    def _unique_pairs(self, users, books):
+        # Yields masks that split the (user, book) pairs into groups with no repeated pairs, in the order that they
+        # occur. Applying each group in turn with numpy indexing gives the same result as applying each row in turn.
+        keys = self._matrix_keys(users, books)
+        order = np.argsort(keys, kind="stable")  # Stable so repeats stay in the order they were returned in
+        sorted_keys = keys[order]
+
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        group_start = np.maximum.accumulate(np.where(first, np.arange(len(keys)), 0))
+
+        occurrence = np.empty(len(keys), dtype=np.intp)
+        occurrence[order] = np.arange(len(keys)) - group_start
+
+        for i in range(occurrence.max() + 1 if len(keys) else 0):
+            yield occurrence == i
+
     def create_train_test(self, ratings=None):
         if ratings is None:
             self.ratings = self.gen_review_matrix()
         else:
             self.ratings = ratings
 
+        if scipy.sparse.issparse(self.ratings):
+            return self._create_sparse_train_test()
+
         train = self.ratings.copy()
 
         while self.ratings.tolist() == train.tolist():
@@ -260,115 +649,167 @@ class Recommendations:
 
         return train, self.ratings
 
+    def _create_sparse_train_test(self):
+        # Same as the dense version - roughly 20% of each user's ratings (chosen with replacement) are removed from the
+        # training set - but works directly on the stored values of the CSR matrix.
+        self.ratings = self.ratings.tocsr()
+        self.ratings.eliminate_zeros()
+
+        row_lengths = np.diff(self.ratings.indptr)
+        num_removed = np.round(row_lengths * 0.2).astype(np.intp)
+        if not num_removed.sum():
+            return self.ratings.copy(), self.ratings  # No user has enough ratings for any to be removed
+
+        row_starts = np.repeat(self.ratings.indptr[:-1], num_removed)
+        row_sizes = np.repeat(row_lengths, num_removed)
+
+        train = self.ratings.copy()
+        while train.nnz == self.ratings.nnz:
+            train = self.ratings.copy()
+            train.data[row_starts + np.floor(np.random.random(len(row_starts)) * row_sizes).astype(np.intp)] = 0.0
+            train.eliminate_zeros()
+
+        return train, self.ratings
+
     def wals_step(self, ratings, fixed):
         A = fixed.T.dot(fixed) + np.eye(self._num_factors) * self._hyperparam
-        B = ratings.dot(fixed)
-        A_inv = np.linalg.inv(A)
-        return B.dot(A_inv)
+        B = ratings.dot(fixed)  # Works for both dense and sparse ratings, and always gives a dense result
+        return scipy.linalg.cho_solve(scipy.linalg.cho_factor(A), B.T).T  # A is symmetric positive definite, so a
+        # Cholesky solve can be used, which is faster and more stable than calculating the inverse
+
+    def weighted_wals_step(self, ratings, fixed):
+        # See solve_weighted_rows. ratings must be a CSR matrix.
+        gram = fixed.T.dot(fixed) + np.eye(self._num_factors) * self._hyperparam
+        result = np.zeros((ratings.shape[0], self._num_factors))
+        solve_weighted_rows(
+            ratings.indptr,
+            ratings.indices,
+            ratings.data,
+            fixed,
+            gram,
+            self._confidence_weight,
+            result,
+            0,
+            ratings.shape[0]
+        )
+        return result
 
     def gen_lookup_tables(self):
-        self.user_lookup_table = dict()
+        # Index -> id is used when writing results back to the database, and id -> index when reading ratings in, so
+        # both directions need to be constant time, rather than searching the values of a dictionary.
         users = self._connection.query("SELECT user_id FROM users")
-        for count, i in enumerate(users):
-            self.user_lookup_table[count] = i[0]
+        self.user_lookup_table = data_structures.LookupTable([i[0] for i in users])
 
-        self.book_lookup_table = dict()
         books = self._connection.query("SELECT book_id FROM books")
-        for count, i in enumerate(books):
-            self.book_lookup_table[count] = i[0]
+        self.book_lookup_table = data_structures.LookupTable([i[0] for i in books])
 
-        self.genre_lookup_table = dict()
         genres = self._connection.query("SELECT genre_id FROM genres")
-        for count, i in enumerate(genres):
-            self.genre_lookup_table[count] = i[0]
+        self.genre_lookup_table = data_structures.LookupTable([i[0] for i in genres])
 
     def gen_recommendations(self):
-        predictions = self.predict()
-
-        query = "INSERT INTO recommendations (user_id, book_id, certainty) VALUES "
-
+        # Scores a batch of users against every book with one matrix product, rather than a row at a time, and then
+        # finds the top books for every user in the batch at once.
         self._list_users_no_preferences = {i[0] for i in self._connection.query(
             "SELECT user_id FROM users WHERE preferences_set=FALSE")}
 
-        for user, books in enumerate(predictions):
-            user_books = []
-            user_id = self.user_lookup_table[user]
-
-            if user_id not in self._list_users_no_preferences:
-                avoid_recs = {
-                    i[0] for i in self._connection.query("""
-                        SELECT book_id
-                        FROM recommendations
-                        WHERE user_id={}
-                            AND date_added>=DATE_SUB(NOW(), INTERVAL 2 DAY)
-                    """.format(user_id))
-                }  # sets are faster for "is val in list" operations
-
-                res = self._connection.query("""
-                    SELECT book_id
-                    FROM reading_lists
-                    INNER JOIN reading_list_names
-                        ON reading_lists.list_id=reading_list_names.list_id
-                    WHERE reading_lists.user_id={}
-                        AND reading_list_names.list_name IN (
-                            "Currently Reading",
-                            "Have Read",
-                            "Want To Read"
-                        )
-                """.format(user_id))  # Note that this covers the diary entries as well, as entries cannot be made unless it is in the have read/currently reading list
-
-                for i in res:
-                    avoid_recs.add(i[0])
-
-                for i in self.get_bad_recommendations(user_id):
-                    avoid_recs.add(i)
-
-                for book, rating in enumerate(books):
-                    book_id = self.book_lookup_table[book]
-                    if book_id not in avoid_recs:
-                        user_books.append({
-                            "id": book_id,
-                            "dot_product": rating
-                        })
-
-                user_books.sort(key=lambda x: x["dot_product"], reverse=True)
-                user_books = user_books[:self._number_recommendations]
-
-                for count, i in enumerate(user_books):  # Done after as this is faily expensive, to avoid unecessary calculations
-                    user_books[count]["certainty"] = self.calculate_certainty(
-                        i["id"],
-                        user_id,
-                        i["dot_product"]
-                    )
-
-                if len(user_books):
-                    query += ",".join(
-                        f"({user_id}, {i['id']}, {i['certainty']})" for i in user_books[:self._number_recommendations]) + ","
-
-        self._connection.query("""
-            DELETE FROM recommendations
-            WHERE date_added<=DATE_SUB(NOW(), INTERVAL 2 DAY)
+        users = np.nonzero(~np.isin(self.user_lookup_table.ids, list(self._list_users_no_preferences)))[0]
+        number_recommendations = min(self._number_recommendations, self._num_books)
+        if number_recommendations == 0:
+            users = users[:0]
+
+        book_norms = np.linalg.norm(self.book_factors, axis=1)
+        user_norms = np.linalg.norm(self.user_factors, axis=1)
+        book_norms[book_norms == 0] = np.inf  # The certainty of a zero vector is 0 rather than NaN
+        user_norms[user_norms == 0] = np.inf
+        normalised_books = self.book_factors / book_norms[:, np.newaxis]
+        normalised_users = self.user_factors / user_norms[:, np.newaxis]
+
+        excluded = self.load_excluded_books(self.user_lookup_table.get_ids(users))
+        engine = nearest_neighbours.create_engine(
+            self._candidate_engine,
+            self.book_factors,
+            **self._candidate_engine_options
+        )  # Built again every time, as the book factors change when fitting
+
+        batch_size = max(1, RECOMMENDATION_BATCH_SIZE // max(1, self._num_books))
+        values = []  # (user_id, book_id, certainty) rows
+        for batch in np.array_split(users, range(batch_size, len(users), batch_size)):
+            top = engine.search(
+                self.user_factors[batch],
+                number_recommendations,
+                excluded=[excluded.indices[excluded.indptr[i]:excluded.indptr[i + 1]] for i in batch]
+            )[0]
+
+            certainties = np.einsum("ij,ikj->ik", normalised_users[batch], normalised_books[top])  # Cosine similarity
+            # of only the chosen books, which is cheaper than the full normalised product
+            certainties = np.minimum(certainties, 1)  # Slim chance it ends up larger than 100%, so limits it artificially.
+
+            for row, user in enumerate(batch):
+                user_id = self.user_lookup_table[user]
+                chosen = top[row] != -1  # Users with fewer available books than number_recommendations
+                values.extend(zip(
+                    [user_id] * int(chosen.sum()),
+                    self.book_lookup_table.get_ids(top[row][chosen]).tolist(),
+                    certainties[row][chosen].tolist()
+                ))
+
+        self._connection.bulk_replace(
+            "recommendations",
+            ["user_id", "book_id", "certainty"],
+            values,
+            where="date_added<=DATE_SUB(NOW(), INTERVAL 2 DAY)"
+        )  # Expired recommendations are replaced in the same transaction, so users always have recommendations
+
+    def load_excluded_books(self, user_ids=None):
+        # Books that should not be recommended to each user, for every user at once, as a sparse users x books boolean
+        # matrix. This is a few queries in total, rather than several for each user. The bad recommendations are only
+        # loaded for user_ids (every user if it is None), so only their expired ones are deleted.
+        recent = self._load_signal("""
+            SELECT user_id,
+                book_id
+            FROM recommendations
+            WHERE date_added>=DATE_SUB(NOW(), INTERVAL 2 DAY)
         """)
 
-        self._connection.query(query[:-1])
+        lists = self._load_signal("""
+            SELECT reading_lists.user_id,
+                reading_lists.book_id
+            FROM reading_lists
+            INNER JOIN reading_list_names
+                ON reading_lists.list_id=reading_list_names.list_id
+            WHERE reading_list_names.list_name IN (
+                "Currently Reading",
+                "Have Read",
+                "Want To Read"
+            )
+        """)  # Note that this covers the diary entries as well, as entries cannot be made unless it is in the have read/currently reading list
+
+        bad_recommendations = self._indexes_from_rows([
+            (user_id, book_id)
+            for user_id, books in self.get_all_bad_recommendations(user_ids).items()
+            for book_id in books
+        ])
+
+        users = np.concatenate([recent[0], lists[0], bad_recommendations[0]])
+        books = np.concatenate([recent[1], lists[1], bad_recommendations[1]])
+        excluded = scipy.sparse.csr_matrix(
+            (np.ones(len(users), dtype=bool), (users, books)),
+            shape=(self._num_users, self._num_books)
+        )  # Repeated entries are summed, which is still True for a boolean matrix
+        return excluded
 
     def delete_recommendation(self, user_id, book_id, bad_recommendation=True):
         # This includes marking a recommendation as bad - it is implicitly the same thing
         self._connection.query("""
             DELETE FROM recommendations
-            WHERE user_id={user_id}
-                AND book_id={book_id}
-        """.format(
-            user_id=user_id,
-            book_id=book_id
-        ))
+            WHERE user_id=%s
+                AND book_id=%s
+        """, (user_id, book_id))
 
         if bad_recommendation:
             self._connection.query(
-                "INSERT INTO bad_recommendations (user_id, book_id) VALUES ({user_id}, {book_id})".format(
-                    user_id=user_id,
-                    book_id=book_id
-                )
+                "INSERT INTO bad_recommendations (user_id, book_id) VALUES (%s, %s)",
+                (user_id, book_id)
             )
 
     def get_bad_recommendations(self, user_id):
@@ -377,14 +818,14 @@ class Recommendations:
                 book_id,
                 date_added
             FROM bad_recommendations
-            WHERE user_id={}
-        """.format(user_id))
+            WHERE user_id=%s
+        """, (user_id,))
 
         reading_list_items = self._connection.query("""
             SELECT reading_lists.book_id
             FROM reading_lists
-            WHERE reading_lists.user_id={}
-        """.format(user_id))
+            WHERE reading_lists.user_id=%s
+        """, (user_id,))
 
         return_vals = []
         remove = []
@@ -398,12 +839,49 @@ class Recommendations:
 
         if len(remove):
             self._connection.query(
-                "DELETE FROM bad_recommendations WHERE recommendation_id IN ({})".format(",".join(str(i) for i in remove))
+                "DELETE FROM bad_recommendations WHERE recommendation_id IN ({})".format(",".join(["%s"] * len(remove))),
+                remove
             )
             # Delete expired recommendations.
 
         return return_vals
 
+    def get_all_bad_recommendations(self, user_ids=None):
+        # Same as get_bad_recommendations, but for every user in user_ids at once, or every user if it is None, so it
+        # only needs a single query. Only the expired bad recommendations of those users are deleted, as they would be
+        # by get_bad_recommendations for each of them. Returns a dictionary of user_id -> list of book ids.
+        if user_ids is not None:
+            user_ids = {int(i) for i in user_ids}
+
+        bad_recommendations = self._connection.query("""
+            SELECT recommendation_id,
+                user_id,
+                book_id,
+                date_added
+            FROM bad_recommendations
+        """)
+
+        return_vals = dict()
+        remove = []
+        for rec_id, user_id, book, date in bad_recommendations:
+            if user_ids is not None and user_id not in user_ids:
+                continue
+
+            if date + datetime.timedelta(weeks=10) > datetime.datetime.now():  # Same 10 week expiry
+                if user_id not in return_vals:
+                    return_vals[user_id] = []
+                return_vals[user_id].append(book)
+            else:
+                remove.append(rec_id)
+
+        if len(remove):
+            self._connection.query(
+                "DELETE FROM bad_recommendations WHERE recommendation_id IN ({})".format(",".join(["%s"] * len(remove))),
+                remove
+            )
+
+        return return_vals
+
     def get_user_recommendations(self, user_id):
         items = self._connection.query("""
             SELECT recommendations.book_id,
@@ -429,12 +907,12 @@ class Recommendations:
             FROM recommendations
             INNER JOIN books ON recommendations.book_id=books.book_id
             INNER JOIN authors ON books.author_id=authors.author_id
-            WHERE recommendations.user_id={user_id}
+            WHERE recommendations.user_id=%s
             ORDER BY recommendations.certainty DESC;
         """.format(
-            user_id=user_id,
-            genre_limit=self._num_display_genres
-        ))  # ORDER BY does not use calculated certainty for higher accuracy, and avoiding collisions
+            genre_limit=int(self._num_display_genres)
+        ), (user_id,))  # The GROUP_CONCAT LIMIT must be a literal rather than a parameter, so is formatted in as an
+        # integer. ORDER BY does not use calculated certainty for higher accuracy, and avoiding collisions
         # IFNULL prevents any null values - replace with 0s.
 
         self._list_users_no_preferences = {i[0] for i in self._connection.query(
@@ -474,9 +952,9 @@ class Recommendations:
             FROM recommendations
             INNER JOIN books ON recommendations.book_id=books.book_id
             INNER JOIN authors ON books.author_id=authors.author_id
-            WHERE recommendations.user_id={}
+            WHERE recommendations.user_id=%s
             ORDER BY recommendations.certainty DESC;
-        """.format(user_id))
+        """, (user_id,))
         return [{
                 "author": components.authors.names_to_display(i[3], i[4], i[5]),
                 "title": i[1],
@@ -485,93 +963,149 @@ class Recommendations:
             } for i in res]
 
     def calculate_certainty(self, book_id, user_id, dot_product, user_vec=None):
+        # gen_recommendations calculates this for every user at once, so this is only used for single users.
         if user_vec is None:
-            user_id = list(self.user_lookup_table.values()).index(user_id)
-            user_vec = [i for i in self.user_factors[user_id]]
-
-        book_id = list(self.book_lookup_table.values()).index(book_id)
-        book_vec = [i for i in self.book_factors[book_id]]
+            user_vec = self.user_factors[self.user_lookup_table.get_index(user_id)]
 
-        abs_book_vec = math.sqrt(sum(i ** 2 for i in book_vec))
-        abs_user_vec = math.sqrt(sum(i ** 2 for i in user_vec))
+        book_vec = self.book_factors[self.book_lookup_table.get_index(book_id)]
 
-        try:
-            similarity = dot_product / (abs_book_vec * abs_user_vec)
-            if similarity > 1:  # Slim chance it ends up larger than 100%, so limits it artificially.
-                similarity = 1
-        except ZeroDivisionError:
-            similarity = 0
+        norms = float(np.linalg.norm(book_vec) * np.linalg.norm(user_vec))
+        if norms == 0:  # Checked rather than catching ZeroDivisionError, as numpy gives NaN instead of raising it
+            return 0
 
-        return similarity
+        return min(float(dot_product) / norms, 1)  # Slim chance it ends up larger than 100%, so limits it artificially.
 
     def add_user(self, user_id, author_ids):
-        vals = [f"({user_id}, {author_id})" for author_id in author_ids]
         available_authors = {i[0] for i in self._connection.query("SELECT author_id FROM authors")}
         users = {i[0] for i in self._connection.query("SELECT user_id FROM users")}
 
-        if set(author_ids).issubset(available_authors) and user_id in users:
-            self._connection.query(
-                "INSERT INTO initial_preferences (user_id, author_id) VALUES {}".format(
-                    ",".join(vals)
-                )
-            )
+        if len(author_ids) and set(author_ids).issubset(available_authors) and user_id in users:  # Without any
+            # authors, nothing is known about the user, so there is nothing to recommend from
+            with self._connection.transaction():  # preferences_set is only set if all of the preferences are added
+                self._connection.query(
+                    "INSERT INTO initial_preferences (user_id, author_id) VALUES {}".format(
+                        ",".join(["(%s, %s)"] * len(author_ids))
+                    ),
+                    [i for author_id in author_ids for i in (user_id, author_id)]
+                )  # One query for every author
 
-            self._connection.query("""
-                UPDATE users
-                SET preferences_set=TRUE
-                WHERE user_id={}
-            """.format(user_id))
+                self._connection.query("""
+                    UPDATE users
+                    SET preferences_set=TRUE
+                    WHERE user_id=%s
+                """, (user_id,))
 
             res = self._connection.query("""
-                    SELECT AVG(book_genres.match_strength),
-                        book_genres.genre_id
-                    FROM book_genres
-                    INNER JOIN books
-                        ON book_genres.book_id=books.book_id
-                    INNER JOIN authors
-                        ON books.author_id=authors.author_id
-                    WHERE authors.author_id IN ({})
-                    GROUP BY book_genres.genre_id;
-                """.format(
-                    ",".join(str(i) for i in author_ids)
-                )
-            )
-
-            target_vec = np.zeros(self._num_factors)
+                SELECT book_id
+                FROM books
+                WHERE author_id IN ({})
+            """.format(
+                ",".join(["%s"] * len(author_ids))
+            ), author_ids)  # At this point the preferences are the only thing known about the user, so the books by the selected
+            # authors are given the same value they are given in gen_review_matrix.
+
+            user_vec = self.fold_in_user(user_id, {i[0]: self._initial_recommendation_mat_val for i in res})
+
+            avoid_recs = {i[0] for i in self._connection.query("""
+                SELECT book_id
+                FROM reading_lists
+                WHERE user_id=%s
+            """, (user_id,))}
+            avoid_recs.update(self.get_bad_recommendations(user_id))
 
-            for avg, genre_id in res:
-                genre = list(self.genre_lookup_table.values()).index(genre_id)
-                target_vec[genre] = avg
+            books = self.book_factors.dot(user_vec)
+            books[self.book_lookup_table.get_indexes([i for i in avoid_recs if self.book_lookup_table.contains_id(i)])] = -np.inf
 
-            rec = (target_vec * self.book_factors).T
+            top = nearest_neighbours.top_indexes(books[np.newaxis], self._number_recommendations)[0][0]
+            top = top[top != -1]  # Fewer books than number_recommendations that have not been excluded
 
             output = []
-            for count, val in enumerate(rec[0]):
+            for book in top:
+                book_id = self.book_lookup_table[book]
                 output.append({
-                    "book_id": self.book_lookup_table[count],
-                    "strength": val
+                    "book_id": book_id,
+                    "strength": float(books[book]),  # Convert the numpy float to a normal float so it can be used
+                    "certainty": self.calculate_certainty(book_id, user_id, float(books[book]), user_vec)
                 })
 
-            output.sort(key=lambda x: x["strength"], reverse=True)
+            self._connection.bulk_replace(
+                "recommendations",
+                ("user_id", "book_id", "certainty"),
+                [(user_id, i["book_id"], i["certainty"]) for i in output],
+                where="user_id=%s",
+                where_params=(user_id,)
+            )  # Replaced rather than added to, so the preferences can be set again
 
-            output = output[:self._number_recommendations]
+            return output
 
-            for count, i in enumerate(output):
-                output[count]["certainty"] = self.calculate_certainty(
-                    i["book_id"],
-                    user_id,
-                    float(i["strength"]), # Convert the numpy float to a normal float so it can be used
-                    target_vec
-                )
+    def fold_in_user(self, user_id, ratings):
+        # Solves for a single user's factors with the book factors fixed, which is the same calculation as that user's
+        # row of the user half step in fit. This means a user can be given factors without refitting the whole model.
+        # ratings is a dictionary of book_id: matrix value. The factors are stored in user_factors if the user is in the
+        # lookup table, as they may have been created after it was generated, and are returned.
+        ratings = {book_id: value for book_id, value in ratings.items() if self.book_lookup_table.contains_id(book_id)}
+        row = scipy.sparse.csr_matrix(
+            (
+                np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings)),
+                (np.zeros(len(ratings), dtype=np.intp), self.book_lookup_table.get_indexes(ratings.keys()))
+            ),
+            shape=(1, self._num_books)
+        )
+
+        gram = self._book_gram()
+        if self._weighted:
+            user_vec = np.zeros((1, self._num_factors))
+            solve_weighted_rows(
+                row.indptr,
+                row.indices,
+                row.data,
+                self.book_factors,
+                gram,
+                self._confidence_weight,
+                user_vec,
+                0,
+                1
+            )
+            user_vec = user_vec[0]
+        else:
+            user_vec = scipy.linalg.cho_solve(scipy.linalg.cho_factor(gram), row.dot(self.book_factors)[0])
 
-            self._connection.query("INSERT INTO recommendations (user_id, book_id, certainty) VALUES {}".format(",".join(f"({user_id}, {i['book_id']}, {i['certainty']})" for i in output)))
+        if self.user_lookup_table.contains_id(user_id):
+            self.user_factors[self.user_lookup_table.get_index(user_id)] = user_vec
 
-            return output
+        return user_vec
+
+    def _book_gram(self):
+        # book_factors.T . book_factors + the regularisation, which is the same for every user, so is kept until the
+        # book factors are replaced. Checked by identity, as fit assigns new arrays rather than changing them.
+        if self._book_gram_cache is None or self._book_gram_cache[0] is not self.book_factors:
+            gram = self.book_factors.T.dot(self.book_factors) + np.eye(self._num_factors) * self._hyperparam
+            self._book_gram_cache = (self.book_factors, gram)
+        return self._book_gram_cache[1]
+
+    @staticmethod
+    def _rated_entries(true):
+        # Rows, columns and ratings of the entries of true that have a rating, which can be sparse or dense
+        if scipy.sparse.issparse(true):
+            true = true.tocoo()
+            mask = true.data != 0
+            return true.row[mask], true.col[mask], true.data[mask]
+
+        rows, columns = np.nonzero(true)
+        return rows, columns, true[rows, columns]
 
     @staticmethod
     def mean_squared_error(true, pred):
-        mask = np.nonzero(true)
-        mse = sklearn.metrics.mean_squared_error(true[mask], pred[mask])
+        rows, columns, values = Recommendations._rated_entries(true)
+        mse = sklearn.metrics.mean_squared_error(values, pred[rows, columns])
+        return mse
+
+    def rated_mean_squared_error(self, true):
+        # The same as mean_squared_error with the model's predictions, but they are only calculated for the entries that
+        # have a rating, so the full users x books prediction matrix is not needed.
+        rows, columns, values = self._rated_entries(true)
+        pred = np.einsum("ij,ij->i", self.user_factors[rows], self.book_factors[columns])
+        mse = sklearn.metrics.mean_squared_error(values, pred)
         return mse
 
 
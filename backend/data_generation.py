@@ -380,8 +380,16 @@ temp_books = components.books.Books(
     reading_lists,
     config.get("home number_about_similarities"),
     number_home_summaries,
-    config.get("number_display_genres")
+    config.get("number_display_genres"),
+    similarity_index_path=os.path.join(parentdir, config.get("books similarity_index_path")),
+    similarity_engine=config.get("books similarity_engine"),
+    similarity_engine_options={
+        "number_lists": config.get("nearest_neighbours number_lists"),
+        "number_probes": config.get("nearest_neighbours number_probes")
+    }  # Only used by the ivf engine
 )
+temp_books.refresh_similarity_index()  # book_genres has been replaced, and the books without genres removed, so an
+# existing index would be out of date
 accounts = components.accounts.Accounts(
     connection,
     config.get("passwords hashing_algorithm"),
@@ -394,10 +402,12 @@ document = components.information_retrieval.DocumentCollection(
     books,
     authors,
     genres,
-    config.get("search number_results")
+    config.get("search number_results"),
+    index_path=os.path.join(parentdir, config.get("search index_path"))  # data_generation is in the backend directory
 )
 
 document.gen_idf_values()
+document.refresh_search_index()
 print("Finished IDF generation 11/11")
 
 
@@ -1,8 +1,17 @@
 # ------------------------------------------------------------------------------
 # Standard Python library imports
 # ------------------------------------------------------------------------------
+import os
 import math
+import time
 import itertools
+import threading
+import collections
+
+# ------------------------------------------------------------------------------
+# Third party Python library imports
+# ------------------------------------------------------------------------------
+import numpy as np
 
 # ------------------------------------------------------------------------------
 # Project imports
@@ -150,3 +159,162 @@ class BinaryTree:
             res.append(root.value)
             res = res + self.in_order_traversal(root.right)
         return res
+
+# ------------------------------------------------------------------------------
+# Lookup Table
+# ------------------------------------------------------------------------------
+class LookupTable:
+    # Bidirectional map between the row/column index used in a matrix and the database id it represents. Indexes are
+    # stored in a numpy array, so index -> id is an array access, and ids are stored in a dictionary, so id -> index
+    # is a hash lookup rather than a linear search of the values.
+    def __init__(self, ids=None):
+        if ids is None:
+            ids = []
+        self._ids = np.array(ids, dtype=np.int64)
+        self._indexes = {int(item_id): index for index, item_id in enumerate(self._ids)}
+
+    def __getitem__(self, index):
+        return int(self._ids[index])  # Same behaviour as the dictionary lookup tables this replaces - index -> id
+
+    def __iter__(self):
+        return iter(range(len(self._ids)))  # Iterates through the indexes, like iterating the keys of a dictionary
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get_index(self, item_id):
+        return self._indexes[int(item_id)]  # int() as the ids can come from strings, eg GROUP_CONCAT results
+
+    def get_indexes(self, item_ids):
+        return np.fromiter((self._indexes[int(i)] for i in item_ids), dtype=np.intp, count=len(item_ids))
+
+    def get_ids(self, indexes):
+        return self._ids[indexes]
+
+    def contains_id(self, item_id):
+        return int(item_id) in self._indexes
+
+    @property
+    def ids(self):
+        return self._ids
+
+# ------------------------------------------------------------------------------
+# TTL Cache
+# ------------------------------------------------------------------------------
+class TTLCache:
+    # Thread safe cache of values that are expensive to calculate, but are the same for every request, so can be shared
+    # between them. Each value expires ttl seconds after it is calculated, and the least recently used values are
+    # removed when there are more than max_size. Only one thread recalculates a value at a time - others are given the
+    # expired value until it has finished, or wait for it if there is no value. A ttl of 0 means values are never reused
+    # or stored, so every caller calculates its own, as if there was no cache.
+    # If invalidation_directory is given, invalidating a key also writes a new generation to a file with the key's name
+    # in it, and values calculated before it was written are not used, so an invalidation reaches every process using
+    # the same directory, rather than only the one that made it. Keys must then be valid file names.
+    def __init__(self, ttl=0, max_size=128, invalidation_directory=None):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._invalidation_directory = invalidation_directory
+        if invalidation_directory is not None:
+            os.makedirs(invalidation_directory, exist_ok=True)
+        self._entries = collections.OrderedDict()  # key -> (value, expiry time, shared generation when it was started
+        # being calculated). In order of use, oldest first.
+        self._refreshing = set()  # Keys that a thread is recalculating
+        self._generations = dict()  # key -> number of invalidations, so a value calculated before an invalidation
+        # is not stored after it.
+        self._condition = threading.Condition()
+
+    def get(self, key, function, ttl=None):
+        # Returns the value for the key, calling function (which does not take any arguments) to calculate it if it is
+        # not stored, or has expired. ttl overrides the ttl of the cache for this key.
+        ttl = self._ttl if ttl is None else ttl
+        if ttl <= 0:
+            return function()  # Never reused, so not shared with other threads either
+
+        while True:
+            shared_generation = self._get_shared_generation(key)  # Read before the lock is held, so threads using
+            # other keys are not held up by it
+            with self._condition:
+                entry = self._entries.get(key)
+                if entry is not None and entry[2] != shared_generation:
+                    del self._entries[key]  # Invalidated by another process
+                    entry = None
+
+                if entry is not None and entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[0]
+
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    generation = self._generations.get(key, 0)
+                    break
+
+                if entry is not None:
+                    return entry[0]  # Expired, but another thread is already recalculating it
+                self._condition.wait()  # The shared generation is read again once it has been calculated
+
+        try:
+            value = function()
+        except BaseException:
+            with self._condition:
+                self._refreshing.discard(key)
+                self._condition.notify_all()  # One of the waiting threads tries instead
+            raise
+
+        with self._condition:
+            self._refreshing.discard(key)
+            if self._generations.get(key, 0) == generation:  # If another process invalidated it while it was being
+                # calculated, the shared generation will not match when it is next used
+                self._entries[key] = (value, time.monotonic() + ttl, shared_generation)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+            self._condition.notify_all()
+
+        return value
+
+    def invalidate(self, *keys):
+        # Removes the values for the keys, so they are recalculated the next time they are needed - used when the data
+        # they come from is changed.
+        with self._condition:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+        if self._invalidation_directory is not None:
+            for key in keys:
+                path = os.path.join(self._invalidation_directory, key)
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, "w") as file:
+                    file.write(os.urandom(16).hex())  # Random rather than counted, so invalidations made at the same
+                    # time by different processes are never given the same generation
+                os.replace(temp_path, path)  # Written then renamed, so a partially written generation is never read
+
+    def _get_shared_generation(self, key):
+        # The generation that was last written to the key's invalidation file, which changes each time any process
+        # invalidates it. Compared rather than the file's modification time, as that is not precise enough to tell if
+        # an invalidation was made just before or after a value was started being calculated.
+        if self._invalidation_directory is None:
+            return None
+
+        try:
+            with open(os.path.join(self._invalidation_directory, key)) as file:
+                return file.read()
+        except FileNotFoundError:
+            return ""  # Never invalidated
+
+    def clear(self):
+        with self._condition:
+            for key in set(self._entries) | self._refreshing:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.clear()
+
+    def __contains__(self, key):
+        # Whether there is a value for the key that has not expired
+        shared_generation = self._get_shared_generation(key)
+        with self._condition:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > time.monotonic() and entry[2] == shared_generation
+
+    def __len__(self):
+        with self._condition:
+            return len(self._entries)
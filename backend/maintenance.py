@@ -1,7 +1,17 @@
+# -----------------------------------------------------------------------------
+# Standard Python library imports
+# -----------------------------------------------------------------------------
+import os
+
 # -----------------------------------------------------------------------------
 # Project imports
 # -----------------------------------------------------------------------------
 import components.accounts
+import components.authors
+import components.books
+import components.genres
+import components.information_retrieval
+import components.reading_lists
 import components.recommendations
 
 import configuration
@@ -11,6 +21,11 @@ import mysql_handler
 # Project constants
 # -----------------------------------------------------------------------------
 config = configuration.Configuration("./project_config.conf", default_conf_filename="./default_config.json")
+project_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+nearest_neighbour_options = {
+    "number_lists": config.get("nearest_neighbours number_lists"),
+    "number_probes": config.get("nearest_neighbours number_probes")
+}  # Only used by the ivf engine
 
 # -----------------------------------------------------------------------------
 # Database connection
@@ -25,6 +40,12 @@ connection = mysql_handler.Connection(
 # -----------------------------------------------------------------------------
 # Class instantiation
 # -----------------------------------------------------------------------------
+genres = components.genres.Genres(connection)
+authors = components.authors.Authors(
+    connection,
+    config.get("number_display_genres"),
+    config.get("home number_home_summaries")
+)
 sessions = components.accounts.Sessions(
     connection,
     config.get("session_id_length")
@@ -40,6 +61,39 @@ recommendations = components.recommendations.Recommendations(
     config.get("recommendations bad_recommendations_matrix_value"),
     config.get("recommendations minimum_required_reviews"),
     config.get("recommendations number_recommendations"),
+    weighted=config.get("recommendations weighted"),
+    confidence_weight=config.get("recommendations confidence_weight"),
+    convergence_tolerance=config.get("recommendations convergence_tolerance"),
+    convergence_patience=config.get("recommendations convergence_patience"),
+    max_fit_time=config.get("recommendations max_fit_time"),
+    convergence_criterion=config.get("recommendations convergence_criterion"),
+    factors_path=os.path.join(project_directory, config.get("recommendations factors_path")),
+    candidate_engine=config.get("recommendations candidate_engine"),
+    candidate_engine_options=nearest_neighbour_options
+)
+reading_lists = components.reading_lists.ReadingLists(
+    connection,
+    config.get("home number_home_summaries"),
+    config.get("number_display_genres"),
+    recommendations
+)
+books = components.books.Books(
+    connection,
+    reading_lists,
+    config.get("home number_about_similarities"),
+    config.get("home number_home_summaries"),
+    config.get("number_display_genres"),
+    similarity_index_path=os.path.join(project_directory, config.get("books similarity_index_path")),
+    similarity_engine=config.get("books similarity_engine"),
+    similarity_engine_options=nearest_neighbour_options
+)
+information_retrieval = components.information_retrieval.DocumentCollection(
+    connection,
+    books,
+    authors,
+    genres,
+    config.get("search number_results"),
+    index_path=os.path.join(project_directory, config.get("search index_path"))
 )
 
 # -----------------------------------------------------------------------------
@@ -54,5 +108,19 @@ for i in sessions.get_session_id_list():
 # -----------------------------------------------------------------------------
 # Recommendations
 # -----------------------------------------------------------------------------
-recommendations.fit()
+recommendations.fit(workers=os.cpu_count() if config.get("recommendations weighted") else 1)  # Runs overnight, so the
+# weighted step can use every core. The unweighted step is not split across processes, so is not given any workers.
 recommendations.gen_recommendations()
+
+# -----------------------------------------------------------------------------
+# Similar books
+# -----------------------------------------------------------------------------
+books.refresh_similarity_index()  # fit replaces book_genres. The web server reloads the index once the file changes.
+
+# -----------------------------------------------------------------------------
+# Search index
+# -----------------------------------------------------------------------------
+information_retrieval.gen_unique_words()  # Built again from the books, authors and genres, so the ones added or changed
+# since the last run can be searched
+information_retrieval.gen_idf_values()
+information_retrieval.refresh_search_index()  # The web server maps the new file before its next search
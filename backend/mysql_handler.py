@@ -1,27 +1,217 @@
 # ------------------------------------------------------------------------------
 # Standard Python library imports
 # ------------------------------------------------------------------------------
+import re
+import math
 import time
+import datetime
+import functools
+import itertools
+import threading
+import contextlib
+import collections
+import concurrent.futures
 
 # ------------------------------------------------------------------------------
 # Third party Python library imports
 # ------------------------------------------------------------------------------
 import mysql.connector
 
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+BULK_CHUNK_SIZE = 1000 # Number of rows sent in each INSERT by bulk_replace
+    # and bulk_upsert.
+    # Small enough to stay well under max_allowed_packet for wide rows.
+DEFAULT_POOL_SIZE = 8 # Maximum number of connections open at once.
+DEFAULT_POOL_TIMEOUT = 10 # Seconds to wait for a connection to be returned
+    # to the pool when all of them are in use.
+DEFAULT_HEALTH_CHECK_INTERVAL = 30 # Seconds a connection can be idle before it
+    # is pinged when it is next checked out.
+DEFAULT_RECYCLE_TIME = 3600 # Seconds a connection can be idle before it is
+    # closed and replaced when it is next checked out. Less than MySQL's
+    # wait_timeout, so the server does not close it first.
+DEFAULT_STATEMENT_CACHE_SIZE = 100 # Number of prepared statements kept for
+    # each connection.
+STREAM_BATCH_SIZE = 1000 # Number of rows fetched from the server at a time
+    # by stream.
+QUERY_SAMPLE_SIZE = 1000 # Number of the most recent times kept for each query
+    # shape, which the percentiles are calculated from.
+SLOW_QUERY_LOG_SIZE = 100 # Number of the most recent slow queries kept.
+REQUEST_LOG_SIZE = 50 # Number of the most recent requests kept.
+
+# ------------------------------------------------------------------------------
+# Exceptions
+# ------------------------------------------------------------------------------
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection becomes available within the pool timeout.
+    """
+    def __init__(self, pool_size, timeout):
+        message = f"All {pool_size} connections were in use for {timeout} seconds"
+        super().__init__(message)
+
+# ------------------------------------------------------------------------------
+# Functions
+# ------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=1024) # Most queries are the same string each time
+def normalise_query(query):
+    """
+    Function to get the shape of a query, so queries that only differ in their
+    values are counted together. Literal values and parameters are replaced
+    with ?, lists of them (such as for IN) with a single ?, and whitespace is
+    collapsed.
+
+    query -> string
+        The MySQL query.
+
+    Returns a string.
+    """
+    query = re.sub(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", "?", query) # Strings
+    query = re.sub(r"%s|\b\d+(?:\.\d+)?\b", "?", query) # Parameters and numbers
+    query = re.sub(r"\?(?:\s*,\s*\?)+", "?", query) # Lists of values
+    return " ".join(query.split()).rstrip(";")
+
+def percentile(values, fraction):
+    """
+    Function to get a percentile of a list of values, using the nearest rank.
+
+    values -> list of numbers
+        The values, which must be sorted in ascending order, and not empty.
+
+    fraction -> float
+        The percentile as a fraction between 0 and 1.
+
+    Returns a number from values.
+    """
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
 # ------------------------------------------------------------------------------
 # Classes
 # ------------------------------------------------------------------------------
+class QueryStatistics:
+    """
+    Records the number of times each shape of query is made, how long they
+    take, and how many rows they return. Safe to use from multiple threads.
+    """
+    def __init__(self, sample_size=QUERY_SAMPLE_SIZE):
+        """
+        Constructor for the QueryStatistics class.
+
+        sample_size -> integer
+            The number of the most recent times kept for each query shape.
+
+        Does not have a return value.
+        """
+        self._sample_size = sample_size
+        self._lock = threading.Lock()
+        self._queries = dict() # shape -> [count, total time, rows, recent times]
+
+    def record(self, query, duration, rows):
+        """
+        Method to record a query that has been made.
+
+        query -> string
+            The MySQL query, which is normalised before it is recorded.
+
+        duration -> float
+            The number of seconds the query took.
+
+        rows -> integer
+            The number of rows returned, or inserted for bulk_replace.
+
+        Does not have a return value.
+        """
+        shape = normalise_query(query)
+        with self._lock:
+            entry = self._queries.get(shape)
+            if entry is None:
+                entry = [0, 0, 0, collections.deque(maxlen=self._sample_size)]
+                self._queries[shape] = entry
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] += rows
+            entry[3].append(duration)
+
+    def summary(self):
+        """
+        Method to get the statistics for every query shape recorded.
+
+        Returns a list of dictionaries, in descending order of total time, with
+        the keys query, count, total_time, p50, p99 and rows. Times are in
+        seconds.
+        """
+        with self._lock:
+            entries = [(shape, i[0], i[1], i[2], sorted(i[3])) for shape, i in self._queries.items()]
+
+        return [{
+                "query": shape,
+                "count": count,
+                "total_time": total_time,
+                "p50": percentile(times, 0.5),
+                "p99": percentile(times, 0.99),
+                "rows": rows
+            } for shape, count, total_time, rows, times in sorted(entries, key=lambda x: -x[2])]
+
+    @property
+    def count(self):
+        """
+        Getter method for the total number of queries recorded.
+
+        Returns an integer.
+        """
+        with self._lock:
+            return sum(i[0] for i in self._queries.values())
+
+    @property
+    def total_time(self):
+        """
+        Getter method for the total time of every query recorded.
+
+        Returns a float, in seconds.
+        """
+        with self._lock:
+            return sum(i[1] for i in self._queries.values())
+
+    def reset(self):
+        """
+        Method to remove everything that has been recorded.
+
+        Does not have a return value.
+        """
+        with self._lock:
+            self._queries = dict()
+
 class Connection:
     """
     Database connection class. Encapsulates the complexity of connecting to the
     database, including error handling, into a single class, to make queries
     more readable and simpler to make.
+
+    Keeps a pool of connections, so it can be shared by multiple threads.
+    Each query checks a connection out of the pool, unless the thread is
+    inside a request, in which case the connection checked out for the
+    request is used.
+
+    Queries with parameters are run as prepared statements, which are kept
+    for each connection, so the server only parses each query once.
+
+    Connections are in autocommit mode, so each statement is committed on its
+    own, unless it is made inside a transaction.
+
+    Independent reads can be made at the same time on different connections
+    with gather.
     """
-    def __init__(self, user, password, schema, host):
+    def __init__(self, user, password, schema, host,
+            pool_size=DEFAULT_POOL_SIZE, pool_timeout=DEFAULT_POOL_TIMEOUT,
+            health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL,
+            recycle_time=DEFAULT_RECYCLE_TIME,
+            statement_cache_size=DEFAULT_STATEMENT_CACHE_SIZE,
+            slow_query_time=None):
         """
         Constructor for the Connection class
 
-        Establishes the connection to the database.
+        Establishes the first connection to the database.
 
         user -> string
             The identifying username for the database that the connection should
@@ -39,77 +229,749 @@ class Connection:
         host -> string
             The host IP address or host name for the server to connect to.
 
+        pool_size -> integer
+            The maximum number of connections that can be open at once.
+
+        pool_timeout -> float
+            The number of seconds to wait for a connection when they are all
+            in use, before PoolTimeoutError is raised.
+
+        health_check_interval -> float
+            The number of seconds a connection can be idle before it is
+            pinged (and reconnected if needed) when it is checked out.
+
+        recycle_time -> float
+            The number of seconds a connection can be idle before it is
+            replaced when it is checked out.
+
+        statement_cache_size -> integer
+            The maximum number of prepared statements kept for each
+            connection. The least recently used is closed when there are
+            more.
+
+        slow_query_time -> float or None
+            The number of seconds a query can take before it is added to the
+            slow query log. None does not keep a slow query log.
+
         Does not have a return value.
         """
         self._user = user
         self._password = password
         self._schema = schema
         self._host = host
-        self._connect() # Establish database connection
+        self._pool_size = pool_size
+        self._pool_timeout = pool_timeout
+        self._health_check_interval = health_check_interval
+        self._recycle_time = recycle_time
+        self._statement_cache_size = statement_cache_size
+
+        self._idle = [] # (connection, time returned) - used as a stack, so
+            # the most recently used connections are reused, and the rest can
+            # be recycled
+        self._num_connections = 0 # Includes connections that are checked out
+        self._pool_lock = threading.Condition()
+        self._local = threading.local() # Connection checked out for the
+            # request the thread is handling
+        self._statements = {} # connection -> OrderedDict of query ->
+            # (prepared cursor, query). Only used by the thread that has the
+            # connection checked out.
+
+        self._slow_query_time = slow_query_time
+        self._statistics = QueryStatistics()
+        self._slow_queries = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self._requests = collections.deque(maxlen=REQUEST_LOG_SIZE) # Summaries
+            # of the most recent requests
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix="gather"
+        ) # Threads are only started when gather is first used
+
+        self._checkin(self._checkout()) # Establish a database connection, so
+            # incorrect details are found immediately
         self._query_time = None
 
     def _connect(self):
         """
-        Method to establish a database connection. Called when an object is
-        instantiated and whenever a query is made, and the database has
-        terminated the connection.
+        Method to establish a new database connection.
 
-        Does not have a return value.
+        Returns the mysql.connector connection.
         """
-        self._connection = mysql.connector.connect(
+        return mysql.connector.connect(
             user=self._user,
             password=self._password,
             host=self._host,
-            database=self._schema
+            database=self._schema,
+            autocommit=True # Reads do not need to be committed, and changes
+                # that need to be made together use transaction
         )
 
-        self._cursor = self._connection.cursor()
+    def _checkout(self, wait=True):
+        """
+        Method to take a connection from the pool, creating one if none are
+        idle and the pool is not full, or waiting for one to be returned
+        otherwise. Idle connections are checked before they are returned.
+
+        wait -> boolean
+            Whether to wait for a connection to be returned if the pool is
+            full. If not, None is returned instead.
+
+        Returns the mysql.connector connection, or None.
+        """
+        deadline = time.monotonic() + self._pool_timeout
+        with self._pool_lock:
+            while not len(self._idle) and self._num_connections >= self._pool_size:
+                if not wait:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._pool_lock.wait(remaining):
+                    raise PoolTimeoutError(self._pool_size, self._pool_timeout)
+
+            if len(self._idle):
+                connection, returned = self._idle.pop()
+            else:
+                connection, returned = None, None
+            self._num_connections += 1 if connection is None else 0
+
+        try:
+            if connection is None:
+                return self._connect()
+
+            idle_time = time.monotonic() - returned
+            if idle_time >= self._recycle_time:
+                self._clear_statements(connection)
+                connection.close()
+                return self._connect()
+            if idle_time >= self._health_check_interval:
+                connection_id = connection.connection_id
+                connection.ping(reconnect=True, attempts=1) # Reconnects if the
+                    # server has closed the connection
+                if connection.connection_id != connection_id:
+                    self._clear_statements(connection) # Prepared statements
+                        # only exist for the connection they were made on
+            return connection
+        except BaseException:
+            self._discard(connection) # None if creating it failed, otherwise
+                # it is closed, as it may be broken
+            raise
+
+    def _checkin(self, connection):
+        """
+        Method to return a connection to the pool.
+
+        connection -> mysql.connector connection
+            A connection from _checkout.
+
+        Does not have a return value.
+        """
+        with self._pool_lock:
+            self._idle.append((connection, time.monotonic()))
+            self._pool_lock.notify()
+
+    def _discard(self, connection=None):
+        """
+        Method to remove a connection that has been checked out from the pool,
+        such as one that is broken, so another can be created in its place.
+        Also used when creating a connection fails, with no connection.
+
+        connection -> mysql.connector connection or None
+            The connection to close, if there is one.
+
+        Does not have a return value.
+        """
+        if connection is not None:
+            self._clear_statements(connection)
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass # It is being discarded as it may already be broken
+
+        with self._pool_lock:
+            self._num_connections -= 1
+            self._pool_lock.notify()
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """
+        Context manager for the connection a query should use - the request's
+        connection if the thread is handling a request, or a connection that is
+        checked out for just the body of the with statement otherwise.
+
+        Yields the mysql.connector connection.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+
+        connection = self._checkout()
+        try:
+            yield connection
+        except BaseException:
+            self._release_after_error(connection)
+            raise
+        self._checkin(connection)
+
+    def _release_after_error(self, connection):
+        """
+        Method to return a connection to the pool after an error, such as a
+        query that violates a constraint. Anything uncommitted is rolled back
+        first, and connections that are no longer usable are discarded.
+
+        connection -> mysql.connector connection
+            A connection from _checkout.
+
+        Does not have a return value.
+        """
+        try:
+            connection.rollback()
+            usable = connection.is_connected()
+        except mysql.connector.Error:
+            usable = False
+
+        if usable:
+            self._checkin(connection)
+        else:
+            self._discard(connection)
+
+    @contextlib.contextmanager
+    def request(self, name=None):
+        """
+        Context manager that checks out a single connection for every query
+        made by the thread in the body of the with statement, such as while a
+        web request is handled. Nested requests use the outer request's
+        connection.
+
+        The queries made during the request are also recorded separately, and
+        a summary of them is kept in the request log once it has finished.
+
+        name -> string or None
+            What the request is for, such as the URI, for the request log.
+
+        Does not yield a value.
+        """
+        if getattr(self._local, "connection", None) is not None:
+            yield
+            return
+
+        statistics = QueryStatistics()
+        start_time = time.perf_counter()
+        with self._connection() as connection:
+            self._local.connection = connection
+            self._local.statistics = statistics
+            try:
+                yield
+            finally:
+                self._local.connection = None
+                self._local.statistics = None
+                self._requests.append({
+                    "name": name,
+                    "time": datetime.datetime.now().isoformat(),
+                    "duration": time.perf_counter() - start_time,
+                    "count": statistics.count,
+                    "total_time": statistics.total_time,
+                    "queries": statistics.summary()
+                })
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context manager for making several changes together. Every query made
+        by the thread in the body of the with statement uses the same
+        connection, and is committed once at the end, or rolled back if an
+        exception is raised, so either all of the changes are made, or none of
+        them are. Transactions inside a transaction are part of the outer one.
+
+        Does not yield a value.
+        """
+        if self._in_transaction():
+            yield
+            return
+
+        outer_connection = getattr(self._local, "connection", None)
+        with self._connection() as connection:
+            self._local.connection = connection # So queries in the body use it
+            self._local.transaction = True
+            try:
+                connection.start_transaction()
+                yield
+                connection.commit()
+            except BaseException:
+                try:
+                    if connection.unread_result:
+                        connection.consume_results() # An unfinished stream
+                    connection.rollback()
+                except mysql.connector.Error:
+                    pass # The connection is broken, so nothing was committed,
+                        # and it is discarded when it is released
+                raise
+            finally:
+                self._local.connection = outer_connection
+                self._local.transaction = False
+
+    def gather(self, *functions):
+        """
+        Method to call functions that make independent reads at the same time,
+        such as the parts of a page, so the time taken is close to that of the
+        slowest, rather than the total. The first function is called by the
+        thread itself, and each of the others is called by a worker thread with
+        its own connection from the pool. If the pool has no connections free,
+        the function is called by the thread after the first instead, so
+        gather never waits for a connection.
+
+        The functions should not change anything that another of the functions
+        reads, as the order they run in is not known. Queries they make are
+        recorded against the current request. Inside a transaction, every
+        function is called by the thread, so they are part of it.
 
-    def query(self, query):
+        *functions -> callables
+            Functions that do not take any arguments.
+
+        Returns a list of the return value of each function, in the same
+        order. If any of them raise an exception, the exception from the first
+        of them is raised, once all of them have finished.
+        """
+        if len(functions) < 2 or self._in_transaction():
+            return [function() for function in functions]
+
+        statistics = getattr(self._local, "statistics", None)
+        futures = []
+        for function in functions[1:]:
+            connection = self._checkout(wait=False)
+            if connection is None:
+                futures.append(None) # Called by this thread instead
+            else:
+                futures.append(self._executor.submit(
+                    self._call_with_connection,
+                    function,
+                    connection,
+                    statistics
+                ))
+
+        results = []
+        error = None
+        for function, future in zip(functions, [None] + futures):
+            try:
+                results.append(function() if future is None else future.result())
+            except Exception as e:
+                results.append(None)
+                error = error or e # Waits for the rest, so their connections
+                    # have been returned before the error is handled
+
+        if error is not None:
+            raise error
+        return results
+
+    def _call_with_connection(self, function, connection, statistics):
+        """
+        Method to call a function in a worker thread for gather, with a
+        connection that has been checked out for it.
+
+        function -> callable
+            The function to call, which does not take any arguments.
+
+        connection -> mysql.connector connection
+            A connection from _checkout, which is returned to the pool once the
+            function has finished.
+
+        statistics -> QueryStatistics or None
+            The statistics of the request that the function is for.
+
+        Returns the return value of the function.
+        """
+        self._local.connection = connection
+        self._local.statistics = statistics
+        try:
+            result = function()
+        except BaseException:
+            self._release_after_error(connection)
+            raise
+        else:
+            self._checkin(connection)
+        finally:
+            self._local.connection = None
+            self._local.statistics = None
+        return result
+
+    def _in_transaction(self):
+        """
+        Method to check whether the thread is inside a transaction.
+
+        Returns a boolean.
+        """
+        return getattr(self._local, "transaction", False)
+
+    def _prepared_statement(self, connection, query):
+        """
+        Method to get the prepared statement for a query on a connection,
+        preparing it if it is not in the connection's cache.
+
+        connection -> mysql.connector connection
+            The connection the statement is for.
+
+        query -> string
+            The MySQL query, with %s for each parameter.
+
+        Returns a tuple of the prepared cursor, and the query string that it
+        was prepared with. The connector only reuses a prepared statement if it
+        is executed with the same string object, so that string must be used
+        rather than an equal one.
+        """
+        statements = self._statements.setdefault(connection, collections.OrderedDict())
+        statement = statements.get(query)
+        if statement is not None:
+            statements.move_to_end(query)
+            return statement
+
+        statement = (connection.cursor(prepared=True), query)
+        statements[query] = statement
+        if len(statements) > self._statement_cache_size:
+            oldest = statements.popitem(last=False)[1][0]
+            oldest.close() # Deallocates the statement on the server
+        return statement
+
+    def _forget_statement(self, connection, query):
+        """
+        Method to remove a query's prepared statement from the connection's
+        cache, such as after an error, when the state of the cursor is not
+        known.
+
+        Does not have a return value.
+        """
+        statement = self._statements.get(connection, {}).pop(query, None)
+        if statement is not None:
+            try:
+                statement[0].close()
+            except mysql.connector.Error:
+                pass
+
+    def _clear_statements(self, connection):
+        """
+        Method to remove every prepared statement for a connection, such as
+        when it has been closed, as the statements only exist on the server
+        for the connection that prepared them.
+
+        Does not have a return value.
+        """
+        self._statements.pop(connection, None)
+
+    def _execute(self, connection, query, params, prepared=True):
+        """
+        Method to execute a query, reconnecting and trying again once if the
+        connection has been closed.
+
+        connection -> mysql.connector connection
+            The connection to execute the query with.
+
+        query -> string
+            The MySQL query that is to be performed.
+
+        params -> tuple, list or None
+            The values for each %s in the query, or None if there are none.
+
+        prepared -> boolean
+            Whether a query with params should be run as a cached prepared
+            statement. If not, a new unbuffered cursor is used, and the values
+            are escaped by the connector instead.
+
+        Returns the cursor the query was executed with.
+        """
+        prepared = prepared and params is not None
+        for attempt in range(2):
+            if not prepared:
+                cursor = connection.cursor(buffered=False)
+                statement = query
+            else:
+                cursor, statement = self._prepared_statement(connection, query)
+
+            try:
+                cursor.execute(statement, params)
+                return cursor
+            except mysql.connector.Error:
+                if not prepared:
+                    cursor.close()
+                else:
+                    self._forget_statement(connection, query)
+
+                if attempt or connection.is_connected() or self._in_transaction():
+                    raise # Error with the query itself, so retrying would fail.
+                        # A transaction cannot be retried, as the statements
+                        # before this have been lost
+                connection.reconnect() # Some databases specifies connections
+                    # close after certain amount of time inactive. This repoens
+                    # the connection if a timeout occurs
+                self._clear_statements(connection)
+
+    def query(self, query, params=None):
         """
         Method to query the connected database.
 
         query -> string
             The MySQL query that is to be performed on the database that the
-            object is connecting to.
+            object is connecting to. Values should be given as %s, and passed
+            in params, rather than formatted into the string, so the query is
+            the same each time, and can be prepared once.
+
+        params -> tuple, list or None
+            The values for each %s in the query, in order. If given, the query
+            is run as a prepared statement.
 
         Returns a list of tuples - each tuple is one row in the response from
         the database. An empty list means that the query result was an empty
         set.
         """
 
-        start_time = time.time() # Changes this first incase multi-threading is
-            # used in the future - a query may be made in a different thread.
+        start_time = time.perf_counter()
         self._query_time = None
 
-        try:
-            self._cursor.execute(query)
-        except mysql.connector.Error:
-            self._connect() # Some databases specifies connections close after
-                # certain amount of time inactive. This repoens the connection
-                # if a timeout occurs
-            self._cursor.execute(query)
+        with self._connection() as connection:
+            cursor = self._execute(connection, query, params) # A cursor for
+                # each query or prepared statement, so threads do not share
+                # cursor state
 
-        try:
-            result = self._cursor.fetchall() # Needs to come before the if
-                # statement as otherwise can result in 'unread result found' error
-        except mysql.connector.errors.InterfaceError:
-            result = [] # Incase the method does not provide any result, like
-                # INSERT
+            try:
+                result = cursor.fetchall() # Needs to come before the if
+                    # statement as otherwise can result in 'unread result found' error
+            except mysql.connector.errors.InterfaceError:
+                result = [] # Incase the method does not provide any result, like
+                    # INSERT
 
-        self._connection.commit() # Applies changes from the query to the db
+            if params is None:
+                cursor.close() # Prepared statements are kept for next time
 
-        self._query_time = time.time() - start_time
+        duration = time.perf_counter() - start_time
+        self._query_time = duration
+        self._record(query, duration, len(result))
 
         return result # Use tuples as they are faster
 
+    def stream(self, query, params=None, batch_size=STREAM_BATCH_SIZE):
+        """
+        Generator method to query the connected database, for queries with
+        too many rows to hold in memory at once, such as loading whole tables.
+        The rows are read from the server batch_size at a time, with an
+        unbuffered cursor, rather than all being fetched like query.
+
+        The connection is in use until the generator is exhausted or closed,
+        so no other queries should be made by the thread while the rows are
+        being iterated over.
+
+        query -> string
+            The MySQL query that is to be performed.
+
+        params -> tuple, list or None
+            The values for each %s in the query, in order.
+
+        batch_size -> integer
+            The number of rows fetched from the server at a time.
+
+        Yields a tuple for each row in the result.
+        """
+        start_time = time.perf_counter()
+        num_rows = 0
+        with self._connection() as connection:
+            cursor = self._execute(connection, query, params, prepared=False)
+                # Prepared statements are not used, as the cached cursor
+                # would be left with unread rows between batches
+            try:
+                rows = cursor.fetchmany(batch_size)
+                while len(rows):
+                    num_rows += len(rows)
+                    yield from rows
+                    rows = cursor.fetchmany(batch_size)
+            finally:
+                if connection.unread_result:
+                    connection.consume_results() # Stopped before the last
+                        # row, which needs to be read before the connection
+                        # can be used again
+                cursor.close()
+
+        self._record(query, time.perf_counter() - start_time, num_rows) # Includes
+            # the time spent processing the rows, as they are fetched while
+            # they are iterated over
+
+    def bulk_replace(self, table, columns, rows, where=None, where_params=None,
+            chunk_size=BULK_CHUNK_SIZE):
+        """
+        Method to replace rows of a table with a new set of rows, in a single
+        transaction. The rows are inserted in chunks with parameterised
+        queries, rather than as one INSERT, so large tables do not exceed the
+        max_allowed_packet size. Other connections see either the old rows or
+        the new rows, never an empty table, and if any part fails, the
+        transaction is rolled back so the old rows are kept.
+
+        table -> string
+            The table that the rows are replaced in.
+
+        columns -> list of strings
+            The columns that each row gives values for, in order.
+
+        rows -> iterable of tuples
+            The new rows. Can be a generator, as it is only iterated over
+            once.
+
+        where -> string or None
+            The condition for the existing rows that are deleted. None deletes
+            every row in the table.
+
+        where_params -> tuple, list or None
+            The values for each %s in where, in order.
+
+        chunk_size -> integer
+            The maximum number of rows in each INSERT.
+
+        Does not have a return value.
+        """
+        delete = "DELETE FROM {}".format(table)
+        if where is not None:
+            delete += " WHERE " + where
+
+        insert = "INSERT INTO {} ({}) VALUES ({})".format(
+            table,
+            ", ".join(columns),
+            ", ".join(["%s"] * len(columns))
+        )
+
+        start_time = time.perf_counter()
+        num_rows = 0
+        with self.transaction(), self._connection() as connection: # Rolled
+                # back if any part fails, which keeps the existing rows
+            cursor = connection.cursor()
+            cursor.execute(delete, where_params)
+
+            rows = iter(rows)
+            chunk = list(itertools.islice(rows, chunk_size))
+            while len(chunk):
+                cursor.executemany(insert, chunk) # The connector rewrites
+                    # this as a single multiple row INSERT
+                num_rows += len(chunk)
+                chunk = list(itertools.islice(rows, chunk_size))
+
+            cursor.close()
+
+        self._record(insert, time.perf_counter() - start_time, num_rows)
+
+    def bulk_upsert(self, table, columns, rows, update_columns,
+            chunk_size=BULK_CHUNK_SIZE):
+        """
+        Method to insert rows into a table, or update the existing rows that
+        have the same primary or unique key, in a single transaction. This
+        uses INSERT ... ON DUPLICATE KEY UPDATE in chunks, rather than an
+        UPDATE for each row, and if any part fails, the transaction is rolled
+        back so none of the rows are changed.
+
+        table -> string
+            The table that the rows are inserted into, or updated in.
+
+        columns -> list of strings
+            The columns that each row gives values for, in order. Must include
+            the key columns, and any column that does not have a default, even
+            if the rows are only expected to be updated.
+
+        rows -> iterable of tuples
+            The rows. Can be a generator, as it is only iterated over once.
+
+        update_columns -> list of strings
+            The columns that are changed for rows that already exist. The
+            other columns keep their existing values.
+
+        chunk_size -> integer
+            The maximum number of rows in each INSERT.
+
+        Does not have a return value.
+        """
+        upsert = "INSERT INTO {} ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+            table,
+            ", ".join(columns),
+            ", ".join(["%s"] * len(columns)),
+            ", ".join("{0}=VALUES({0})".format(i) for i in update_columns)
+        )
+
+        start_time = time.perf_counter()
+        num_rows = 0
+        with self.transaction(), self._connection() as connection:
+            cursor = connection.cursor()
+
+            rows = iter(rows)
+            chunk = list(itertools.islice(rows, chunk_size))
+            while len(chunk):
+                cursor.executemany(upsert, chunk) # Also rewritten as a single
+                    # multiple row INSERT
+                num_rows += len(chunk)
+                chunk = list(itertools.islice(rows, chunk_size))
+
+            cursor.close()
+
+        self._record(upsert, time.perf_counter() - start_time, num_rows)
+
+    def _record(self, query, duration, rows):
+        """
+        Method to record a query that has been made, in the overall
+        statistics, the current request's statistics, and the slow query log if
+        it took longer than the slow query time.
+
+        query -> string
+            The MySQL query that was performed.
+
+        duration -> float
+            The number of seconds the query took.
+
+        rows -> integer
+            The number of rows returned, or inserted.
+
+        Does not have a return value.
+        """
+        self._statistics.record(query, duration, rows)
+
+        statistics = getattr(self._local, "statistics", None)
+        if statistics is not None:
+            statistics.record(query, duration, rows)
+
+        if self._slow_query_time is not None and duration >= self._slow_query_time:
+            self._slow_queries.append({
+                "query": " ".join(query.split()), # Not normalised, so the
+                    # literal values are kept
+                "time": datetime.datetime.now().isoformat(),
+                "duration": duration,
+                "rows": rows
+            }) # deque.append is thread safe
+
+    def query_statistics(self):
+        """
+        Method to get everything that has been recorded about the queries made
+        since the object was created, or the statistics were reset.
+
+        Returns a dictionary, with the keys:
+            queries - list of dictionaries from QueryStatistics.summary, for
+                every query made.
+            slow_queries - list of the most recent queries that took longer
+                than the slow query time, oldest first.
+            requests - list of the most recent requests, oldest first, each
+                with the queries that were made during it.
+        """
+        return {
+            "queries": self._statistics.summary(),
+            "slow_queries": list(self._slow_queries),
+            "requests": list(self._requests)
+        }
+
+    def reset_statistics(self):
+        """
+        Method to remove everything that has been recorded about the queries
+        made.
+
+        Does not have a return value.
+        """
+        self._statistics.reset()
+        self._slow_queries.clear()
+        self._requests.clear()
 
     @property
     def query_time(self):
         """
         Getter method for the query time of the previous query.
 
-        Time includes processing within the class, such as committing changes.
+        Time includes processing within the class, such as fetching the rows.
 
         Returns a floating point number for the time in seconds of the previous
         query, or None if a query has not yet been made, or there is one in
@@ -117,12 +979,41 @@ class Connection:
         """
         return self._query_time
 
+    @property
+    def pool_size(self):
+        """
+        Getter method for the maximum number of connections in the pool.
+
+        Returns an integer.
+        """
+        return self._pool_size
+
+    def close(self):
+        """
+        Method to close every idle connection in the pool. Connections that are
+        checked out are closed when they are discarded.
+
+        Does not have a return value.
+        """
+        self._executor.shutdown(wait=False)
+
+        with self._pool_lock:
+            idle = self._idle
+            self._idle = []
+            self._num_connections -= len(idle)
+
+        for connection, returned in idle:
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass
+
     def __del__(self):
         """
-        Custom destructor for the connection class. Closes the connection with
+        Custom destructor for the connection class. Closes the connections with
         the databse whenever the program is terminated or the instance is
         deleted manually.
 
         Does not have a return value
         """
-        self._connection.close()
+        self.close()
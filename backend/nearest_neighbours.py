@@ -0,0 +1,308 @@
+# ------------------------------------------------------------------------------
+# Standard Python library imports
+# ------------------------------------------------------------------------------
+import os
+import json
+import math
+
+# ------------------------------------------------------------------------------
+# Third party Python library imports
+# ------------------------------------------------------------------------------
+import numpy as np
+
+# ------------------------------------------------------------------------------
+# Project imports
+# ------------------------------------------------------------------------------
+import data_structures
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+SIMILARITY_BATCH_SIZE = 4000000  # Number of item x item similarities calculated at once when building the neighbour
+# table. 4 million 64 bit floats is 32MB.
+INDEX_FILE_VERSION = 3  # Increase if the format of the saved index changes, so old files are not used
+DEFAULT_NUMBER_PROBES = 8  # Number of lists the ivf engine searches for each query. More finds more of the true
+# neighbours, but compares the query with more items.
+KMEANS_ITERATIONS = 20  # Maximum number of iterations used to find the ivf engine's lists
+
+# ------------------------------------------------------------------------------
+# Functions
+# ------------------------------------------------------------------------------
+def normalise_rows(vectors):
+    # Divides each row by its length, so the dot product of two rows is their cosine similarity. Rows of zeros are left
+    # as zeros, rather than becoming NaN.
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros(vectors.shape), where=norms > 0)
+
+def top_indexes(scores, number):
+    # Column indexes and scores of the highest number scores in each row, highest first, with equal scores in order of
+    # column. Columns with a score of -inf are never chosen, and are -1 in the result if a row has fewer than number
+    # other columns.
+    num_rows, num_columns = scores.shape
+    indexes = np.full((num_rows, number), -1, dtype=np.int64)
+    top_scores = np.full((num_rows, number), -np.inf)
+    chosen = min(number, num_columns)
+    if chosen == 0 or num_rows == 0:
+        return indexes, top_scores
+
+    kth_scores = -np.partition(-scores, chosen - 1, axis=1)[:, chosen - 1]  # The lowest score in each row's top
+    # chosen, found in linear time
+    candidates = scores >= kth_scores[:, np.newaxis]  # Includes every column tied with the lowest
+    exact = candidates.sum(axis=1) == chosen  # Rows without a tie for the last place, which is nearly all of them
+
+    rows = np.nonzero(exact)[0]
+    columns = np.nonzero(candidates[rows])[1].reshape(len(rows), chosen)  # In order of column
+    order = np.argsort(-np.take_along_axis(scores[rows], columns, axis=1), axis=1, kind="stable")
+    indexes[rows, :chosen] = np.take_along_axis(columns, order, axis=1)
+
+    for row in np.nonzero(~exact)[0]:  # Ties are broken by column, which needs every tied column
+        columns = np.flatnonzero(candidates[row])
+        indexes[row, :chosen] = columns[np.argsort(-scores[row, columns], kind="stable")[:chosen]]
+
+    top_scores[:, :chosen] = np.take_along_axis(scores, indexes[:, :chosen], axis=1)
+    indexes[top_scores == -np.inf] = -1
+    return indexes, top_scores
+
+def kmeans(vectors, number_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    # Centre of each cluster, and the cluster of each vector. The centres start as randomly chosen vectors, and
+    # clusters that become empty keep their previous centre.
+    generator = np.random.default_rng(seed)
+    centroids = vectors[generator.choice(len(vectors), number_clusters, replace=False)]
+    assignments = nearest_centroids(vectors, centroids)
+    for i in range(iterations):
+        counts = np.bincount(assignments, minlength=number_clusters)
+        sums = np.zeros(centroids.shape)
+        np.add.at(sums, assignments, vectors)
+
+        new_centroids = centroids.copy()
+        filled = counts > 0
+        new_centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+        new_assignments = nearest_centroids(vectors, new_centroids)
+
+        centroids = new_centroids
+        if np.array_equal(new_assignments, assignments):
+            break
+        assignments = new_assignments
+
+    return centroids, assignments
+
+def nearest_centroids(vectors, centroids):
+    # Index of the closest centroid to each vector by euclidean distance. |v - c|^2 = |v|^2 - 2v.c + |c|^2, and |v|^2
+    # is the same for every centroid, so it is not needed to find the closest.
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    batch_size = max(1, SIMILARITY_BATCH_SIZE // max(1, len(centroids)))
+    for start in range(0, len(vectors), batch_size):
+        distances = centroid_norms - 2 * vectors[start:start + batch_size].dot(centroids.T)
+        assignments[start:start + batch_size] = np.argmin(distances, axis=1)
+    return assignments
+
+def augment_for_inner_product(vectors):
+    # Adds a column of sqrt(M^2 - |x|^2) to each vector x, where M is the length of the longest, so every vector has
+    # length M. A query with a 0 in the extra column has the same dot product with them as before, and as they are the
+    # same length, the vectors with the highest dot product are the closest by euclidean distance. This means k-means
+    # clusters suit finding the highest dot product, even if the vectors are not normalised.
+    squared_norms = (vectors ** 2).sum(axis=1)
+    extra = np.sqrt(np.maximum(squared_norms.max(initial=0) - squared_norms, 0))
+    return np.hstack([vectors, extra[:, np.newaxis]])
+
+def create_engine(name, vectors, **options):
+    # Engine used to find the vectors with the highest dot product with a query. name is a key of ENGINES.
+    if name not in ENGINES:
+        raise ValueError(f"Unknown nearest neighbour engine '{name}', expected one of {', '.join(ENGINES)}")
+    return ENGINES[name](vectors, **options)
+
+# ------------------------------------------------------------------------------
+# Search engines
+# ------------------------------------------------------------------------------
+# Each engine finds the vectors with the highest dot product with each query, which is the cosine similarity if the
+# vectors and queries are normalised. search returns the row indexes and scores of the top number vectors for each
+# query, highest first, with equal scores in order of row and -1 if fewer are found. excluded is the row indexes that
+# cannot be chosen for each query.
+class ExactSearch:
+    # Compares each query with every vector, so always finds the true neighbours.
+    name = "exact"
+
+    def __init__(self, vectors, **options):
+        # The options of the other engines are accepted and ignored, so the engine can be changed in the config alone
+        self.vectors = np.asarray(vectors, dtype=np.float64)
+
+    def search(self, queries, number, excluded=None):
+        scores = np.asarray(queries, dtype=np.float64).dot(self.vectors.T)
+        if excluded is not None:
+            lengths = [len(i) for i in excluded]
+            if sum(lengths):
+                scores[np.repeat(np.arange(len(scores)), lengths), np.concatenate(excluded).astype(np.int64)] = -np.inf
+        return top_indexes(scores, number)
+
+    def arrays(self):
+        return {}
+
+
+class IVFSearch:
+    # Inverted file index. The vectors are split into number_lists clusters by k-means, and each query is only
+    # compared with the vectors in the number_probes clusters whose centres are closest to it. The clusters are found
+    # from augment_for_inner_product of the vectors, so they suit vectors that are not normalised, such as the book
+    # factors. Searching every list gives the exact result, and fewer lists is faster but can miss some of the true
+    # neighbours.
+    name = "ivf"
+
+    def __init__(self, vectors, number_lists=0, number_probes=DEFAULT_NUMBER_PROBES, seed=0, centroids=None,
+            assignments=None):
+        # number_lists of 0 uses the square root of the number of vectors. centroids and assignments are only given
+        # when the clusters have already been found, such as by SimilarityIndex.load.
+        self.vectors = np.asarray(vectors, dtype=np.float64)
+        if centroids is None:
+            if number_lists <= 0:
+                number_lists = round(math.sqrt(len(self.vectors)))
+            number_lists = max(1, min(number_lists, len(self.vectors)))
+            if len(self.vectors):
+                centroids, assignments = kmeans(augment_for_inner_product(self.vectors), number_lists, seed=seed)
+            else:
+                centroids, assignments = np.zeros((1, self.vectors.shape[1] + 1)), np.zeros(0, dtype=np.int64)
+
+        self.centroids = np.asarray(centroids, dtype=np.float64)  # Including the extra column
+        self._centroid_norms = (self.centroids ** 2).sum(axis=1)
+        self.assignments = np.asarray(assignments, dtype=np.int64)
+        self.number_probes = max(1, min(number_probes, len(self.centroids)))
+
+        self._order = np.argsort(self.assignments, kind="stable")  # Rows grouped by list, in order of row in each
+        self._list_starts = np.searchsorted(self.assignments[self._order], np.arange(len(self.centroids) + 1))
+
+    def search(self, queries, number, excluded=None):
+        queries = np.asarray(queries, dtype=np.float64)
+        probes = top_indexes(
+            2 * queries.dot(self.centroids[:, :-1].T) - self._centroid_norms,
+            self.number_probes
+        )[0]  # Closest centres by euclidean distance to the query with a 0 added, as in nearest_centroids
+
+        indexes = np.full((len(queries), number), -1, dtype=np.int64)
+        scores = np.full((len(queries), number), -np.inf)
+        for row, query in enumerate(queries):
+            candidates = np.sort(np.concatenate(
+                [self._order[self._list_starts[i]:self._list_starts[i + 1]] for i in probes[row]]
+            ))  # Sorted so equal scores are in order of row
+            if excluded is not None:
+                candidates = candidates[~np.isin(candidates, excluded[row])]
+
+            top, top_scores = top_indexes(self.vectors[candidates].dot(query)[np.newaxis], number)
+            found = top[0] != -1
+            indexes[row, found] = candidates[top[0, found]]
+            scores[row] = top_scores[0]
+
+        return indexes, scores
+
+    def arrays(self):
+        return {"centroids": self.centroids, "assignments": self.assignments}
+
+
+ENGINES = {i.name: i for i in (ExactSearch, IVFSearch)}
+
+# ------------------------------------------------------------------------------
+# Similarity Index
+# ------------------------------------------------------------------------------
+class SimilarityIndex:
+    # The most similar items to every item by cosine similarity, calculated in advance, so finding them is a lookup of
+    # one row of the neighbour table, rather than comparing the item with every other item. Items with the same
+    # similarity are in order of id. The table is found with a search engine, which is saved with it.
+    def __init__(self, ids, vectors, number_neighbours, engine="exact", engine_options=None, neighbours=None,
+            similarities=None, engine_arrays=None):
+        # ids and vectors are the id of each item, and its row in the matrix of vectors. neighbours, similarities and
+        # engine_arrays are only given when the table has already been calculated, such as by load.
+        if engine_options is None:
+            engine_options = dict()
+        if engine_arrays is None:
+            engine_arrays = dict()
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        self.lookup_table = data_structures.LookupTable(ids[order])
+        self.vectors = normalise_rows(np.asarray(vectors)[order])
+        self._number_neighbours = number_neighbours
+        self._engine_options = engine_options  # As given rather than as used by the engine, so load can check they
+        # match the options the index is wanted with
+        self.engine = create_engine(engine, self.vectors, **engine_options, **engine_arrays)
+
+        if neighbours is None:
+            neighbours, similarities = self._calculate_neighbours()
+        self.neighbours = neighbours  # Row indexes of each item's neighbours, most similar first. -1 if there are
+        # fewer other items than number_neighbours.
+        self.similarities = similarities
+
+    def _calculate_neighbours(self):
+        num_items = len(self.lookup_table)
+        neighbours = np.full((num_items, self._number_neighbours), -1, dtype=np.int64)
+        similarities = np.zeros((num_items, self._number_neighbours))
+        if self._number_neighbours == 0:
+            return neighbours, similarities
+
+        batch_size = max(1, SIMILARITY_BATCH_SIZE // max(1, num_items))
+        for start in range(0, num_items, batch_size):
+            end = min(start + batch_size, num_items)
+            rows = np.arange(start, end)
+            neighbours[start:end], scores = self.engine.search(
+                self.vectors[start:end],
+                self._number_neighbours,
+                excluded=rows[:, np.newaxis]  # An item is not its own neighbour
+            )
+            similarities[start:end] = np.where(neighbours[start:end] != -1, scores, 0)
+
+        return neighbours, similarities
+
+    def __contains__(self, item_id):
+        return self.lookup_table.contains_id(item_id)
+
+    def __len__(self):
+        return len(self.lookup_table)
+
+    @property
+    def number_neighbours(self):
+        return self._number_neighbours
+
+    def get_neighbours(self, item_id, number=None):
+        # Ids of the most similar items to the item, most similar first. Raises KeyError if the item is not in the index.
+        row = self.neighbours[self.lookup_table.get_index(item_id), :number]
+        return self.lookup_table.get_ids(row[row >= 0]).tolist()
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = path + ".tmp.npz"  # Written then renamed, so a partially written file is never read
+        np.savez(
+            temp_path,
+            version=INDEX_FILE_VERSION,
+            ids=self.lookup_table.ids,
+            vectors=self.vectors,
+            neighbours=self.neighbours,
+            similarities=self.similarities,
+            engine=self.engine.name,
+            engine_options=json.dumps(self._engine_options, sort_keys=True),
+            **{"engine_" + key: value for key, value in self.engine.arrays().items()}
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, number_neighbours, engine="exact", engine_options=None):
+        # Returns None if there is no file, it is from a different version, or it has a different number of
+        # neighbours or engine, as the index needs to be calculated again.
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as saved:
+            if int(saved["version"]) != INDEX_FILE_VERSION or saved["neighbours"].shape[1] != number_neighbours:
+                return None
+
+            if str(saved["engine"]) != engine or \
+                    str(saved["engine_options"]) != json.dumps(engine_options or dict(), sort_keys=True):
+                return None
+
+            return cls(
+                saved["ids"],
+                saved["vectors"],
+                number_neighbours,
+                engine=engine,
+                engine_options=engine_options,
+                neighbours=saved["neighbours"],
+                similarities=saved["similarities"],
+                engine_arrays={key[len("engine_"):]: saved[key] for key in saved.files
+                    if key.startswith("engine_") and key != "engine_options"}
+            )
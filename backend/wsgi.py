@@ -1,6 +1,7 @@
 # -----------------------------------------------------------------------------
 # Standard Python library imports
 # -----------------------------------------------------------------------------
+import os
 import json
 import urllib.parse
 
@@ -17,6 +18,7 @@ import components.reading_lists
 import components.recommendations
 
 import configuration
+import data_structures
 import environ_manipulation
 import logger
 import mysql_handler
@@ -29,6 +31,11 @@ config = configuration.Configuration(
     default_conf_filename="./default_config.json"
 )
 # The json does not need to be user editable, so is not very readable.
+project_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+nearest_neighbour_options = {
+    "number_lists": config.get("nearest_neighbours number_lists"),
+    "number_probes": config.get("nearest_neighbours number_probes")
+}  # Only used by the ivf engine
 
 # -----------------------------------------------------------------------------
 # Database connection
@@ -37,8 +44,11 @@ connection = mysql_handler.Connection(
     user=config.get("mysql username"),
     password=config.get("mysql password"),
     schema=config.get("mysql schema"),
-    host=config.get("mysql host")
-)
+    host=config.get("mysql host"),
+    pool_size=config.get("mysql pool_size"),
+    pool_timeout=config.get("mysql pool_timeout"),
+    slow_query_time=config.get("mysql slow_query_time")
+)  # Shared by every request thread, so is a pool of connections
 
 # -----------------------------------------------------------------------------
 # Project Constants
@@ -51,7 +61,13 @@ number_home_summaries = config.get("home number_home_summaries")  # This is a
 # -----------------------------------------------------------------------------
 # Class instantiation
 # -----------------------------------------------------------------------------
-diaries = components.diaries.Diaries(connection)
+cache = data_structures.TTLCache(
+    config.get("cache ttl"),
+    config.get("cache max_size"),
+    invalidation_directory=os.path.join(project_directory, config.get("cache invalidation_directory"))
+)  # Sections of pages that are the same for every user, shared by every request thread. Invalidations are shared with
+# the other FastCGI processes through the directory.
+diaries = components.diaries.Diaries(connection, cache)
 genres = components.genres.Genres(connection)
 sessions = components.accounts.Sessions(
     connection,
@@ -78,14 +94,19 @@ reading_lists = components.reading_lists.ReadingLists(
     connection,
     number_home_summaries,
     config.get("number_display_genres"),
-    recommendations
+    recommendations,
+    cache
 )
 books = components.books.Books(
     connection,
     reading_lists,
     config.get("home number_about_similarities"),
     number_home_summaries,
-    config.get("number_display_genres")
+    config.get("number_display_genres"),
+    cache,
+    similarity_index_path=os.path.join(project_directory, config.get("books similarity_index_path")),
+    similarity_engine=config.get("books similarity_engine"),
+    similarity_engine_options=nearest_neighbour_options
 )
 accounts = components.accounts.Accounts(
     connection,
@@ -99,7 +120,9 @@ information_retrieval = components.information_retrieval.DocumentCollection(
     books,
     authors,
     genres,
-    config.get("search number_results")
+    config.get("search number_results"),
+    backend=config.get("search backend"),
+    index_path=os.path.join(project_directory, config.get("search index_path"))
 )
 
 
@@ -155,7 +178,9 @@ class Handler(object):
             target_name = environ_manipulation.application.get_sub_target(self._environ)
             self._log.output_message(f"     Redirecting to {self.__class__.__name__}.{target_name}")
             target_function = self._routes.get(target_name) or ErrorHandler("404 Not Found", log).error_response
-            response, status, response_headers = target_function()
+            with connection.request(self._environ["REQUEST_URI"]):  # Every query for the request uses the same
+                # pooled connection, and the queries are recorded against the URI
+                response, status, response_headers = target_function()
         except Exception as e:
             self._log.output_message(f"     An error occurred within {self.__class__.__name__}.{target_name} whilst processing the request")
             self._log.output_message("     " + repr(e))
@@ -1006,20 +1031,34 @@ class HomeHandler(Handler):
         try:
             self._log.output_message("          Session ID: " + session_id)
             user_id = sessions.get_user_id(session_id)
-            sessions.update_time(session_id)
+            sessions.update_time(session_id)  # A write, so is not made by gather
             self._log.output_message("          User ID: " + str(user_id))
-
-            result["recommended"] = recommendations.get_user_recommendation_summaries(user_id)[:number_home_summaries]
-            result["currently_reading"] = reading_lists.get_currently_reading(user_id)[:number_home_summaries]
-            result["want_read"] = reading_lists.get_want_read(user_id)[:number_home_summaries]
         except components.accounts.SessionExpiredError:
             self._log.output_message("          Session expired / No session")
+            user_id = None
+
+        if user_id is not None:
+            (
+                result["trending"],
+                result["newest_additions"],
+                result["recommended"],
+                result["currently_reading"],
+                result["want_read"]
+            ) = connection.gather(
+                reading_lists.get_popular,
+                books.get_newest,
+                lambda: recommendations.get_user_recommendation_summaries(user_id)[:number_home_summaries],
+                lambda: reading_lists.get_currently_reading(user_id)[:number_home_summaries],
+                lambda: reading_lists.get_want_read(user_id)[:number_home_summaries]
+            )  # None of these depend on each other, so are made at the same time on different connections
+        else:
             result["recommended"] = None
             result["currently_reading"] = None
             result["want_read"] = None
-        
-        result["trending"] = reading_lists.get_popular()
-        result["newest_additions"] = books.get_newest()
+            result["trending"], result["newest_additions"] = connection.gather(
+                reading_lists.get_popular,
+                books.get_newest
+            )
 
         response = json.dumps(result)
 
@@ -1238,36 +1277,50 @@ class SearchingHandler(Handler):
         self._log.output_message("          Session ID: " + session_id)
         try:
             user_id = sessions.get_user_id(session_id)
-            sessions.update_time(session_id)
+            sessions.update_time(session_id)  # A write, so is not made by gather
             self._log.output_message("          User ID: " + str(user_id))
         except components.accounts.SessionExpiredError:
             self._log.output_message("          Session expired")
             user_id = None
             self._log.output_message("          User ID: #N/A")
-        
+
+        functions = [
+            reading_lists.get_popular,
+            books.get_newest,
+            books.get_highly_rated
+        ]  # This is not user specific
+        if user_id is not None:
+            functions += [
+                lambda: reading_lists.get_most_recent_read(user_id),
+                lambda: reading_lists.get_newest_addition(user_id),
+                lambda: authors.get_author_favourite_data(user_id)
+            ]
+        results = connection.gather(*functions)  # None of these depend on each other, so are made at the same time on
+        # different connections
+
         result = {
-            "trending": reading_lists.get_popular(),
-            "newest_additions": books.get_newest(),
-            "highly_rated": books.get_highly_rated()
-        }  # This is not user specific
+            "trending": results[0],
+            "newest_additions": results[1],
+            "highly_rated": results[2]
+        }
 
         result["because_read"] = result["because_added"] = None
 
         if user_id is not None:
-            res = reading_lists.get_most_recent_read(user_id)
-            if res is not None:
-                book_id, title = res
-                if book_id is not None:
-                    result["because_read"] = books.get_similar_items(book_id)
-                    result["because_read_title"] = title
-            res = reading_lists.get_newest_addition(user_id)
-            if res is not None:
-                book_id, title = res
-                if book_id is not None:
-                    result["because_added"] = books.get_similar_items(book_id)
-                    result["because_added_title"] = title
-            result["favourite_authors"] = authors.get_author_favourite_data(user_id)
-            
+            result["favourite_authors"] = results[5]
+
+            similar = []  # (key, book_id, title) for each set of similar books needed
+            for key, res in (("because_read", results[3]), ("because_added", results[4])):
+                if res is not None and res[0] is not None:
+                    similar.append((key, res[0], res[1]))
+
+            similar_items = connection.gather(*[
+                lambda book_id=book_id: books.get_similar_items(book_id) for key, book_id, title in similar
+            ])  # Needs the books from the first set of queries, so cannot be part of it
+            for (key, book_id, title), items in zip(similar, similar_items):
+                result[key] = items
+                result[key + "_title"] = title
+
         response = json.dumps(result)
 
         status = "200 OK"
@@ -1283,6 +1336,48 @@ class SearchingHandler(Handler):
         return response, status, response_headers
 
 
+# -----------------------------------------------------------------------------
+# Debug Handler
+# -----------------------------------------------------------------------------
+class DebugHandler(Handler):
+    # Only routed to when debugging is enabled, as it shows the queries that have been made.
+    def __init__(self, log):
+        super().__init__(log)
+        self._routes = {
+            "query_statistics": self.get_query_statistics,
+            "reset_query_statistics": self.reset_query_statistics
+        }
+
+    def get_query_statistics(self):
+        response = json.dumps(connection.query_statistics())  # Includes the request for this, as it is recorded
+        # after the response is created
+        status = "200 OK"
+
+        self._log.output_message("          Status: " + status)
+
+        response_headers = [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(response)))
+        ]
+
+        return response, status, response_headers
+
+    def reset_query_statistics(self):
+        connection.reset_statistics()
+        response = ""
+        status = "200 OK"
+
+        self._log.output_message("          Reset query statistics")
+        self._log.output_message("          Status: " + status)
+
+        response_headers = [
+            ("Content-Type", "text/plain"),
+            ("Content-Length", str(len(response)))
+        ]
+
+        return response, status, response_headers
+
+
 # -----------------------------------------------------------------------------
 # Error Handler
 # -----------------------------------------------------------------------------
@@ -1335,4 +1430,7 @@ if __name__ != "__main__":
         # Objects are persistent, so will the response should be faster and more memory efficient.
     }
 
+    if config.get("debugging"):
+        routes["debug"] = DebugHandler(log)  # Query statistics should not be public
+
     app = Middleware(routes, log)
@@ -0,0 +1,80 @@
+# python3 benchmark_nearest_neighbours.py
+# Benchmarks for the nearest neighbour engines, which do not need the test database. Each approximate engine is compared
+# with the exact engine on generated vectors, for time and recall@K - the fraction of the true top K that it finds.
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import nearest_neighbours
+
+NUM_GENRES = 50
+GENRES_PER_BOOK = 6
+NUMBER_NEIGHBOURS = 10
+NUM_QUERIES = 500
+
+
+def generate_genre_vectors(num_books):
+    # Books have a few genres each, with a random match strength, like book_genres
+    vectors = np.zeros((num_books, NUM_GENRES))
+    for row in vectors:
+        row[np.random.choice(NUM_GENRES, GENRES_PER_BOOK, replace=False)] = np.random.random(GENRES_PER_BOOK)
+    return nearest_neighbours.normalise_rows(vectors)
+
+
+def recall(found, expected):
+    # Fraction of the expected neighbours of each query that were found, averaged over the queries
+    return np.mean([
+        len(set(i[i != -1]) & set(k[k != -1])) / max(1, (k != -1).sum()) for i, k in zip(found, expected)
+    ])
+
+
+def run_engine(name, vectors, queries, excluded=None, **options):
+    start_time = time.perf_counter()
+    engine = nearest_neighbours.create_engine(name, vectors, **options)
+    build_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    found = engine.search(queries, NUMBER_NEIGHBOURS, excluded=excluded)[0]
+    search_time = time.perf_counter() - start_time
+    return found, build_time, search_time
+
+
+def benchmark_engines(vectors, queries, excluded=None, probes=(1, 2, 4, 8, 16, 32)):
+    exact, build_time, search_time = run_engine("exact", vectors, queries, excluded)
+    print(f"{'engine':>10} {'probes':>10} {'build s':>10} {'ms/query':>10} {f'recall@{NUMBER_NEIGHBOURS}':>10}")
+    print(f"{'exact':>10} {'-':>10} {build_time:>10.4f} {search_time / len(queries) * 1e3:>10.4f} {1:>10.3f}")
+
+    for number_probes in probes:
+        found, build_time, search_time = run_engine("ivf", vectors, queries, excluded, number_probes=number_probes)
+        print(
+            f"{'ivf':>10} {number_probes:>10} {build_time:>10.4f} {search_time / len(queries) * 1e3:>10.4f} "
+            f"{recall(found, exact):>10.3f}"
+        )
+
+
+def benchmark_book_similarity(sizes=(10000, 100000)):
+    # Cosine similarity between books' genres, as used to build the similar books index
+    for num_books in sizes:
+        print(f"\nSimilar books: {num_books} books")
+        vectors = generate_genre_vectors(num_books)
+        rows = np.random.choice(num_books, NUM_QUERIES, replace=False)
+        benchmark_engines(vectors, vectors[rows], excluded=rows[:, np.newaxis])
+
+
+def benchmark_recommendation_candidates(sizes=(10000, 100000)):
+    # Dot product between user and book factors, as used to choose recommendations. This is not normalised, so
+    # longer book vectors score higher, which the ivf engine allows for with augment_for_inner_product.
+    for num_books in sizes:
+        print(f"\nRecommendation candidates: {num_books} books")
+        book_factors = generate_genre_vectors(num_books) * np.random.random((num_books, 1))
+        user_factors = np.random.random((NUM_QUERIES, NUM_GENRES))
+        benchmark_engines(book_factors, user_factors)
+
+
+if __name__ == "__main__":
+    benchmark_book_similarity()
+    benchmark_recommendation_candidates()
@@ -0,0 +1,117 @@
+# python3 benchmark_recommendations.py
+# Benchmarks for the recommendation system which do not need the test database. The database connection is replaced by
+# an in-memory table of generated ratings, so only the time spent in the recommendations module is measured.
+import sys
+import os
+import time
+import random
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import components.recommendations
+
+NUM_USERS = 200
+NUM_GENRES = 20
+RATINGS_PER_BOOK = 5
+
+
+class GeneratedConnection:
+    # Answers the queries made by the Recommendations class from generated data. Anything that is not needed for the
+    # rating matrix (preferences, reading lists etc.) is empty.
+    def __init__(self, num_ratings):
+        self.user_ids = list(range(1, NUM_USERS + 1))
+        self.book_ids = list(range(1, (num_ratings // RATINGS_PER_BOOK) + 1))
+        self.genre_ids = list(range(1, NUM_GENRES + 1))
+
+        self.reviews = [
+            (random.choice(self.user_ids), random.choice(self.book_ids), random.randint(1, 5)) for i in range(num_ratings)
+        ]
+
+    def query(self, query, params=None):
+        if "FROM genres" in query:
+            return [(i,) for i in self.genre_ids]
+        elif "FROM users" in query and "preferences_set" not in query:
+            return [(i,) for i in self.user_ids]
+        elif "FROM books" in query:
+            return [(i,) for i in self.book_ids]
+        elif "FROM reviews" in query:
+            return self.reviews
+        return []
+
+    def stream(self, query, params=None, batch_size=None):
+        return iter(self.query(query, params))
+
+    def bulk_replace(self, table, columns, rows, where=None, where_params=None):
+        list(rows)  # Rows are generated but not stored
+
+
+def create_recommendations(connection):
+    return components.recommendations.Recommendations(
+        connection,
+        num_converge_iters=10,
+        hyperparam=0.1,
+        number_display_genres=8,
+        initial_recommendation_mat_val=0.5,
+        reading_list_percentage_increase=0.5,
+        following_percentage_increase=0.5,
+        bad_recommendation_value=0.5,
+        minimum_required_reviews=10,
+        number_recommendations=10
+    )
+
+
+def benchmark_review_matrix(sizes=(2000, 4000, 8000, 16000, 32000, 64000)):
+    # The time per rating should stay roughly constant as the number of ratings (and therefore books) increases.
+    print(f"{'ratings':>10} {'books':>10} {'seconds':>10} {'us/rating':>10}")
+    for num_ratings in sizes:
+        connection = GeneratedConnection(num_ratings)
+        recommendations = create_recommendations(connection)
+
+        start_time = time.perf_counter()
+        recommendations.gen_review_matrix()
+        total_time = time.perf_counter() - start_time
+
+        print(f"{num_ratings:>10} {len(connection.book_ids):>10} {total_time:>10.4f} {total_time / num_ratings * 1e6:>10.2f}")
+
+
+def benchmark_fold_in(sizes=(2000, 20000, 200000), num_ratings=20, repeats=100):
+    # Time to give a single user factors and score every book, which happens while the user waits for a response.
+    print(f"{'books':>10} {'ms/user':>10}")
+    for num_books in sizes:
+        connection = GeneratedConnection(num_books * RATINGS_PER_BOOK)
+        recommendations = create_recommendations(connection)
+        recommendations.book_factors = np.random.random(recommendations.book_factors.shape)
+
+        start_time = time.perf_counter()
+        for i in range(repeats):
+            ratings = {book_id: random.randint(1, 5) for book_id in random.sample(connection.book_ids, num_ratings)}
+            user_vec = recommendations.fold_in_user(0, ratings)
+            recommendations.book_factors.dot(user_vec).argsort()
+        total_time = time.perf_counter() - start_time
+
+        print(f"{num_books:>10} {total_time / repeats * 1e3:>10.3f}")
+
+
+def benchmark_gen_recommendations(sizes=(1000, 4000, 16000)):
+    # Scoring and choosing the recommendations for every user. This should scale with users x books.
+    print(f"{'users':>10} {'books':>10} {'seconds':>10} {'ns/score':>10}")
+    for num_books in sizes:
+        connection = GeneratedConnection(num_books * RATINGS_PER_BOOK)
+        recommendations = create_recommendations(connection)
+        recommendations.book_factors = np.random.random(recommendations.book_factors.shape)
+        recommendations.user_factors = np.random.random(recommendations.user_factors.shape)
+
+        start_time = time.perf_counter()
+        recommendations.gen_recommendations()
+        total_time = time.perf_counter() - start_time
+
+        num_scores = len(connection.user_ids) * num_books
+        print(f"{len(connection.user_ids):>10} {num_books:>10} {total_time:>10.4f} {total_time / num_scores * 1e9:>10.2f}")
+
+
+if __name__ == "__main__":
+    benchmark_review_matrix()
+    benchmark_fold_in()
+    benchmark_gen_recommendations()
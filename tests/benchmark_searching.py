@@ -0,0 +1,143 @@
+# python3 benchmark_searching.py
+# Benchmarks for the search backends, which do not need the test database. The database connection is replaced by
+# generated documents, so only the time and memory used by the information retrieval module is measured.
+import sys
+import os
+import time
+import tempfile
+import random
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import components.information_retrieval
+
+VOCABULARY_SIZE = 50000
+NUM_QUERIES = 200
+
+
+class GeneratedConnection:
+    # Answers the queries made by the DocumentCollection class from generated documents. unique_words and the idf
+    # values are kept in memory, rather than in a table.
+    def __init__(self, num_books):
+        self.vocabulary = ["word" + str(i) for i in range(VOCABULARY_SIZE)]
+        self.authors = [(self.name(2), i) for i in range(1, (num_books // 10) + 2)]
+        self.genres = [(self.name(2), i) for i in range(1, 101)]
+        self.books = [(self.name(6), i, random.choice(self.authors)[0]) for i in range(1, num_books + 1)]
+        self.unique_words = []
+        self.idf_values = dict()
+
+    def name(self, max_words):
+        return " ".join(random.choices(self.vocabulary, k=random.randint(1, max_words)))
+
+    def stream(self, query, params=None, batch_size=None):
+        if "FROM books" in query:
+            return iter(self.books)
+        elif "FROM genres" in query:
+            return iter(self.genres)
+        return iter(self.authors)
+
+    def query(self, query, params=None):
+        if "SELECT word, idf_values" in query:
+            return list(self.idf_values.items())
+        elif "FROM unique_words" in query:
+            return [(i, word) for i, (word,) in enumerate(self.unique_words)]
+        return list(self.stream(query, params))
+
+    def bulk_replace(self, table, columns, rows, where=None, where_params=None):
+        self.unique_words = list(rows)
+
+    def bulk_upsert(self, table, columns, rows, update_columns):
+        self.idf_values = {word: idf for word_id, word, idf in rows}
+
+
+def create_collection(connection, backend, index_path=None):
+    collection = components.information_retrieval.DocumentCollection(
+        connection,
+        None,
+        None,
+        None,
+        50,
+        backend=backend,
+        index_path=index_path
+    )
+    collection.gen_unique_words()
+    collection.gen_idf_values()
+    return collection
+
+
+def benchmark_backends(sizes=(10000, 100000)):
+    # Memory is what the backend's index takes, on top of the documents, which both backends need. Latency is the
+    # time taken by tfidf_search, once the index has been generated.
+    print(f"{'books':>10} {'backend':>10} {'index MB':>10} {'build s':>10} {'ms/query':>10}")
+    for num_books in sizes:
+        connection = GeneratedConnection(num_books)
+        queries = [connection.name(3) for i in range(NUM_QUERIES)]
+
+        for backend in components.information_retrieval.SEARCH_BACKENDS:
+            collection = create_collection(connection, backend)
+
+            tracemalloc.start()
+            start_time = time.perf_counter()
+            if backend == "dict":
+                collection.inverted_index
+            else:
+                collection.sparse_index
+            build_time = time.perf_counter() - start_time
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            start_time = time.perf_counter()
+            for query in queries:
+                collection.tfidf_search(query)
+            search_time = time.perf_counter() - start_time
+
+            print(
+                f"{num_books:>10} {backend:>10} {memory / 2 ** 20:>10.1f} {build_time:>10.3f} "
+                f"{search_time / NUM_QUERIES * 1e3:>10.3f}"
+            )
+
+
+def benchmark_startup(sizes=(10000, 100000)):
+    # Time and memory taken by a web server process to create the collection and answer its first search, with the
+    # documents loaded from the database, or the index memory mapped. Memory mapped pages are read from the file, and
+    # shared with every other process that maps it, so are not counted.
+    print(f"{'books':>10} {'index':>10} {'memory MB':>10} {'startup s':>10} {'ms/query':>10}")
+    for num_books in sizes:
+        connection = GeneratedConnection(num_books)
+        queries = [connection.name(3) for i in range(NUM_QUERIES)]
+        with tempfile.TemporaryDirectory() as directory:
+            index_path = os.path.join(directory, "search_index.bin")
+            create_collection(connection, "dict", index_path).refresh_search_index()
+
+            for name, path in (("database", None), ("mapped", index_path)):
+                tracemalloc.start()
+                start_time = time.perf_counter()
+                collection = components.information_retrieval.DocumentCollection(
+                    connection,
+                    None,
+                    None,
+                    None,
+                    50,
+                    index_path=path
+                )
+                collection.tfidf_search(queries[0])
+                startup_time = time.perf_counter() - start_time
+                memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+
+                start_time = time.perf_counter()
+                for query in queries:
+                    collection.tfidf_search(query)
+                search_time = time.perf_counter() - start_time
+
+                print(
+                    f"{num_books:>10} {name:>10} {memory / 2 ** 20:>10.1f} {startup_time:>10.3f} "
+                    f"{search_time / NUM_QUERIES * 1e3:>10.3f}"
+                )
+                del collection  # Freed here, rather than while the next one is timed
+
+
+if __name__ == "__main__":
+    benchmark_backends()
+    benchmark_startup()
@@ -3,6 +3,8 @@ import unittest
 import sys
 import os
 
+import numpy as np
+
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
 
 import configuration
@@ -10,6 +12,7 @@ import mysql_handler
 import components.recommendations
 import components.reading_lists
 import components.books
+import nearest_neighbours
 
 config = configuration.Configuration(
     "./project_config.conf",
@@ -123,6 +126,27 @@ class BooksTest(unittest.TestCase):
             500
         )
 
+    def test_similar_books_not_indexed(self):
+        not_indexed = components.books.Books(
+            connection,
+            reading_lists,
+            config.get("home number_about_similarities"),
+            number_home_summaries,
+            config.get("number_display_genres")
+        )
+        not_indexed._similarity_index = nearest_neighbours.SimilarityIndex(
+            [2, 3],
+            np.eye(2),
+            config.get("home number_about_similarities")
+        )  # Such as an index refreshed before book 1 was added
+
+        assert (not_indexed.get_similar_items(1) == [])
+        self.assertRaises(
+            components.books.BookNotFoundError,
+            not_indexed.get_similar_items,
+            500
+        )
+
     def test_summary_data_id(self):
         exp = {'author': 'Author 1', 'title': 'Book 1', 'book_id': 1, 'cover': ''}
         assert (books.get_summary(1) == exp)
@@ -2,6 +2,9 @@
 import string
 import unittest
 import random
+import threading
+import tempfile
+import time
 import sys
 import os
 from queue import PriorityQueue as TruePriorityQueue
@@ -161,5 +164,178 @@ class StackTest(unittest.TestCase):
             stack.pop
         )
 
+class LookupTableTest(unittest.TestCase):
+    def test_index_to_id(self):
+        ids = random.sample(range(1, 10000), 100)
+        table = structures.LookupTable(ids)
+
+        assert ([table[i] for i in table] == ids)
+
+    def test_id_to_index(self):
+        ids = random.sample(range(1, 10000), 100)
+        table = structures.LookupTable(ids)
+
+        assert ([table.get_index(i) for i in ids] == list(range(100)))
+        assert (table.get_index(str(ids[10])) == 10)  # Ids from GROUP_CONCAT are strings
+
+    def test_vectorised(self):
+        ids = random.sample(range(1, 10000), 100)
+        table = structures.LookupTable(ids)
+        targets = random.choices(ids, k=50)
+
+        indexes = table.get_indexes(targets)
+
+        assert (table.get_ids(indexes).tolist() == targets)
+
+    def test_unknown_id(self):
+        table = structures.LookupTable([1, 2, 3])
+
+        assert (not table.contains_id(4))
+        self.assertRaises(
+            KeyError,
+            table.get_index,
+            4
+        )
+
+class TTLCacheTest(unittest.TestCase):
+    def test_reused(self):
+        cache = structures.TTLCache(ttl=60)
+        calls = []
+        for i in range(3):
+            assert (cache.get("a", lambda: calls.append(1) or len(calls)) == 1)
+
+        assert (len(calls) == 1)
+
+    def test_expired(self):
+        cache = structures.TTLCache(ttl=0.05)
+        assert (cache.get("a", lambda: 1) == 1)
+        time.sleep(0.1)
+
+        assert ("a" not in cache)
+        assert (cache.get("a", lambda: 2) == 2)
+        assert (cache.get("b", lambda: 3, ttl=0) == 3)
+        assert (cache.get("b", lambda: 4, ttl=0) == 4)  # The ttl can be given for each key
+
+    def test_no_ttl(self):
+        cache = structures.TTLCache()
+        assert (cache.get("a", lambda: 1) == 1)
+        assert (cache.get("a", lambda: 2) == 2)
+        assert (len(cache) == 0)  # Not stored, so an expired value is never given to another thread
+
+        started = threading.Event()
+
+        def calculate():
+            started.set()
+            time.sleep(0.1)
+            return 3
+
+        thread = threading.Thread(target=cache.get, args=("a", calculate))
+        thread.start()
+        started.wait()
+        assert (cache.get("a", lambda: 4) == 4)  # Calculated by each caller, rather than waiting for the other thread
+        thread.join()
+
+    def test_least_recently_used(self):
+        cache = structures.TTLCache(ttl=60, max_size=2)
+        cache.get("a", lambda: 1)
+        cache.get("b", lambda: 2)
+        cache.get("a", lambda: 1)
+        cache.get("c", lambda: 3)
+
+        assert ("a" in cache and "b" not in cache and "c" in cache)
+        assert (len(cache) == 2)
+
+    def test_invalidate(self):
+        cache = structures.TTLCache(ttl=60)
+        cache.get("a", lambda: 1)
+        cache.get("b", lambda: 2)
+        cache.invalidate("a")
+
+        assert (cache.get("a", lambda: 3) == 3)
+        assert (cache.get("b", lambda: 4) == 2)
+
+    def test_invalidate_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = structures.TTLCache(ttl=60, invalidation_directory=directory)
+            other = structures.TTLCache(ttl=60, invalidation_directory=directory)  # Such as another process
+            cache.get("a", lambda: 1)
+            cache.get("b", lambda: 2)
+            other.invalidate("a")
+
+            assert ("a" not in cache)
+            assert (cache.get("a", lambda: 3) == 3)
+            assert (cache.get("a", lambda: 4) == 3)  # Calculated after the invalidation, so is reused
+            assert (cache.get("b", lambda: 5) == 2)
+
+    def test_invalidated_shared_while_calculating(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = structures.TTLCache(ttl=60, invalidation_directory=directory)
+            other = structures.TTLCache(ttl=60, invalidation_directory=directory)
+
+            def calculate():
+                other.invalidate("a")  # Straight after it was started, so the file may have the same modification time
+                return 1
+
+            assert (cache.get("a", calculate) == 1)
+            assert ("a" not in cache)
+            assert (cache.get("a", lambda: 2) == 2)
+
+    def test_single_flight(self):
+        cache = structures.TTLCache(ttl=60)
+        calls = []
+
+        def calculate():
+            calls.append(1)
+            time.sleep(0.1)
+            return 1
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("a", calculate))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert (len(calls) == 1)
+        assert (results == [1] * 5)
+
+    def test_stale_while_refreshing(self):
+        cache = structures.TTLCache(ttl=0.05)
+        cache.get("a", lambda: 1)
+        time.sleep(0.1)
+
+        started = threading.Event()
+
+        def calculate():
+            started.set()
+            time.sleep(0.1)
+            return 2
+
+        thread = threading.Thread(target=cache.get, args=("a", calculate))
+        thread.start()
+        started.wait()
+        assert (cache.get("a", lambda: 3) == 1)  # Another thread is recalculating it, so the old value is used
+        thread.join()
+        assert (cache.get("a", lambda: 3) == 2)
+
+    def test_invalidated_while_calculating(self):
+        cache = structures.TTLCache(ttl=60)
+
+        def calculate():
+            cache.invalidate("a")  # Such as a write made while the value was being calculated
+            return 1
+
+        assert (cache.get("a", calculate) == 1)
+        assert ("a" not in cache)
+
+    def test_error(self):
+        cache = structures.TTLCache(ttl=60)
+
+        def calculate():
+            raise ValueError()
+
+        self.assertRaises(ValueError, cache.get, "a", calculate)
+        assert (cache.get("a", lambda: 1) == 1)
+
 if __name__ == '__main__':
     unittest.main()
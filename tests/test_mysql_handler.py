@@ -0,0 +1,356 @@
+import unittest
+import threading
+import time
+import sys
+import os
+
+import mysql.connector
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import configuration
+import mysql_handler
+
+config = configuration.Configuration(
+    "./project_config.conf",
+    default_conf_filename="./default_config.json"
+)
+
+connection = mysql_handler.Connection(
+    user=config.get("mysql username"),
+    password=config.get("mysql password"),
+    schema=config.get("mysql schema"),
+    host=config.get("mysql host")
+)
+
+def table_rows():
+    return connection.query("SELECT entry_id, name, value FROM handler_test ORDER BY entry_id")
+
+class HandlerTableTests(unittest.TestCase):
+    # Creates a table to test with, which is removed afterwards
+    def setUp(self):
+        connection.query("""
+            CREATE TABLE handler_test (
+                entry_id INT NOT NULL,
+                name VARCHAR(10) NOT NULL,
+                value FLOAT NOT NULL,
+                PRIMARY KEY (entry_id)
+            )
+        """)
+        connection.query("INSERT INTO handler_test (entry_id, name, value) VALUES (1, 'a', 1.5), (2, 'b', 2.5)")
+
+    def tearDown(self):
+        connection.query("DROP TABLE handler_test")
+
+class BulkReplaceTests(HandlerTableTests):
+    def test_replace_all(self):
+        connection.bulk_replace("handler_test", ["entry_id", "name", "value"], [(3, "c", 3.5)])
+        assert (table_rows() == [(3, "c", 3.5)])
+
+    def test_replace_where(self):
+        connection.bulk_replace("handler_test", ["entry_id", "name", "value"], [(3, "c", 3.5)], where="entry_id=1")
+        assert (table_rows() == [(2, "b", 2.5), (3, "c", 3.5)])
+
+    def test_chunks(self):
+        rows = [(i, str(i), i / 2) for i in range(10, 15)]
+        connection.bulk_replace("handler_test", ["entry_id", "name", "value"], (i for i in rows), chunk_size=2)
+        assert (table_rows() == rows)
+
+    def test_where_params(self):
+        connection.bulk_replace("handler_test", ["entry_id", "name", "value"], [(3, "c", 3.5)], where="name=%s", where_params=("b",))
+        assert (table_rows() == [(1, "a", 1.5), (3, "c", 3.5)])
+
+    def test_empty(self):
+        connection.bulk_replace("handler_test", ["entry_id", "name", "value"], [])
+        assert (table_rows() == [])
+
+    def test_failure_keeps_rows(self):
+        rows = [(3, "c", 3.5), (3, "d", 4.5)]  # Duplicate primary key
+        self.assertRaises(
+            mysql.connector.Error,
+            connection.bulk_replace,
+            "handler_test",
+            ["entry_id", "name", "value"],
+            rows,
+            chunk_size=1
+        )
+        assert (table_rows() == [(1, "a", 1.5), (2, "b", 2.5)])
+
+class BulkUpsertTests(HandlerTableTests):
+    def test_update(self):
+        connection.bulk_upsert("handler_test", ["entry_id", "name", "value"], [(2, "x", 5.5)], ["value"])
+        assert (table_rows() == [(1, "a", 1.5), (2, "b", 5.5)])  # Only the update columns are changed
+
+    def test_insert(self):
+        connection.bulk_upsert("handler_test", ["entry_id", "name", "value"], [(3, "c", 3.5)], ["value"])
+        assert (table_rows() == [(1, "a", 1.5), (2, "b", 2.5), (3, "c", 3.5)])
+
+    def test_chunks(self):
+        rows = [(i, str(i), i / 2) for i in range(1, 6)]
+        connection.bulk_upsert("handler_test", ["entry_id", "name", "value"], (i for i in rows), ["name", "value"],
+            chunk_size=2)
+        assert (table_rows() == rows)
+
+    def test_empty(self):
+        connection.bulk_upsert("handler_test", ["entry_id", "name", "value"], [], ["value"])
+        assert (table_rows() == [(1, "a", 1.5), (2, "b", 2.5)])
+
+    def test_failure_keeps_rows(self):
+        rows = [(1, "a", 7.5), (3, None, 3.5)]  # name cannot be NULL
+        self.assertRaises(
+            mysql.connector.Error,
+            connection.bulk_upsert,
+            "handler_test",
+            ["entry_id", "name", "value"],
+            rows,
+            ["value"],
+            chunk_size=1
+        )
+        assert (table_rows() == [(1, "a", 1.5), (2, "b", 2.5)])
+
+def create_connection(**kwargs):
+    return mysql_handler.Connection(
+        user=config.get("mysql username"),
+        password=config.get("mysql password"),
+        schema=config.get("mysql schema"),
+        host=config.get("mysql host"),
+        **kwargs
+    )
+
+def connection_id(pool):
+    return pool.query("SELECT CONNECTION_ID()")[0][0]
+
+class ConnectionPoolTests(unittest.TestCase):
+    def test_reused(self):
+        pool = create_connection(pool_size=2)
+        assert (connection_id(pool) == connection_id(pool))
+
+    def test_request(self):
+        pool = create_connection(pool_size=2)
+        with pool.request():
+            first = connection_id(pool)
+            result = []
+            thread = threading.Thread(target=lambda: result.append(connection_id(pool)))
+            thread.start()
+            thread.join()
+            assert (connection_id(pool) == first)
+            assert (result[0] != first)  # Other threads cannot use the request's connection
+
+    def test_bounded(self):
+        pool = create_connection(pool_size=1, pool_timeout=0.1)
+        with pool.request():
+            result = []
+
+            def query():
+                try:
+                    pool.query("SELECT 1")
+                except mysql_handler.PoolTimeoutError:
+                    result.append(True)
+
+            thread = threading.Thread(target=query)
+            thread.start()
+            thread.join()
+            assert (result == [True])
+
+        assert (pool.query("SELECT 1") == [(1,)])  # Available again once the request has finished
+
+    def test_threads(self):
+        pool = create_connection(pool_size=3)
+        results = []
+
+        def query(i):
+            for j in range(20):
+                results.append(pool.query(f"SELECT {i * 100 + j}")[0][0] == i * 100 + j)
+
+        threads = [threading.Thread(target=query, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert (len(results) == 120 and all(results))
+
+    def test_recycled(self):
+        pool = create_connection(pool_size=2, recycle_time=0)
+        assert (connection_id(pool) != connection_id(pool))
+
+    def test_error_keeps_connection(self):
+        pool = create_connection(pool_size=1, pool_timeout=0.1)
+        self.assertRaises(mysql.connector.Error, pool.query, "SELECT * FROM missing_table")
+        assert (pool.query("SELECT 1") == [(1,)])
+
+    def test_failed_ping_closes_connection(self):
+        pool = create_connection(pool_size=1, health_check_interval=0)
+        pool.query("SELECT 1")
+        broken = pool._idle[0][0]
+
+        def ping(**kwargs):
+            raise mysql.connector.InterfaceError("Lost connection to MySQL server")
+
+        broken.ping = ping
+        self.assertRaises(mysql.connector.InterfaceError, pool.query, "SELECT 1")
+        assert (not broken.is_connected())
+        assert (broken not in pool._statements)
+        assert (pool.query("SELECT 1") == [(1,)])  # Another connection is created in its place
+
+class PreparedStatementTests(HandlerTableTests):
+    def test_params(self):
+        assert (connection.query("SELECT name FROM handler_test WHERE entry_id=%s", (2,)) == [("b",)])
+
+    def test_values_not_executed(self):
+        connection.query("INSERT INTO handler_test (entry_id, name, value) VALUES (%s, %s, %s)", (3, "'); --", 3.5))
+        assert (connection.query("SELECT name FROM handler_test WHERE entry_id=%s", (3,)) == [("'); --",)])
+        assert (len(table_rows()) == 3)
+
+    def test_reused(self):
+        query = "SELECT entry_id FROM handler_test WHERE value>%s ORDER BY entry_id"
+        assert (connection.query(query, (0,)) == [(1,), (2,)])
+        assert (connection.query(query, (2,)) == [(2,)])
+        assert (connection.query(query, (3,)) == [])
+
+    def test_evicted(self):
+        pool = create_connection(pool_size=1, statement_cache_size=1)
+        for i in range(3):
+            assert (pool.query("SELECT name FROM handler_test WHERE entry_id=%s", (1,)) == [("a",)])
+            assert (pool.query("SELECT entry_id FROM handler_test WHERE name=%s", ("b",)) == [(2,)])
+
+    def test_recycled(self):
+        pool = create_connection(pool_size=1, recycle_time=0)
+        assert (pool.query("SELECT name FROM handler_test WHERE entry_id=%s", (1,)) == [("a",)])
+        assert (pool.query("SELECT name FROM handler_test WHERE entry_id=%s", (2,)) == [("b",)])  # The statement
+        # has to be prepared again on the new connection
+
+class StreamTests(HandlerTableTests):
+    def test_rows(self):
+        rows = connection.stream("SELECT entry_id, name, value FROM handler_test ORDER BY entry_id", batch_size=1)
+        assert (list(rows) == [(1, "a", 1.5), (2, "b", 2.5)])
+
+    def test_params(self):
+        assert (list(connection.stream("SELECT name FROM handler_test WHERE entry_id=%s", (2,))) == [("b",)])
+
+    def test_empty(self):
+        assert (list(connection.stream("SELECT name FROM handler_test WHERE entry_id=3")) == [])
+
+    def test_stopped_early(self):
+        pool = create_connection(pool_size=1)
+        with pool.request():
+            rows = pool.stream("SELECT entry_id FROM handler_test ORDER BY entry_id", batch_size=1)
+            assert (next(rows) == (1,))
+            rows.close()
+            assert (pool.query("SELECT name FROM handler_test WHERE entry_id=%s", (1,)) == [("a",)])  # The rest of
+            # the rows have been read, so the connection can be used again
+
+class QueryStatisticsTests(HandlerTableTests):
+    def test_normalise(self):
+        assert (mysql_handler.normalise_query("SELECT name FROM handler_test WHERE entry_id=1;") == "SELECT name FROM handler_test WHERE entry_id=?")
+        assert (mysql_handler.normalise_query("SELECT name\n    FROM handler_test WHERE name='a'") == "SELECT name FROM handler_test WHERE name=?")
+        assert (mysql_handler.normalise_query("DELETE FROM handler_test WHERE entry_id IN (%s, %s,%s)") == "DELETE FROM handler_test WHERE entry_id IN (?)")
+
+    def test_counted(self):
+        pool = create_connection(pool_size=1)
+        for i in range(3):
+            pool.query("SELECT name FROM handler_test WHERE entry_id=%s", (i,))
+        pool.query("SELECT name FROM handler_test")
+
+        queries = {i["query"]: i for i in pool.query_statistics()["queries"]}
+        assert (queries["SELECT name FROM handler_test WHERE entry_id=?"]["count"] == 3)
+        assert (queries["SELECT name FROM handler_test WHERE entry_id=?"]["rows"] == 2)
+        assert (queries["SELECT name FROM handler_test"]["rows"] == 2)
+        assert (all(0 <= i["p50"] <= i["p99"] <= i["total_time"] for i in queries.values()))
+
+    def test_slow_queries(self):
+        pool = create_connection(pool_size=1, slow_query_time=0.05)
+        pool.query("SELECT 1")
+        pool.query("SELECT SLEEP(0.1)")
+        slow_queries = pool.query_statistics()["slow_queries"]
+        assert (len(slow_queries) == 1 and slow_queries[0]["query"] == "SELECT SLEEP(0.1)")
+
+    def test_requests(self):
+        pool = create_connection(pool_size=1)
+        with pool.request("first"):
+            pool.query("SELECT 1")
+            list(pool.stream("SELECT name FROM handler_test"))
+        pool.query("SELECT 2")  # Not part of a request
+
+        requests = pool.query_statistics()["requests"]
+        assert (len(requests) == 1 and requests[0]["name"] == "first" and requests[0]["count"] == 2)
+
+    def test_reset(self):
+        pool = create_connection(pool_size=1, slow_query_time=0)
+        with pool.request():
+            pool.query("SELECT 1")
+        pool.reset_statistics()
+        assert (pool.query_statistics() == {"queries": [], "slow_queries": [], "requests": []})
+
+class TransactionTests(HandlerTableTests):
+    def test_committed(self):
+        pool = create_connection(pool_size=2)
+        with pool.transaction():
+            pool.query("INSERT INTO handler_test (entry_id, name, value) VALUES (%s, %s, %s)", (3, "c", 3.5))
+            assert (len(table_rows()) == 2)  # Not visible to other connections until it is committed
+        assert (len(table_rows()) == 3)
+
+    def test_rolled_back(self):
+        def add_entries():
+            with connection.transaction():
+                connection.query("INSERT INTO handler_test (entry_id, name, value) VALUES (%s, %s, %s)", (3, "c", 3.5))
+                connection.query("INSERT INTO handler_test (entry_id, name, value) VALUES (%s, %s, %s)", (1, "d", 4.5))
+
+        self.assertRaises(mysql.connector.Error, add_entries)  # Duplicate primary key
+        assert (table_rows() == [(1, "a", 1.5), (2, "b", 2.5)])
+
+    def test_nested(self):
+        def replace_entries():
+            with connection.transaction():
+                connection.bulk_replace("handler_test", ["entry_id", "name", "value"], [(3, "c", 3.5)])
+                raise ValueError()
+
+        self.assertRaises(ValueError, replace_entries)
+        assert (table_rows() == [(1, "a", 1.5), (2, "b", 2.5)])  # The inner transaction is part of the outer one
+
+    def test_request(self):
+        pool = create_connection(pool_size=1, pool_timeout=0.1)
+        with pool.request():
+            with pool.transaction():  # Uses the request's connection, rather than waiting for another
+                pool.query("DELETE FROM handler_test WHERE entry_id=%s", (1,))
+            assert (pool.query("SELECT entry_id FROM handler_test") == [(2,)])
+
+class GatherTests(unittest.TestCase):
+    def test_results(self):
+        pool = create_connection(pool_size=3)
+        assert (pool.gather(lambda: pool.query("SELECT 1"), lambda: pool.query("SELECT 2"), lambda: 3) == [[(1,)], [(2,)], 3])
+
+    def test_concurrent(self):
+        pool = create_connection(pool_size=3)
+        start_time = time.perf_counter()
+        pool.gather(*[lambda: pool.query("SELECT SLEEP(0.2)") for i in range(3)])
+        assert (time.perf_counter() - start_time < 0.4)
+
+    def test_separate_connections(self):
+        pool = create_connection(pool_size=2)
+        with pool.request():
+            first = connection_id(pool)
+            ids = pool.gather(lambda: connection_id(pool), lambda: connection_id(pool))
+            assert (ids[0] == first and ids[1] != first)
+
+    def test_pool_full(self):
+        pool = create_connection(pool_size=1, pool_timeout=0.1)
+        with pool.request():  # Uses the only connection, so the functions are called by this thread
+            assert (pool.gather(lambda: connection_id(pool), lambda: connection_id(pool)) == [connection_id(pool)] * 2)
+
+    def test_error(self):
+        pool = create_connection(pool_size=2, pool_timeout=0.1)
+        self.assertRaises(
+            mysql.connector.Error,
+            pool.gather,
+            lambda: pool.query("SELECT 1"),
+            lambda: pool.query("SELECT * FROM missing_table")
+        )
+        assert (pool.gather(lambda: pool.query("SELECT 1"), lambda: pool.query("SELECT 2")) == [[(1,)], [(2,)]])  # The
+        # connections have been returned
+
+    def test_recorded(self):
+        pool = create_connection(pool_size=2)
+        with pool.request("gather"):
+            pool.gather(lambda: pool.query("SELECT 1"), lambda: pool.query("SELECT 2"))
+        assert (pool.query_statistics()["requests"][0]["count"] == 2)
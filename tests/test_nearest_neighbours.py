@@ -0,0 +1,178 @@
+# python3 -m unittest -v test_nearest_neighbours.py
+import unittest
+import tempfile
+import sys
+import os
+
+import numpy as np
+
+sys.path.append("/".join(os.getcwd().split("/")[:-1]) + "/backend/")
+
+import nearest_neighbours
+
+def brute_force(ids, vectors, item_id, number):
+    vectors = nearest_neighbours.normalise_rows(vectors)
+    target = vectors[list(ids).index(item_id)]
+    scores = sorted(
+        ((-float(target.dot(vector)), i) for i, vector in zip(ids, vectors) if i != item_id)
+    )  # Most similar first, then in order of id
+    return [i for _, i in scores[:number]]
+
+class SimilarityIndexTest(unittest.TestCase):
+    def setUp(self):
+        generator = np.random.default_rng(5)
+        self.ids = generator.permutation(np.arange(1, 201)) * 3  # Not in order, and not the row numbers
+        self.vectors = generator.random((200, 12)) * (generator.random((200, 12)) > 0.6)  # Sparse, like genres
+
+    def test_matches_brute_force(self):
+        index = nearest_neighbours.SimilarityIndex(self.ids, self.vectors, 10)
+        for i in self.ids[:50]:
+            assert (index.get_neighbours(i) == brute_force(self.ids, self.vectors, i, 10))
+
+    def test_batched(self):
+        original = nearest_neighbours.SIMILARITY_BATCH_SIZE
+        nearest_neighbours.SIMILARITY_BATCH_SIZE = 1000  # 5 rows at a time
+        try:
+            batched = nearest_neighbours.SimilarityIndex(self.ids, self.vectors, 10)
+        finally:
+            nearest_neighbours.SIMILARITY_BATCH_SIZE = original
+
+        index = nearest_neighbours.SimilarityIndex(self.ids, self.vectors, 10)
+        assert (np.array_equal(batched.neighbours, index.neighbours))
+
+    def test_ties_by_id(self):
+        vectors = [[1, 0], [1, 0], [1, 0], [1, 0], [0, 1]]
+        index = nearest_neighbours.SimilarityIndex([9, 4, 7, 2, 5], vectors, 2)
+
+        assert (index.get_neighbours(9) == [2, 4])
+        assert (index.get_neighbours(2) == [4, 7])
+
+    def test_not_own_neighbour(self):
+        index = nearest_neighbours.SimilarityIndex(self.ids, self.vectors, 10)
+        for i in self.ids:
+            assert (i not in index.get_neighbours(i))
+
+    def test_fewer_items(self):
+        index = nearest_neighbours.SimilarityIndex([1, 2, 3], [[1, 0], [1, 1], [0, 1]], 10)
+
+        assert (index.get_neighbours(2) == [1, 3])
+        assert (index.get_neighbours(1, number=1) == [2])
+
+    def test_zero_vector(self):
+        index = nearest_neighbours.SimilarityIndex([1, 2, 3], [[0, 0], [1, 1], [0, 1]], 2)
+
+        assert (index.get_neighbours(1) == [2, 3])  # All similarities are 0
+        assert (not np.isnan(index.similarities).any())
+
+    def test_unknown_id(self):
+        index = nearest_neighbours.SimilarityIndex(self.ids, self.vectors, 10)
+
+        assert (1 not in index)
+        self.assertRaises(KeyError, index.get_neighbours, 1)
+
+    def test_save_load(self):
+        index = nearest_neighbours.SimilarityIndex(self.ids, self.vectors, 10)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.npz")
+            index.save(path)
+            loaded = nearest_neighbours.SimilarityIndex.load(path, 10)
+
+        assert (np.array_equal(loaded.neighbours, index.neighbours))
+        assert (all(loaded.get_neighbours(i) == index.get_neighbours(i) for i in self.ids))
+
+    def test_load_invalid(self):
+        index = nearest_neighbours.SimilarityIndex(self.ids, self.vectors, 10)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.npz")
+            assert (nearest_neighbours.SimilarityIndex.load(path, 10) is None)  # No file
+
+            index.save(path)
+            assert (nearest_neighbours.SimilarityIndex.load(path, 5) is None)  # Different number of neighbours
+
+            original = nearest_neighbours.INDEX_FILE_VERSION
+            nearest_neighbours.INDEX_FILE_VERSION = original + 1
+            try:
+                assert (nearest_neighbours.SimilarityIndex.load(path, 10) is None)
+            finally:
+                nearest_neighbours.INDEX_FILE_VERSION = original
+
+
+class TopIndexesTest(unittest.TestCase):
+    def test_matches_sort(self):
+        scores = np.random.random((20, 50))
+        indexes, top_scores = nearest_neighbours.top_indexes(scores, 10)
+
+        assert (np.array_equal(indexes, np.argsort(-scores, axis=1)[:, :10]))
+        assert (np.array_equal(top_scores, -np.sort(-scores, axis=1)[:, :10]))
+
+    def test_ties_by_column(self):
+        scores = np.array([[1, 3, 3, 2, 3], [0, 0, 0, 0, 0]], dtype=np.float64)
+        indexes = nearest_neighbours.top_indexes(scores, 2)[0]
+
+        assert (indexes.tolist() == [[1, 2], [0, 1]])
+
+    def test_excluded(self):
+        scores = np.array([[1, -np.inf, 2, -np.inf]])
+        indexes = nearest_neighbours.top_indexes(scores, 5)[0]
+
+        assert (indexes.tolist() == [[2, 0, -1, -1, -1]])
+
+
+class EngineTest(unittest.TestCase):
+    def setUp(self):
+        generator = np.random.default_rng(3)
+        self.vectors = nearest_neighbours.normalise_rows(generator.random((300, 8)))
+        self.queries = generator.random((20, 8))
+
+    def test_exact_excluded(self):
+        engine = nearest_neighbours.create_engine("exact", self.vectors)
+        indexes = engine.search(self.queries, 5)[0]
+        excluded_indexes = engine.search(self.queries, 5, excluded=indexes[:, :2])[0]
+
+        assert (np.array_equal(excluded_indexes[:, :3], indexes[:, 2:]))
+
+    def test_ivf_every_list(self):
+        exact = nearest_neighbours.create_engine("exact", self.vectors)
+        ivf = nearest_neighbours.create_engine("ivf", self.vectors, number_lists=10, number_probes=10)
+
+        for excluded in (None, [[i] for i in range(len(self.queries))]):
+            assert (np.array_equal(
+                ivf.search(self.queries, 5, excluded=excluded)[0],
+                exact.search(self.queries, 5, excluded=excluded)[0]
+            ))  # Searching every list is the same as comparing with every vector
+
+    def test_ivf_lists(self):
+        ivf = nearest_neighbours.create_engine("ivf", self.vectors, number_probes=2)
+
+        assert (len(ivf.centroids) == 17)  # Square root of the number of vectors
+        assert (ivf.number_probes == 2)
+        assert (len(ivf.assignments) == 300 and ivf.assignments.max() < 17)  # Every vector is in one of the lists
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, nearest_neighbours.create_engine, "unknown", self.vectors)
+
+    def test_ivf_similarity_index(self):
+        ids = np.arange(1, 301)
+        exact = nearest_neighbours.SimilarityIndex(ids, self.vectors, 10)
+        ivf = nearest_neighbours.SimilarityIndex(ids, self.vectors, 10, "ivf", {"number_probes": 4})
+
+        found = [len(set(ivf.get_neighbours(i)) & set(exact.get_neighbours(i))) for i in ids]
+        assert (sum(found) / (len(ids) * 10) > 0.5)  # Approximate, but should find most of them
+
+    def test_ivf_save_load(self):
+        options = {"number_lists": 10, "number_probes": 3}
+        index = nearest_neighbours.SimilarityIndex(np.arange(300), self.vectors, 10, "ivf", options)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.npz")
+            index.save(path)
+            loaded = nearest_neighbours.SimilarityIndex.load(path, 10, "ivf", options)
+
+            assert (nearest_neighbours.SimilarityIndex.load(path, 10) is None)  # Different engine
+            assert (nearest_neighbours.SimilarityIndex.load(path, 10, "ivf", {"number_probes": 3}) is None)
+
+        assert (np.array_equal(loaded.engine.centroids, index.engine.centroids))  # Not clustered again
+        assert (np.array_equal(loaded.neighbours, index.neighbours))
+        assert (np.array_equal(
+            loaded.engine.search(self.queries, 5)[0],
+            index.engine.search(self.queries, 5)[0]
+        ))
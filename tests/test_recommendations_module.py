@@ -1,7 +1,13 @@
+import math
+import time
+import tempfile
 import unittest
 import sys
 import os
 
+import numpy as np
+import scipy.sparse
+
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
 
 import components.recommendations
@@ -34,6 +40,86 @@ recommendations = components.recommendations.Recommendations(
     config.get("recommendations number_recommendations"),
 )
 
+def per_user_review_matrix(model):
+    # The review matrix as it was generated before the signals were loaded in bulk - the same queries, for one user at a
+    # time. It is used as the reference that the bulk version must match exactly.
+    mat = np.zeros((len(model.user_lookup_table), len(model.book_lookup_table)))
+    for user in model.user_lookup_table:
+        user_id = model.user_lookup_table[user]
+        reviews = connection.query("""
+            SELECT book_id,
+                (overall_rating + IFNULL(character_rating, overall_rating) + IFNULL(plot_rating, overall_rating)) / 3
+            FROM reviews
+            WHERE user_id={}
+            GROUP BY review_id;
+        """.format(user_id))
+
+        for book_id, rating in reviews:
+            mat[user][model.book_lookup_table.get_index(book_id)] = float(rating)
+
+        books = connection.query("""
+            SELECT books.book_id
+            FROM initial_preferences
+            INNER JOIN books
+                ON books.author_id=initial_preferences.author_id
+            WHERE initial_preferences.user_id={}
+            GROUP BY books.book_id
+        """.format(user_id))
+
+        if len(reviews) <= config.get("recommendations minimum_required_reviews"):
+            if len(books):
+                for i in books:
+                    mat[user][model.book_lookup_table.get_index(i[0])] += config.get("recommendations inital_recommendation_matrix_value")
+            else:
+                continue
+
+        lists = connection.query("""
+            SELECT reading_lists.book_id
+            FROM reading_lists
+            INNER JOIN reading_list_names
+                ON reading_lists.list_id=reading_list_names.list_id
+            WHERE reading_lists.user_id={}
+            GROUP BY reading_lists.book_id;
+        """.format(user_id))
+
+        for i in lists:
+            used_book_id = model.book_lookup_table.get_index(i[0])
+            if mat[user][used_book_id] == 0:
+                mat[user][used_book_id] = config.get("recommendations inital_recommendation_matrix_value")
+            else:
+                mat[user][used_book_id] *= (1 + config.get("recommendations reading_list_percentage_increase"))
+
+        following = connection.query("""
+            SELECT books.book_id
+            FROM author_followers
+            INNER JOIN books
+                ON books.author_id=author_followers.author_id
+            WHERE user_id={}
+        """.format(user_id))
+
+        for i in following:
+            used_book_id = model.book_lookup_table.get_index(i[0])
+            if mat[user][used_book_id] == 0:
+                mat[user][used_book_id] = config.get("recommendations inital_recommendation_matrix_value")
+            else:
+                mat[user][used_book_id] *= (1 + config.get("recommendations author_following_percentage_increase"))
+
+        for book in model.get_bad_recommendations(user_id):
+            mat[user][model.book_lookup_table.get_index(book)] = config.get("recommendations bad_recommendations_matrix_value")
+
+        entries = connection.query("""
+            SELECT book_id,
+                (SUM(overall_rating) + SUM(IFNULL(character_rating, overall_rating)) + SUM(IFNULL(plot_rating, overall_rating))) / (COUNT(entry_id) * 3)
+            FROM diary_entries
+            WHERE user_id={}
+            GROUP BY book_id;
+        """.format(user_id))
+
+        for book_id, rating in entries:
+            mat[user][model.book_lookup_table.get_index(book_id)] += float(rating)
+
+    return mat
+
 class RecommendationTests(unittest.TestCase):
     def test_bad_recommendations(self):
         assert (recommendations.get_bad_recommendations(1) == [3, 5])
@@ -63,6 +149,14 @@ class RecommendationTests(unittest.TestCase):
             5
         )
 
+    def test_add_user_no_authors(self):
+        assert (recommendations.add_user(5, []) is None)
+        self.assertRaises(
+            components.recommendations.NoUserPreferencesError,
+            recommendations.get_user_recommendations,
+            5
+        )  # preferences_set is left false
+
     def test_get_summaries(self):
         exp = [{'author': 'Author 1', 'title': 'Book 1', 'book_id': 1, 'cover': ''}, {'author': 'Author 2', 'title': 'Book 2', 'book_id': 2, 'cover': ''}]
         assert (recommendations.get_user_recommendation_summaries(1) == exp)
@@ -81,6 +175,233 @@ class RecommendationTests(unittest.TestCase):
     def test_get_summaries_unknown(self):
         assert (recommendations.get_user_recommendation_summaries(400) == [])
 
+def create_sparse_recommendations(**kwargs):
+    return components.recommendations.Recommendations(
+        connection,
+        config.get("recommendations number_converge_iterations"),
+        config.get("recommendations hyperparameter"),
+        config.get("number_display_genres"),
+        config.get("recommendations inital_recommendation_matrix_value"),
+        config.get("recommendations reading_list_percentage_increase"),
+        config.get("recommendations author_following_percentage_increase"),
+        config.get("recommendations bad_recommendations_matrix_value"),
+        config.get("recommendations minimum_required_reviews"),
+        config.get("recommendations number_recommendations"),
+        dense_matrix_limit=0,  # Always use the sparse matrix, even for the small test data
+        **kwargs
+    )
+
+class ReviewMatrixTests(unittest.TestCase):
+    def test_matches_per_user(self):
+        expected = per_user_review_matrix(recommendations)
+        assert (np.array_equal(recommendations.gen_review_matrix(), expected))
+
+    def test_sparse_matches_dense(self):
+        sparse = create_sparse_recommendations().gen_review_matrix()
+        assert (scipy.sparse.issparse(sparse))
+        assert (np.array_equal(sparse.toarray(), recommendations.gen_review_matrix()))
+
+    def test_sparse_train_test(self):
+        model = create_sparse_recommendations()
+        train, test = model.create_train_test()
+        assert (train.nnz < test.nnz)
+        assert (np.all(test.toarray()[train.toarray() != 0] == train.toarray()[train.toarray() != 0]))
+
+    def test_sparse_mean_squared_error(self):
+        model = create_sparse_recommendations()
+        ratings = model.gen_review_matrix()
+        model.user_factors = np.random.random((ratings.shape[0], model.book_factors.shape[1]))
+        expected = components.recommendations.Recommendations.mean_squared_error(ratings.toarray(), model.predict())
+        assert (math.isclose(model.rated_mean_squared_error(ratings), expected))
+        assert (math.isclose(model.mean_squared_error(ratings, model.predict()), expected))
+
+    def test_all_bad_recommendations(self):
+        bad_recommendations = recommendations.get_all_bad_recommendations()
+        for user_id in [1, 2, 3, 400]:
+            assert (bad_recommendations.get(user_id, []) == recommendations.get_bad_recommendations(user_id))
+
+        assert (set(recommendations.get_all_bad_recommendations([2])) <= {2})
+
+class WalsStepTests(unittest.TestCase):
+    def test_step_matches_inverse(self):
+        ratings = scipy.sparse.random(20, 30, density=0.2, format="csr") * 5
+        fixed = np.random.random((30, recommendations.book_factors.shape[1]))
+
+        A = fixed.T.dot(fixed) + np.eye(fixed.shape[1]) * config.get("recommendations hyperparameter")
+        expected = ratings.dot(fixed).dot(np.linalg.inv(A))
+
+        assert (np.allclose(recommendations.wals_step(ratings, fixed), expected))
+
+    def test_weighted_step_matches_full_solve(self):
+        ratings = scipy.sparse.random(20, 30, density=0.2, format="csr") * 5
+        fixed = np.random.random((30, recommendations.book_factors.shape[1]))
+        result = recommendations.weighted_wals_step(ratings, fixed)
+
+        dense = ratings.toarray()
+        for user in range(20):
+            confidence = np.diag(1 + components.recommendations.DEFAULT_CONFIDENCE_WEIGHT * dense[user])
+            A = fixed.T.dot(confidence).dot(fixed) + np.eye(fixed.shape[1]) * config.get("recommendations hyperparameter")
+            expected = np.linalg.solve(A, fixed.T.dot(confidence).dot(dense[user]))
+            assert (np.allclose(result[user], expected))
+
+    def test_parallel_step_matches_serial(self):
+        ratings = scipy.sparse.random(200, 300, density=0.05, format="csr") * 5
+        ratings_t = ratings.T.tocsr()
+        book_factors = np.random.random((300, recommendations.book_factors.shape[1]))
+        user_factors = np.random.random((200, recommendations.book_factors.shape[1]))
+
+        with components.recommendations.ParallelWeightedSolver(
+                (ratings, ratings_t),
+                recommendations.book_factors.shape[1],
+                config.get("recommendations hyperparameter"),
+                components.recommendations.DEFAULT_CONFIDENCE_WEIGHT,
+                workers=2) as solver:
+            assert (np.allclose(
+                solver.weighted_wals_step(ratings, book_factors),
+                recommendations.weighted_wals_step(ratings, book_factors)
+            ))
+            assert (np.allclose(
+                solver.weighted_wals_step(ratings_t, user_factors),
+                recommendations.weighted_wals_step(ratings_t, user_factors)
+            ))
+
+class ConvergenceMonitorTests(unittest.TestCase):
+    def test_loss_converges(self):
+        monitor = components.recommendations.ConvergenceMonitor(tolerance=0.01, patience=2)
+        factors = np.ones((2, 2))
+        assert (not monitor.update(factors, factors, 1.0))
+        assert (not monitor.update(factors, factors, 0.5))
+        assert (not monitor.update(factors, factors, 0.499))  # First iteration below the tolerance
+        assert (monitor.update(factors, factors, 0.498))
+
+    def test_patience_resets(self):
+        monitor = components.recommendations.ConvergenceMonitor(tolerance=0.01, patience=2)
+        factors = np.ones((2, 2))
+        for loss in [1.0, 0.999, 0.5, 0.499]:
+            assert (not monitor.update(factors, factors, loss))
+
+    def test_factors_converge(self):
+        monitor = components.recommendations.ConvergenceMonitor(tolerance=0.01, patience=1, criterion="factors")
+        assert (not monitor.update(np.ones((2, 2)), np.ones((3, 2))))
+        assert (not monitor.update(np.ones((2, 2)) * 2, np.ones((3, 2))))
+        assert (monitor.update(np.ones((2, 2)) * 2.001, np.ones((3, 2))))
+
+    def test_never_converges(self):
+        monitor = components.recommendations.ConvergenceMonitor()
+        factors = np.ones((2, 2))
+        for i in range(10):
+            assert (not monitor.update(factors, factors, 1.0))
+
+    def test_max_time(self):
+        monitor = components.recommendations.ConvergenceMonitor(max_time=0.01)
+        time.sleep(0.02)
+        assert (monitor.update(np.ones((2, 2)), np.ones((2, 2)), 1.0))
+
+    def test_unknown_criterion(self):
+        self.assertRaises(
+            ValueError,
+            components.recommendations.ConvergenceMonitor,
+            criterion="unknown"
+        )
+
+class FactorPersistenceTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "factors.npz")
+        self.model = create_sparse_recommendations(factors_path=self.path)
+        self.model.user_factors = np.random.random((len(self.model.user_lookup_table), self.model.book_factors.shape[1]))
+        self.model.book_factors = np.random.random(self.model.book_factors.shape)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        self.model.save_factors()
+        user_factors = self.model.user_factors.copy()
+        book_factors = self.model.book_factors.copy()
+
+        self.model.user_factors = np.zeros(user_factors.shape)
+        self.model.book_factors = np.zeros(book_factors.shape)
+        assert (self.model.load_factors())
+        assert (np.array_equal(self.model.user_factors, user_factors))
+        assert (np.array_equal(self.model.book_factors, book_factors))
+
+    def test_new_ids_unchanged(self):
+        # Saved as though the first user did not exist in the previous fit
+        np.savez(
+            self.path,
+            version=components.recommendations.FACTORS_FILE_VERSION,
+            user_ids=self.model.user_lookup_table.ids[1:],
+            book_ids=self.model.book_lookup_table.ids,
+            genre_ids=self.model.genre_lookup_table.ids,
+            user_factors=self.model.user_factors[1:] + 1,
+            book_factors=self.model.book_factors
+        )
+        user_factors = self.model.user_factors.copy()
+        assert (self.model.load_factors())
+        assert (np.array_equal(self.model.user_factors[0], user_factors[0]))
+        assert (np.array_equal(self.model.user_factors[1:], user_factors[1:] + 1))
+
+    def test_changed_genres_ignored(self):
+        np.savez(
+            self.path,
+            version=components.recommendations.FACTORS_FILE_VERSION,
+            user_ids=self.model.user_lookup_table.ids,
+            book_ids=self.model.book_lookup_table.ids,
+            genre_ids=self.model.genre_lookup_table.ids[1:],
+            user_factors=self.model.user_factors[:, 1:],
+            book_factors=self.model.book_factors[:, 1:]
+        )
+        assert (not self.model.load_factors())
+
+    def test_no_file(self):
+        assert (not self.model.load_factors())
+        assert (not create_sparse_recommendations().load_factors())
+
+class FoldInTests(unittest.TestCase):
+    def test_matches_step(self):
+        model = create_sparse_recommendations()
+        ratings = model.gen_review_matrix()
+        expected = model.wals_step(ratings, model.book_factors)
+
+        for user in range(ratings.shape[0]):
+            row = ratings.getrow(user)
+            user_id = model.user_lookup_table[user]
+            book_ids = model.book_lookup_table.get_ids(row.indices)
+            user_vec = model.fold_in_user(user_id, dict(zip(book_ids, row.data)))
+            assert (np.allclose(user_vec, expected[user]))
+            assert (np.array_equal(model.user_factors[user], user_vec))
+
+    def test_weighted_matches_step(self):
+        model = create_sparse_recommendations(weighted=True)
+        ratings = model.gen_review_matrix()
+        expected = model.weighted_wals_step(ratings, model.book_factors)
+
+        row = ratings.getrow(0)
+        book_ids = model.book_lookup_table.get_ids(row.indices)
+        assert (np.allclose(model.fold_in_user(model.user_lookup_table[0], dict(zip(book_ids, row.data))), expected[0]))
+
+    def test_unknown_user(self):
+        model = create_sparse_recommendations()
+        user_factors = model.user_factors.copy()
+        user_vec = model.fold_in_user(400, {model.book_lookup_table[0]: 1, 400: 1})
+        assert (user_vec.shape == (model.book_factors.shape[1],))
+        assert (np.array_equal(model.user_factors, user_factors))
+
+class ExcludedBooksTests(unittest.TestCase):
+    def test_excluded_books(self):
+        excluded = recommendations.load_excluded_books()
+        assert (excluded.shape == (len(recommendations.user_lookup_table), len(recommendations.book_lookup_table)))
+        for user_id in [1, 2, 3]:
+            user = recommendations.user_lookup_table.get_index(user_id)
+            book_ids = set(recommendations.book_lookup_table.get_ids(excluded[user].indices))
+            assert (set(recommendations.get_bad_recommendations(user_id)).issubset(book_ids))
+
+    def test_zero_certainty(self):
+        book_id = recommendations.book_lookup_table[0]
+        user_vec = np.zeros(recommendations.book_factors.shape[1])
+        assert (recommendations.calculate_certainty(book_id, None, 0.0, user_vec) == 0)
+
 def fit():
     input("Press enter to proceed")
     print("Check addition of new genres")
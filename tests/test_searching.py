@@ -1,4 +1,5 @@
 import unittest
+import tempfile
 import sys
 import os
 
@@ -186,6 +187,90 @@ class SearchingTest(unittest.TestCase):
     def test_book_unknown(self):
         assert (information_retrieval.database_search("An arbitrary book's title") == dict())
 
+    def test_inverted_index(self):
+        for word, postings in information_retrieval.inverted_index.items():
+            assert ([i[0] for i in postings] == sorted({i[0] for i in postings}))  # In order, with no repeats
+            for position, tf in postings:
+                document = information_retrieval._documents_dict[position]
+                assert (word in document["words"].split(" "))
+                assert (tf == document["tf"][word])
+
+    def test_sparse_backend(self):
+        sparse = components.information_retrieval.DocumentCollection(
+            connection,
+            books,
+            authors,
+            genres,
+            config.get("search number_results"),
+            backend="sparse"
+        )
+        for search in ("Kristin Hannah", "Genre 1", "Jennifer Armentrout"):
+            result = sparse.tfidf_search(search)
+            expected = information_retrieval.tfidf_search(search)[0]
+            assert ((result[0]["type"], result[0]["id"]) == (expected["type"], expected["id"]))  # Exact matches are
+            # first with both backends, although the similarities are not the same
+            assert ([i["similarity"] for i in result] == sorted([i["similarity"] for i in result], reverse=True))
+
+        assert (sparse.tfidf_search("Arbitrary writer") == [])
+
+    def test_mapped_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "search_index.bin")
+            saved = components.information_retrieval.DocumentCollection(
+                connection,
+                books,
+                authors,
+                genres,
+                config.get("search number_results"),
+                index_path=path
+            )  # There is no file yet, so the documents are loaded from the database
+            assert (saved.mapped_index is None)
+            saved.refresh_search_index()
+
+            mapped = components.information_retrieval.DocumentCollection(
+                connection,
+                books,
+                authors,
+                genres,
+                config.get("search number_results"),
+                index_path=path
+            )
+            assert (mapped.mapped_index is not None)
+            for search in ("Kristin Hannah", "Genre 1", "Jennifer Armentrout", "Arbitrary writer"):
+                assert (mapped.tfidf_search(search) == saved.tfidf_search(search))
+
+            mapped.gen_tf_values()  # Needs the documents, so they are loaded in place of the mapped index
+            assert (mapped.mapped_index is None)
+
+            saved.refresh_search_index()  # Such as maintenance in another process
+            assert (mapped.mapped_index is not None)
+            assert (saved.mapped_index is None)  # Saved from its own documents, so they are kept
+            for search in ("Kristin Hannah", "Genre 1", "Jennifer Armentrout", "Arbitrary writer"):
+                assert (mapped.tfidf_search(search) == saved.tfidf_search(search))
+
+    def test_mapped_index_outdated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "search_index.bin")
+            components.information_retrieval.MappedSearchIndex.build([], dict()).save(path)
+
+            original = components.information_retrieval.INDEX_FILE_VERSION
+            components.information_retrieval.INDEX_FILE_VERSION = original + 1
+            try:
+                assert (components.information_retrieval.MappedSearchIndex.load(path) is None)
+                collection = components.information_retrieval.DocumentCollection(
+                    connection,
+                    books,
+                    authors,
+                    genres,
+                    config.get("search number_results"),
+                    index_path=path
+                )
+            finally:
+                components.information_retrieval.INDEX_FILE_VERSION = original
+
+        assert (collection.mapped_index is None)
+        assert (collection.tfidf_search("Kristin Hannah")[0] == information_retrieval.tfidf_search("Kristin Hannah")[0])
+
 def test_unique_words():
     input("Press enter to proceed")
     connection.query("DELETE FROM unique_words")